@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+from pathlib import Path
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from PIL import Image, ImageDraw, ImageFont
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+import instrument
+from extract_target_table_pdf import TABLE_TITLES, get_output_path
+from process_pages import run_report_jobs
+from raster_cache import PageRasterCache, open_page, upright
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+BASELINE_PATH = PROJECT_ROOT / "derived" / "benchmark-baseline.json"
+
+# Letter pages, in points; scanned fixtures are drawn at SCAN_DPI
+PAGE_SIZE = (612, 792)
+SCAN_DPI = 200
+
+# Render resolution of the pipeline's OCR steps
+RENDER_DPI = 300
+
+# Rows of a county table: a header row and one row per county
+N_COUNTIES = 64
+TABLE_HEADER = ["County", "Mill Levy", "Assessed Valuation", "Total Revenue", "Total Average Levy"]
+
+# Stage is reported slower than the baseline when its throughput drops by more than this share
+MAX_SLOWDOWN = 0.25
+
+# Tables in every synthetic report: crosswalk-style (directory, page offsets from the
+# end of the report, orientation). Rotated pages are printed sideways, so they take
+# a 270 degree counter-clockwise turn to read, as in the county valuation crosswalk
+TABLE_LAYOUT = [
+    ("bench-single", [-6], 0),
+    ("bench-rotated", [-4], 270),
+    ("bench-span", [-3, -2], 0),
+]
+
+def table_rows(rng, n_rows=N_COUNTIES):
+    """Generate a county table with plausible values: header row first."""
+    rows = [TABLE_HEADER]
+    for i in range(1, n_rows + 1):
+        valuation = rng.randint(2_000_000, 900_000_000)
+        county_levy = rng.uniform(2, 40)
+        total_levy = county_levy + rng.uniform(20, 90)
+        rows.append([
+            f"County {i:02d}",
+            f"{county_levy:.3f}",
+            f"${valuation:,}",
+            f"${valuation * total_levy / 1000:,.0f}",
+            f"{total_levy:.3f}",
+        ])
+    return rows
+
+def filler_lines(rng, n_lines=40):
+    """Generate report prose for pages without a table."""
+    words = ["assessed", "property", "valuation", "county", "district", "levy", "school",
+             "the", "of", "and", "for", "division", "report", "taxable", "annual"]
+    return [" ".join(rng.choice(words) for _ in range(12)) for _ in range(n_lines)]
+
+def page_tables(n_pages):
+    """
+    Place the tables of TABLE_LAYOUT in a report of n_pages pages.
+
+    Returns:
+        dict: Page number (1-indexed) -> orientation of the table on it
+    """
+    return {n_pages + 1 + offset: orientation
+            for _, offsets, orientation in TABLE_LAYOUT for offset in offsets}
+
+def _text_ops(lines, rotated, font_size=7, leading=10):
+    """Content stream drawing lines of cells; rotated pages run bottom to top, as a sideways table."""
+    width, height = PAGE_SIZE if not rotated else PAGE_SIZE[::-1]
+    ops = []
+    for i, cells in enumerate(lines):
+        v = height - 40 - i * leading
+        for j, cell in enumerate(cells):
+            u = 36 + j * (width - 72) / max(len(cells), 1)
+            text = str(cell).replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            if rotated:
+                # Upright (u, v) on the sideways page -> page space, text turned 90 degrees counter-clockwise
+                ops.append(f"BT /F1 {font_size} Tf 0 1 -1 0 {PAGE_SIZE[0] - v:.1f} {u:.1f} Tm ({text}) Tj ET")
+            else:
+                ops.append(f"BT /F1 {font_size} Tf 1 0 0 1 {u:.1f} {v:.1f} Tm ({text}) Tj ET")
+    return "\n".join(ops).encode()
+
+def make_text_report(pdf_path, n_pages, rng):
+    """Write a born-digital report: every page has a text layer."""
+    writer = PdfWriter()
+    tables = page_tables(n_pages)
+
+    for page_num in range(1, n_pages + 1):
+        page = writer.add_blank_page(*PAGE_SIZE)
+        if page_num in tables:
+            lines = [[TABLE_TITLES["mill-levies"]]] + table_rows(rng)
+            content = _text_ops(lines, rotated=bool(tables[page_num]))
+        else:
+            content = _text_ops([[line] for line in filler_lines(rng)], rotated=False, font_size=9, leading=14)
+
+        stream = DecodedStreamObject()
+        stream.set_data(content)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): DictionaryObject({
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            })})
+        })
+        page.replace_contents(stream)
+
+    with open(pdf_path, 'wb') as f:
+        writer.write(f)
+
+def _scan_image(lines, rotated, font, row_height):
+    """Draw lines of cells on a grayscale page image, sideways if rotated."""
+    width, height = (int(PAGE_SIZE[0] / 72 * SCAN_DPI), int(PAGE_SIZE[1] / 72 * SCAN_DPI))
+    if rotated:
+        width, height = height, width
+
+    img = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for i, cells in enumerate(lines):
+        y = SCAN_DPI // 2 + i * row_height
+        for j, cell in enumerate(cells):
+            x = SCAN_DPI // 2 + j * (width - SCAN_DPI) // max(len(cells), 1)
+            draw.text((x, y), str(cell), fill=0, font=font)
+
+    # Turning the upright image 90 degrees counter-clockwise leaves it needing 270 to read
+    return img.rotate(90, expand=True) if rotated else img
+
+def make_scan_report(pdf_path, n_pages, rng):
+    """Write a scanned report: every page is an image without a text layer."""
+    font = ImageFont.load_default(size=SCAN_DPI // 9)
+    tables = page_tables(n_pages)
+
+    images = []
+    for page_num in range(1, n_pages + 1):
+        if page_num in tables:
+            lines = [[TABLE_TITLES["mill-levies"]]] + table_rows(rng)
+            images.append(_scan_image(lines, bool(tables[page_num]), font, row_height=SCAN_DPI // 7))
+        else:
+            images.append(_scan_image([[line] for line in filler_lines(rng)], False, font, row_height=SCAN_DPI // 4))
+
+    images[0].save(pdf_path, save_all=True, append_images=images[1:], resolution=SCAN_DPI)
+
+def make_fixtures(work_dir, n_reports=2, n_pages=40, seed=0):
+    """
+    Generate synthetic annual reports, half born-digital and half scanned.
+
+    Scanned reports get years from 1971, born-digital ones from 2001, as in
+    the real collection. Each report holds the tables of TABLE_LAYOUT.
+
+    Returns:
+        list: Report dicts with pdf_path, year, kind ('text' or 'scan') and
+            jobs (page jobs as built by process_pages)
+    """
+    rng = random.Random(seed)
+    report_dir = Path(work_dir) / "reports"
+    report_dir.mkdir(exist_ok=True, parents=True)
+
+    reports = []
+    for i in range(n_reports):
+        kind = "scan" if i % 2 == 0 else "text"
+        year = str((1971 if kind == "scan" else 2001) + i // 2)
+        pdf_path = report_dir / f"{year} Annual Report.pdf"
+        (make_scan_report if kind == "scan" else make_text_report)(pdf_path, n_pages, rng)
+
+        jobs = []
+        for dir_name, offsets, orientation in TABLE_LAYOUT:
+            pages = [n_pages + 1 + offset for offset in offsets]
+            job = {"pdf_path": str(pdf_path), "year": year, "page_num": pages[0], "suffix": "",
+                   "dir_name": dir_name, "orientation": orientation, "crosswalk": "benchmark"}
+            if len(pages) > 1:
+                job["pages"] = [(page_num, orientation) for page_num in pages]
+            jobs.append(job)
+
+        reports.append({"pdf_path": pdf_path, "year": year, "kind": kind, "jobs": jobs})
+
+    return reports
+
+def job_pages(job):
+    """Page numbers a page job copies."""
+    return [page_num for page_num, _ in job["pages"]] if "pages" in job else [job["page_num"]]
+
+def missing_tools():
+    """Get the external tools the OCR stages need that are not installed."""
+    missing = [tool for tool in ("pdftoppm", "tesseract") if shutil.which(tool) is None]
+    if importlib.util.find_spec("pytesseract") is None:
+        missing.append("pytesseract")
+    return missing
+
+def check_table(table, label, n_pages=1):
+    """
+    Check that an extracted fixture table has its header and county rows in TABLE_HEADER's columns.
+
+    A table stitched from n_pages pages keeps one header row and the county rows of every page.
+    """
+    expected = (1 + N_COUNTIES * n_pages, len(TABLE_HEADER))
+    n_rows, n_cols = len(table), max((len(row) for row in table), default=0)
+    if (n_rows, n_cols) != expected:
+        raise RuntimeError(f"{label}: expected {expected[0]} rows x {expected[1]} columns, "
+                           f"got {n_rows} x {n_cols}")
+
+def stage_split(reports, work_dir):
+    """Copy every table page out of its report, one open report at a time."""
+    n_pages = 0
+    for report in reports:
+        results = run_report_jobs(report["jobs"])
+        failed = [r for r in results if r["status"] != "ok"]
+        if failed:
+            raise RuntimeError(f"Splitting {report['pdf_path'].name} failed: {failed[0]['error']}")
+        n_pages += sum(len(job_pages(job)) for job in report["jobs"])
+    return n_pages
+
+def stage_rasterize(reports, work_dir):
+    """Render the table pages of scanned reports into an empty raster cache."""
+    cache = PageRasterCache(cache_dir=Path(work_dir) / f"raster-cache-{time.monotonic_ns()}")
+    n_pages = 0
+    for report in reports:
+        if report["kind"] == "scan":
+            page_nums = [page_num for job in report["jobs"] for page_num in job_pages(job)]
+            n_pages += len(cache.render_pages(report["pdf_path"], page_nums, dpi=RENDER_DPI))
+    return n_pages
+
+def stage_ocr(reports, work_dir):
+    """OCR the rendered table pages of scanned reports into word boxes."""
+    from local_tables import ocr_words
+
+    cache = PageRasterCache(cache_dir=Path(work_dir) / "raster-cache-ocr")
+    n_pages = 0
+    for report in reports:
+        if report["kind"] != "scan":
+            continue
+        for job in report["jobs"]:
+            rendered = cache.render_pages(report["pdf_path"], job_pages(job), dpi=RENDER_DPI)
+            for png_path in rendered.values():
+                ocr_words(upright(open_page(png_path), job["orientation"]))
+                n_pages += 1
+    return n_pages
+
+def stage_text_layer(reports, work_dir):
+    """Read the tables of the born-digital table PDFs from their text layer."""
+    from text_layer import extract_pdf_text_tables
+
+    n_pages = 0
+    for report in reports:
+        if report["kind"] != "text":
+            continue
+        for job in report["jobs"]:
+            tables = extract_pdf_text_tables(get_output_path(report["pdf_path"], job["dir_name"]))
+            if tables is None:
+                raise RuntimeError(f"No text layer in {job['dir_name']}/{report['year']}")
+            for page_num, table in enumerate(tables, start=1):
+                check_table(table, f"{job['dir_name']}/{report['year']} page {page_num}")
+            n_pages += len(tables)
+    return n_pages
+
+def stage_local_tables(reports, work_dir):
+    """
+    Extract the tables of the scanned table PDFs with the local backend, into workbooks.
+
+    Renders go to the pipeline's raster cache, so runs after the first time
+    OCR and layout only; the rasterize stage times rendering on its own.
+    Each workbook is read back and checked with check_table.
+    """
+    from table_backends import LocalBackend
+
+    backend = LocalBackend()
+    output_dir = Path(work_dir) / "derived"
+    output_dir.mkdir(exist_ok=True)
+
+    n_pages = 0
+    for report in reports:
+        if report["kind"] != "scan":
+            continue
+        for job in report["jobs"]:
+            source = get_output_path(report["pdf_path"], job["dir_name"])
+            excel_output_path = output_dir / f"{job['dir_name']}-{report['year']}.xlsx"
+            backend.extract_one(report["year"], source, excel_output_path)
+
+            # The table's pages are stitched into the first sheet
+            sheet = pd.read_excel(excel_output_path, sheet_name=0, header=None, dtype=str)
+            check_table(sheet.fillna("").values.tolist(), f"{job['dir_name']}/{report['year']}",
+                        n_pages=len(job_pages(job)))
+            n_pages += len(job_pages(job))
+    return n_pages
+
+def stage_upload(reports, work_dir, endpoint_url=None, s3_bucket="benchmark"):
+    """Upload every table PDF to an S3-compatible stand-in (MinIO, moto server)."""
+    from upload_check import get_s3_client, upload_file
+
+    s3_client = get_s3_client(endpoint_url)
+    try:
+        s3_client.head_bucket(Bucket=s3_bucket)
+    except Exception:
+        s3_client.create_bucket(Bucket=s3_bucket)
+
+    n_pages = 0
+    for report in reports:
+        for job in report["jobs"]:
+            pdf_path = get_output_path(report["pdf_path"], job["dir_name"])
+            upload_file(s3_client, pdf_path, s3_bucket, f"{job['dir_name']}/{pdf_path.name}")
+            n_pages += len(job_pages(job))
+    return n_pages
+
+STAGES = {
+    "split": (stage_split, []),
+    "rasterize": (stage_rasterize, ["pdftoppm"]),
+    "ocr": (stage_ocr, ["pdftoppm", "tesseract", "pytesseract"]),
+    "text_layer": (stage_text_layer, []),
+    "local_tables": (stage_local_tables, ["pdftoppm", "tesseract", "pytesseract"]),
+    "upload": (stage_upload, ["s3"]),
+}
+
+def time_stage(fn, reports, work_dir, repeat, **kwargs):
+    """
+    Run a stage repeat times.
+
+    Returns:
+        dict: pages handled per run, best and median wall seconds and pages per second (from the best run)
+    """
+    times = []
+    n_pages = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_pages = fn(reports, work_dir, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    best = times[0]
+    return {
+        "pages": n_pages,
+        "best_seconds": round(best, 4),
+        "median_seconds": round(times[len(times) // 2], 4),
+        "pages_per_second": round(n_pages / best, 2) if best > 0 else None,
+    }
+
+def compare(results, baseline, max_slowdown=MAX_SLOWDOWN):
+    """
+    Compare stage throughputs with a baseline.
+
+    Returns:
+        list: (stage, current pages/s, baseline pages/s, ratio, regressed) for stages in both
+    """
+    rows = []
+    for stage, result in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous or not previous.get("pages_per_second") or not result.get("pages_per_second"):
+            continue
+        ratio = result["pages_per_second"] / previous["pages_per_second"]
+        rows.append((stage, result["pages_per_second"], previous["pages_per_second"], ratio,
+                     ratio < 1 - max_slowdown))
+    return rows
+
+def benchmark(stages=tuple(STAGES), n_reports=2, n_pages=40, repeat=3, work_dir=None, endpoint_url=None,
+              baseline_path=BASELINE_PATH, save_baseline=False, max_slowdown=MAX_SLOWDOWN):
+    """
+    Time the extraction pipeline on synthetic reports.
+
+    Runs in a scratch directory so the pipeline's relative paths
+    (data/annual-reports/, data/raster-cache/) and its timing trace stay out
+    of the repository. Stages whose tools are not installed, and the upload
+    stage without an S3 endpoint, are skipped.
+
+    Args:
+        stages (tuple): Keys of STAGES to run, in order; split always runs first
+        n_reports (int): Synthetic reports to generate, alternating scanned and born-digital
+        n_pages (int): Pages per report
+        repeat (int): Runs per stage; the best run is reported
+        work_dir (Path): Scratch directory to keep, or None for a temporary one
+        endpoint_url (str): S3-compatible endpoint for the upload stage
+        baseline_path (Path): Stored baseline to compare with
+        save_baseline (bool): Whether to store these results as the new baseline
+        max_slowdown (float): Drop in pages/second, as a share of the baseline, counted as a regression
+
+    Returns:
+        dict: Results with fixture parameters, per-stage timings and the stages that regressed
+    """
+    endpoint_url = endpoint_url or os.environ.get("S3_ENDPOINT_URL")
+    temp_dir = tempfile.TemporaryDirectory(prefix="databuild-benchmark-") if work_dir is None else None
+    work_dir = Path(work_dir or temp_dir.name).resolve()
+    work_dir.mkdir(exist_ok=True, parents=True)
+
+    cwd = os.getcwd()
+    trace_path = instrument.TRACE_PATH
+    unavailable = set(missing_tools()) | (set() if endpoint_url else {"s3"})
+
+    results = {
+        "fixtures": {"reports": n_reports, "pages_per_report": n_pages, "scan_dpi": SCAN_DPI,
+                     "render_dpi": RENDER_DPI},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stages": {},
+        "skipped": {},
+    }
+
+    try:
+        os.chdir(work_dir)
+        instrument.TRACE_PATH = work_dir / "trace.jsonl"
+
+        start = time.perf_counter()
+        reports = make_fixtures(work_dir, n_reports, n_pages)
+        print(f"Generated {n_reports} reports of {n_pages} pages in {time.perf_counter() - start:.1f}s ({work_dir})")
+
+        for stage in ["split"] + [stage for stage in stages if stage != "split"]:
+            fn, requires = STAGES[stage]
+            missing = [tool for tool in requires if tool in unavailable]
+            if missing:
+                results["skipped"][stage] = f"needs {', '.join(missing)}"
+                print(f"[skipped] {stage}: needs {', '.join(missing)}")
+                continue
+
+            kwargs = {"endpoint_url": endpoint_url} if stage == "upload" else {}
+            result = time_stage(fn, reports, work_dir, repeat, **kwargs)
+            results["stages"][stage] = result
+            print(f"[{stage:>12}] {result['pages']} pages in {result['best_seconds']:.3f}s "
+                  f"({result['pages_per_second']} pages/s)")
+    finally:
+        os.chdir(cwd)
+        instrument.TRACE_PATH = trace_path
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    baseline = {}
+    if Path(baseline_path).exists():
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+    comparison = compare(results, baseline, max_slowdown) if baseline else []
+    results["regressed"] = [stage for stage, *_, regressed in comparison if regressed]
+
+    # Print summary
+    print("\nBenchmark Summary:")
+    print(f"{'Stage':<14} {'Pages':>6} {'Best (s)':>9} {'Pages/s':>9} {'Baseline':>9} {'Change':>8}")
+    compared = {stage: (previous, ratio) for stage, _, previous, ratio, _ in comparison}
+    for stage, result in results["stages"].items():
+        previous, ratio = compared.get(stage, (None, None))
+        change = f"{ratio - 1:+.0%}" if ratio is not None else "-"
+        print(f"{stage:<14} {result['pages']:>6} {result['best_seconds']:>9.3f} "
+              f"{result['pages_per_second'] or 0:>9.1f} {previous or '-':>9} {change:>8}")
+    for stage, reason in results["skipped"].items():
+        print(f"{stage:<14} skipped ({reason})")
+
+    if not baseline and not save_baseline:
+        print(f"No baseline at {baseline_path}; run with --save-baseline on this machine to store one")
+    if baseline and baseline.get("fixtures") != results["fixtures"]:
+        print(f"Warning: baseline {baseline_path} was measured on different fixtures")
+    if results["regressed"]:
+        print(f"Slower than baseline by more than {max_slowdown:.0%}: {', '.join(results['regressed'])}")
+
+    if save_baseline:
+        baseline_path = Path(baseline_path)
+        baseline_path.parent.mkdir(exist_ok=True, parents=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {baseline_path}")
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time page split, rasterize, OCR, table extraction and upload on synthetic reports.",
+        epilog="Example: python program/databuild/benchmark.py --reports 4 --repeat 5 --save-baseline"
+    )
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES),
+                        help="Stages to time (default: all); split always runs since the others read its output")
+    parser.add_argument("--reports", type=int, default=2,
+                        help="Synthetic reports, alternating scanned and born-digital (default: 2)")
+    parser.add_argument("--pages", type=int, default=40, help="Pages per report (default: 40)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best is reported (default: 3)")
+    parser.add_argument("--workdir", type=Path, help="Keep fixtures and outputs here instead of a temporary directory")
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint for the upload stage (default: S3_ENDPOINT_URL)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH,
+                        help=f"Baseline results (default: {BASELINE_PATH.relative_to(PROJECT_ROOT)})")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--max-slowdown", type=float, default=MAX_SLOWDOWN,
+                        help=f"Exit with an error if a stage's pages/s drops by more than this share "
+                             f"of the baseline (default: {MAX_SLOWDOWN})")
+    args = parser.parse_args()
+
+    if args.pages < 8:
+        parser.error("--pages must be at least 8 to hold the synthetic tables")
+
+    results = benchmark(stages=tuple(args.stages), n_reports=args.reports, n_pages=args.pages,
+                        repeat=args.repeat, work_dir=args.workdir, endpoint_url=args.endpoint_url,
+                        baseline_path=args.baseline, save_baseline=args.save_baseline,
+                        max_slowdown=args.max_slowdown)
+    if results["regressed"]:
+        sys.exit(1)
@@ -0,0 +1,297 @@
+from pathlib import Path
+import argparse
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+from county_matcher import ALIASES_PATH, AUTO_ALIASES_PATH, COUNTIES_PATH, CountyMatcher
+from manifest import BuildManifest, artifact_key, tool_version
+from raster_cache import file_hash
+from validate import COLUMN_KINDS, parse_numeric
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+PANEL_PATH = PROJECT_ROOT / "derived" / "panel.parquet"
+
+# Total, state and average rows, repeated header rows and the report form number
+SKIP_ROW_PATTERN = re.compile(r"total|state|average|county|t[do]evr3", re.IGNORECASE)
+
+PANEL_SCHEMA = pa.schema([
+    ("countyfp", pa.int32()),
+    ("year", pa.int16()),
+    ("county", pa.string()),
+    ("assessed_valuation", pa.float64()),
+    ("total_revenue", pa.float64()),
+    ("county_mill_levy", pa.float64()),
+    ("total_levy", pa.float64()),
+    ("assessed_resi", pa.float64()),
+    ("assessed_total", pa.float64()),
+])
+
+def clean_county(name):
+    """
+    Strip footnote markers from a county cell and drop rows that are not counties.
+
+    Returns:
+        str: County name as printed, or None for cells without letters and total/header rows
+    """
+    if name is None:
+        return None
+
+    name = re.sub(r"[$*]| \+|:|'| #| 4$", "", str(name)).strip()
+    if not re.search(r"[A-Za-z]", name) or SKIP_ROW_PATTERN.search(name):
+        return None
+
+    return name
+
+def iter_rows(xlsx_path):
+    """
+    Stream the rows of a workbook's first sheet without loading it into memory.
+
+    Yields:
+        tuple: Cell values of one row
+    """
+    workbook = load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def get_parts(dir_name):
+    """
+    Group a table's workbooks by year.
+
+    A combined workbook (1986.xlsx, from process_pages.py --combine) is used
+    instead of any per-page parts left over from earlier runs.
+
+    Returns:
+        dict: Year -> workbook paths in page order (e.g. 1986a.xlsx, 1986b.xlsx)
+    """
+    parts = {}
+    for xlsx_path in sorted((PROJECT_ROOT / "derived" / dir_name).glob("*.xlsx")):
+        match = re.fullmatch(r"(\d{4})[a-z]?", xlsx_path.stem)
+        if match:
+            parts.setdefault(int(match.group(1)), []).append(xlsx_path)
+
+    for year, paths in parts.items():
+        combined = [xlsx_path for xlsx_path in paths if xlsx_path.stem == str(year)]
+        if combined:
+            parts[year] = combined
+
+    return parts
+
+# Header text of the mill levy table columns; 1970 spells Valuation 'Voluation'
+LEVY_COLUMNS = {
+    "assessed_valuation": r"v[ao]luation",
+    "total_revenue": r"revenue",
+    "county_mill_levy": r"mill levy",
+    "total_levy": r"total average",
+}
+
+def read_levy_rows(paths, year):
+    """
+    Read one year of the mill levy table, stitching its page parts.
+
+    Each part repeats the header row; columns are located by header text.
+
+    Yields:
+        tuple: (county cell, {column: raw cell} for the LEVY_COLUMNS found)
+    """
+    for xlsx_path in paths:
+        rows = iter_rows(xlsx_path)
+        header = [str(cell or "").strip().lower() for cell in next(rows, ())]
+
+        columns = {}
+        for column, pattern in LEVY_COLUMNS.items():
+            col = next((i for i, name in enumerate(header) if re.search(pattern, name)), None)
+            if col is not None:
+                columns[column] = col
+
+        if "county_mill_levy" not in columns:
+            print(f"No mill levy column found in {xlsx_path.name}")
+            continue
+
+        for row in rows:
+            yield row[0], {column: row[col] if col < len(row) else None for column, col in columns.items()}
+
+def read_valuation_rows(paths, year):
+    """
+    Read one year of the county valuation table, stitching its page parts.
+
+    The sheets have no usable header, so columns are taken by position as in
+    import-valuations.R.
+
+    Yields:
+        tuple: (county cell, {"assessed_resi": raw cell, "assessed_total": raw cell})
+    """
+    resi_col, total_col = (1, 8) if year < 1984 else (2, 10)
+
+    for xlsx_path in paths:
+        for row in iter_rows(xlsx_path):
+            if len(row) > total_col:
+                yield row[0], {"assessed_resi": row[resi_col], "assessed_total": row[total_col]}
+
+TABLE_READERS = {
+    "mill-levies": read_levy_rows,
+    "county-valuation": read_valuation_rows,
+}
+
+def consolidate_inputs(table_parts):
+    """Get the build inputs of the panel: every workbook, the county crosswalks and tool versions."""
+    return {
+        "stage": "consolidate",
+        "sources": {
+            artifact_key(xlsx_path): file_hash(xlsx_path)
+            for parts in table_parts.values() for paths in parts.values() for xlsx_path in paths
+        },
+        "counties": file_hash(COUNTIES_PATH),
+        "aliases": file_hash(ALIASES_PATH) if ALIASES_PATH.exists() else None,
+        "auto_aliases": file_hash(AUTO_ALIASES_PATH) if AUTO_ALIASES_PATH.exists() else None,
+        "tools": {"openpyxl": tool_version("openpyxl"), "pandas": tool_version("pandas"),
+                  "pyarrow": tool_version("pyarrow")},
+    }
+
+def parse_table(records):
+    """
+    Parse the raw cells of one table into numbers, a whole column at a time.
+
+    Args:
+        records (list): Dicts with year, name and raw value columns
+
+    Returns:
+        pd.DataFrame: year, name and float64 value columns
+    """
+    table = pd.DataFrame.from_records(records)
+    for column in table.columns.intersection(list(COLUMN_KINDS)):
+        table[column] = parse_numeric(table[column], COLUMN_KINDS[column])
+
+    for column in table.columns.intersection(["county_mill_levy", "total_levy"]):
+        table[column] = table[column].abs()  # OCR picks up stray dashes
+
+    # 1984-1992 county valuations are reported in thousands
+    in_thousands = table["year"].between(1984, 1992)
+    for column in table.columns.intersection(["assessed_resi", "assessed_total"]):
+        table.loc[in_thousands, column] *= 1000
+
+    return table
+
+def write_panel(panel, output_path):
+    """
+    Write the panel as Parquet with one row group per year, sorted by county FIPS.
+
+    Args:
+        panel (pd.DataFrame): Panel with the PANEL_SCHEMA columns
+        output_path (Path): Destination file
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    temp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+
+    panel = panel.reindex(columns=PANEL_SCHEMA.names).sort_values(["year", "countyfp"])
+    with pq.ParquetWriter(temp_path, PANEL_SCHEMA) as writer:
+        for _, rows in panel.groupby("year", sort=True):
+            writer.write_table(pa.Table.from_pandas(rows, schema=PANEL_SCHEMA, preserve_index=False))
+
+    os.replace(temp_path, output_path)
+
+def consolidate(tables=tuple(TABLE_READERS), output_path=PANEL_PATH, force=False):
+    """
+    Combine the per-year table workbooks into one county-by-year Parquet panel.
+
+    Workbooks are streamed row by row, page parts (1986a, 1986b, ...) are
+    stitched in order, numbers are parsed column-wise with
+    validate.parse_numeric and county names are mapped to FIPS codes with
+    county_matcher. Rows whose county cannot be matched are reported and
+    left out.
+
+    Args:
+        tables (tuple): Table directories in derived/ to include
+        output_path (Path): Where to write the panel
+        force (bool): Rebuild even if no workbook changed since the last build
+
+    Returns:
+        dict: Summary with the number of panel rows, unmatched names and duplicate keys
+    """
+    table_parts = {dir_name: get_parts(dir_name) for dir_name in tables}
+
+    manifest = BuildManifest()
+    inputs = consolidate_inputs(table_parts)
+    if not force and not manifest.is_stale(output_path, inputs):
+        print(f"Panel is up to date at {output_path}")
+        return {"rows": None, "unmatched": [], "duplicates": []}
+
+    matcher = CountyMatcher()
+    frames = []
+    unmatched = []
+    duplicates = []
+
+    for dir_name, parts in table_parts.items():
+        reader = TABLE_READERS[dir_name]
+        records = []
+        for year, paths in sorted(parts.items()):
+            for cell, values in reader(paths, year):
+                name = clean_county(cell)
+                if name is not None:
+                    records.append({"year": year, "name": name, **values})
+
+        if not records:
+            continue
+        table = parse_table(records)
+
+        # Each distinct spelling is scored once
+        matches = matcher.match_many(table["name"])
+        table["countyfp"] = [countyfp for _, countyfp, _ in matches]
+
+        missing = table["countyfp"].isna()
+        for year, name in table.loc[missing, ["year", "name"]].itertuples(index=False):
+            unmatched.append((dir_name, year, name))
+        table = table[~missing].astype({"countyfp": "int64"})
+
+        repeated = table.duplicated(["countyfp", "year"])
+        for year, name in table.loc[repeated, ["year", "name"]].itertuples(index=False):
+            duplicates.append((dir_name, year, name))
+        frames.append(table[~repeated].drop(columns="name"))
+
+    panel = frames[0] if frames else pd.DataFrame(columns=["countyfp", "year"])
+    for table in frames[1:]:
+        panel = panel.merge(table, on=["countyfp", "year"], how="outer")
+    fips_names = {countyfp: county for county, countyfp in matcher.counties.items()}
+    panel["county"] = panel["countyfp"].map(fips_names)
+
+    new_aliases = sorted(matcher.new_aliases.values(), key=lambda alias: alias["alias"])
+    matcher.save()
+
+    write_panel(panel, output_path)
+    manifest.record(output_path, inputs)
+    manifest.save()
+
+    # Print summary
+    print("\nConsolidation Summary:")
+    print(f"Panel rows: {len(panel)} written to {output_path}")
+    print(f"New county aliases: {len(new_aliases)} added to {AUTO_ALIASES_PATH.name} for review")
+    for alias in new_aliases:
+        print(f"  - {alias['alias']!r} -> {alias['county']} (confidence {alias['confidence']:.2f})")
+    print(f"Unmatched county names: {len(unmatched)}")
+    for dir_name, year, name in unmatched:
+        print(f"  - {dir_name} {year}: {name!r}")
+    print(f"Duplicate county-years (kept first): {len(duplicates)}")
+    for dir_name, year, name in duplicates:
+        print(f"  - {dir_name} {year}: {name}")
+
+    return {"rows": len(panel), "unmatched": unmatched, "duplicates": duplicates}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Combine derived/<table>/<year>.xlsx workbooks into one county-by-year Parquet panel."
+    )
+    parser.add_argument("--tables", nargs="+", default=list(TABLE_READERS), choices=list(TABLE_READERS),
+                        help="Tables to include (default: all)")
+    parser.add_argument("--output", type=Path, default=PANEL_PATH,
+                        help=f"Output Parquet file (default: {PANEL_PATH.relative_to(PROJECT_ROOT)})")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if no workbook changed")
+    args = parser.parse_args()
+
+    consolidate(tables=tuple(args.tables), output_path=args.output, force=args.force)
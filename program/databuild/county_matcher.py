@@ -0,0 +1,215 @@
+from pathlib import Path
+import argparse
+import csv
+import os
+import re
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+COUNTIES_PATH = PROJECT_ROOT / "crosswalk" / "counties-co.csv"
+ALIASES_PATH = PROJECT_ROOT / "crosswalk" / "county-aliases.csv"
+
+# Fuzzy matches awaiting review; crosswalk/county-aliases.csv is only edited by hand
+AUTO_ALIASES_PATH = PROJECT_ROOT / "derived" / "county-aliases-auto.csv"
+
+ALIAS_FIELDS = ["alias", "county", "confidence", "source"]
+
+# Trigram similarity (Dice coefficient) needed to accept a fuzzy match
+MIN_CONFIDENCE = 0.6
+
+# Lead the best county must have over the runner-up ('San' is San Juan or San Miguel)
+MIN_MARGIN = 0.2
+
+# Shortest name, as a share of the county's normalized length, that may match;
+# truncated cells ('Clear', 'Paso') are left for a person to resolve
+MIN_LENGTH_RATIO = 0.75
+
+# Digits OCR reads in place of letters; '10' is checked first (R10 Grande)
+OCR_DIGITS = [("10", "io"), ("0", "o"), ("1", "l"), ("5", "s"), ("6", "g"), ("8", "b")]
+
+def normalize(name):
+    """
+    Reduce a county name to the form used for matching.
+
+    Lowercases, maps OCR digit confusions to letters and drops 'County'/'Co.',
+    punctuation and spaces, so 'ARAPAHOE CO.', 'Arapaho e' and 'Arapahoe'
+    all become 'arapahoe'.
+    """
+    name = str(name).lower()
+    for digits, letters in OCR_DIGITS:
+        name = name.replace(digits, letters)
+    name = re.sub(r"\bco(unty)?\b\.?", " ", name)
+    return re.sub(r"[^a-z]", "", name)
+
+def trigrams(key):
+    """Get the set of character trigrams of a normalized name, padded at both ends."""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CountyMatcher:
+    """
+    Match OCR'd county names to Colorado counties.
+
+    Known spellings (official names, the hand-made alias table and earlier
+    automatic matches) are resolved with a dictionary lookup. Other names
+    are scored against a trigram index of the 64 counties; a match is
+    accepted only when it is clearly better than the runner-up and the name
+    is not a truncation. Accepted matches are written to a separate review
+    file, never to the hand-made alias table.
+
+    Attributes:
+        counties (dict): County name -> five-digit FIPS code
+        aliases (dict): Alias as written -> alias record (county, confidence, source),
+            from the hand-made table and then the review file
+        lookup (dict): Normalized spelling -> alias record; hand-made aliases win
+    """
+
+    def __init__(self, counties_path=COUNTIES_PATH, aliases_path=ALIASES_PATH,
+                 auto_aliases_path=AUTO_ALIASES_PATH, min_confidence=MIN_CONFIDENCE, min_margin=MIN_MARGIN):
+        self.aliases_path = Path(aliases_path)
+        self.auto_aliases_path = Path(auto_aliases_path)
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.counties = self._load_counties(counties_path)
+        self.aliases = {**self._load_aliases(self.auto_aliases_path), **self._load_aliases(self.aliases_path)}
+        self.lookup = {}
+        for alias in sorted(self.aliases.values(), key=lambda alias: alias["source"] != "manual"):
+            self.lookup.setdefault(normalize(alias["alias"]), alias)
+        self.new_aliases = {}
+
+        self.exact = {normalize(county): county for county in self.counties}
+        self.index = {}
+        for key, county in self.exact.items():
+            for gram in trigrams(key):
+                self.index.setdefault(gram, []).append(county)
+        self.sizes = {county: len(trigrams(key)) for key, county in self.exact.items()}
+
+    @staticmethod
+    def _load_counties(path):
+        counties = {}
+        with open(path, 'r', newline='') as f:
+            for row in csv.DictReader(f, delimiter='|'):
+                name = row["COUNTYNAME"].removesuffix(" County")
+                counties[name] = int(row["STATEFP"]) * 1000 + int(row["COUNTYFP"])
+        return counties
+
+    @staticmethod
+    def _load_aliases(path):
+        """Read an alias table, keyed by the alias exactly as written."""
+        if not path.exists():
+            return {}
+
+        with open(path, 'r', newline='') as f:
+            return {
+                row["alias"]: {
+                    "alias": row["alias"],
+                    "county": row["county"],
+                    "confidence": float(row["confidence"]),
+                    "source": row["source"],
+                }
+                for row in csv.DictReader(f)
+            }
+
+    def score(self, key):
+        """
+        Score a normalized name against every county sharing a trigram with it.
+
+        Returns:
+            list: (confidence, county) pairs, best first
+        """
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for county in self.index.get(gram, ()):
+                shared[county] = shared.get(county, 0) + 1
+
+        scores = [(2 * count / (len(grams) + self.sizes[county]), county) for county, count in shared.items()]
+        return sorted(scores, reverse=True)
+
+    def match(self, name):
+        """
+        Match one name.
+
+        Returns:
+            tuple: (county, FIPS code, confidence); county and FIPS are None
+                when no county scores at least min_confidence
+        """
+        key = normalize(name)
+        if not key:
+            return None, None, 0.0
+
+        if key in self.exact:
+            county = self.exact[key]
+            return county, self.counties[county], 1.0
+
+        alias = self.lookup.get(key) or self.new_aliases.get(key)
+        if alias is not None:
+            return alias["county"], self.counties[alias["county"]], alias["confidence"]
+
+        scores = self.score(key)
+        if not scores:
+            return None, None, 0.0
+
+        confidence, county = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        if (confidence < self.min_confidence or confidence - runner_up < self.min_margin
+                or len(key) < MIN_LENGTH_RATIO * len(normalize(county))):
+            return None, None, confidence
+
+        self.new_aliases[key] = {"alias": str(name).strip(), "county": county,
+                                 "confidence": round(confidence, 3), "source": "auto"}
+        return county, self.counties[county], confidence
+
+    def match_many(self, names):
+        """
+        Match a column of names, scoring each distinct spelling once.
+
+        Args:
+            names (iterable): County names as read from the tables
+
+        Returns:
+            list: (county, FIPS code, confidence) for each name, in order
+        """
+        names = list(names)
+        resolved = {name: self.match(name) for name in dict.fromkeys(names)}
+        return [resolved[name] for name in names]
+
+    def save(self):
+        """
+        Add the spellings matched since loading to the review file.
+
+        Review the rows there and copy the correct ones into
+        crosswalk/county-aliases.csv with source 'manual'.
+        """
+        if not self.new_aliases:
+            return
+
+        aliases = self._load_aliases(self.auto_aliases_path)
+        for alias in self.new_aliases.values():
+            aliases.setdefault(alias["alias"], alias)
+
+        self.auto_aliases_path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = self.auto_aliases_path.with_name(f".{self.auto_aliases_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=ALIAS_FIELDS)
+            writer.writeheader()
+            writer.writerows(sorted(aliases.values(), key=lambda alias: (alias["county"], alias["alias"])))
+        os.replace(temp_path, self.auto_aliases_path)
+
+        for key, alias in self.new_aliases.items():
+            self.aliases.setdefault(alias["alias"], alias)
+            self.lookup.setdefault(key, alias)
+        self.new_aliases = {}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match county names to Colorado counties and FIPS codes.")
+    parser.add_argument("names", nargs="+", help="Names to match, e.g. 'ARAPAHOE CO.'")
+    parser.add_argument("--save", action="store_true",
+                        help=f"Add new matches to {AUTO_ALIASES_PATH.relative_to(PROJECT_ROOT)} for review")
+    args = parser.parse_args()
+
+    matcher = CountyMatcher()
+    for name, (county, countyfp, confidence) in zip(args.names, matcher.match_many(args.names)):
+        print(f"{name!r} -> {county or 'no match'} ({countyfp or '-'}, confidence {confidence:.2f})")
+
+    if args.save:
+        matcher.save()
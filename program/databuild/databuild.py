@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from extract_target_table_pdf import get_output_path
+from instrument import print_report, span, start_run
+from manifest import BuildManifest, table_inputs
+from process_pages import (combine_page_jobs, get_page_jobs, plan_page_jobs, resolve_orientations,
+                           run_report_jobs)
+from raster_cache import DEFAULT_MAX_PIXELS
+from table_backends import BACKENDS, DEFAULT_MAX_CONCURRENT, PROJECT_ROOT, get_backend
+
+DEFAULT_TABLES = ["county-valuation", "mill-levies"]
+STAGES = ["extract", "upload", "analyze", "export"]
+
+class Task:
+    """
+    One node of the build DAG: a pipeline stage for one table and year.
+
+    Attributes:
+        name (str): Unique name, e.g. 'analyze:mill-levies/1995'
+        stage (str): One of STAGES
+        year (str): Year the task works on
+        fn (callable): Function doing the work; its return value is kept in result
+        deps (list): Names of tasks that must succeed first
+        group (str): Concurrency group, 'local' for work on this machine or
+            'remote' for tasks that mostly wait on AWS
+        stale (bool): Whether the manifest marks the task's outputs as missing
+            or out of date, i.e. whether running it would do any work
+    """
+
+    def __init__(self, name, stage, year, fn, deps=(), group="local", stale=True):
+        self.name = name
+        self.stage = stage
+        self.year = year
+        self.fn = fn
+        self.deps = list(deps)
+        self.group = group
+        self.stale = stale
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def run(self):
+        """Run the task, recording its result, status and wall time."""
+        start = time.perf_counter()
+        try:
+            with span(self.stage, stage=self.stage, year=self.year, task=self.name):
+                self.result = self.fn()
+            self.status = "ok"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+        self.elapsed = time.perf_counter() - start
+        return self
+
+def run_dag(tasks, limits):
+    """
+    Run tasks as soon as their dependencies have succeeded.
+
+    Ready tasks are started earliest year first, so early years move on to
+    later stages while later years are still being extracted. Tasks whose
+    dependencies failed are skipped.
+
+    Args:
+        tasks (list): Task objects
+        limits (dict): Concurrency group -> most tasks of that group running at once
+    """
+    by_name = {task.name: task for task in tasks}
+    pending = sorted(tasks, key=lambda t: (t.year, STAGES.index(t.stage), t.name))
+    running = {}
+    finished = set()
+    active = {group: 0 for group in limits}
+
+    with ThreadPoolExecutor(max_workers=sum(limits.values())) as executor:
+        while pending or running:
+            for task in list(pending):
+                deps = [by_name[dep] for dep in task.deps if dep in finished]
+                if any(dep.status in ("failed", "skipped") for dep in deps):
+                    task.status = "skipped"
+                    pending.remove(task)
+                    finished.add(task.name)
+                    _print_task(task)
+                elif len(deps) == len(task.deps) and all(dep.status == "ok" for dep in deps) and active[task.group] < limits[task.group]:
+                    task.status = "running"
+                    pending.remove(task)
+                    active[task.group] += 1
+                    running[executor.submit(task.run)] = task
+
+            if not running:
+                break  # everything left is waiting on a task that will never run
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                active[task.group] -= 1
+                finished.add(task.name)
+                _print_task(task)
+
+def build_tasks(dir_name, backend, manifest, only=None, combine=False, dry_run=False):
+    """
+    Create the extract -> upload -> analyze -> export tasks for one table.
+
+    Args:
+        dir_name (str): Table directory, e.g. 'mill-levies'
+        backend (TableBackend): Table extraction backend
+        manifest (BuildManifest): Manifest deciding which artifacts are stale
+        only (set): Years to build, or None for all years in the crosswalk
+        combine (bool): Whether to save multi-page tables as one PDF per table
+        dry_run (bool): Only plan the tasks: orientations are read from the
+            sidecars but not detected, nothing is written, and each task's
+            stale flag is set from the manifest
+
+    Returns:
+        list: Task objects
+    """
+    csv_path = PROJECT_ROOT / "crosswalk" / f"{dir_name}-pages.csv"
+    page_jobs = [job for job in get_page_jobs(csv_path) if only is None or job["year"] in only]
+
+    resolve_orientations(page_jobs, detect=not dry_run)
+    if combine:
+        page_jobs = combine_page_jobs(page_jobs)
+    plan_page_jobs(page_jobs, manifest, adopt=not dry_run)
+
+    years = {}
+    for job in page_jobs:
+        years.setdefault(job["year"], []).append(job)
+
+    output_dir = PROJECT_ROOT / "derived" / dir_name
+    tools = backend.versions()
+    remote = "remote" if backend.requires_upload else "local"
+    s3_index = _S3Index(dir_name) if backend.requires_upload else None
+
+    tasks = []
+    for year, year_jobs in sorted(years.items()):
+        label = f"{dir_name}/{year}"
+        pages_stale = any(job["stale"] for job in year_jobs)
+        tables_stale = (pages_stale or not dry_run
+                        or _tables_stale(dir_name, year_jobs, backend, manifest, tools, s3_index))
+
+        extract = Task(f"extract:{label}", "extract", year,
+                       lambda year_jobs=year_jobs: _extract(year_jobs, manifest), stale=pages_stale)
+        tasks.append(extract)
+
+        analyze_deps = [extract.name]
+        if backend.requires_upload:
+            upload = Task(f"upload:{label}", "upload", year,
+                          lambda extract=extract: _upload(dir_name, extract.result, s3_index),
+                          deps=[extract.name], group=remote, stale=pages_stale)
+            tasks.append(upload)
+            analyze_deps = [upload.name]
+
+        analyze = Task(f"analyze:{label}", "analyze", year,
+                       lambda extract=extract: _analyze(dir_name, extract.result, backend, manifest, tools, s3_index),
+                       deps=analyze_deps, group=remote, stale=tables_stale)
+        export = Task(f"export:{label}", "export", year,
+                      lambda analyze=analyze: _export(output_dir, analyze.result, backend, manifest),
+                      deps=[analyze.name], group=remote, stale=tables_stale)
+        tasks.extend([analyze, export])
+
+    return tasks
+
+def _workbook_inputs(dir_name, part, backend, tools, s3_index):
+    """Get a workbook's source and build inputs, with the ETag of its S3 object for backends reading from S3."""
+    from upload_check import DEFAULT_BUCKET
+
+    source = backend.source_for(dir_name, part)
+    s3_etag = None
+    if s3_index is not None:
+        _, index = s3_index.get(DEFAULT_BUCKET)
+        s3_etag = index.get(f"{dir_name}/{part}.pdf", {}).get("etag")
+    return source, table_inputs(source, backend.name, tools, s3_etag)
+
+def _tables_stale(dir_name, year_jobs, backend, manifest, tools, s3_index):
+    """Check whether any of a year's workbooks would be rebuilt, without changing the manifest."""
+    for part in sorted({f"{job['year']}{job['suffix']}" for job in year_jobs}):
+        _, inputs = _workbook_inputs(dir_name, part, backend, tools, s3_index)
+        excel_output_path = PROJECT_ROOT / "derived" / dir_name / f"{part}.xlsx"
+        if manifest.is_stale(excel_output_path, inputs) and not manifest.is_adoptable(excel_output_path, inputs):
+            return True
+    return False
+
+def _extract(year_jobs, manifest):
+    """Extract a year's pages; returns the year/part names of its PDFs."""
+    results = run_report_jobs(year_jobs)
+    failed = [r for r in results if r["status"] == "failed"]
+    if failed:
+        raise Exception(f"{len(failed)} page(s) failed: {failed[0]['error'] or 'see log'}")
+
+    for r in results:
+        if r["status"] == "ok":
+            manifest.record(get_output_path(r["pdf_path"], r["dir_name"], r["suffix"]), r["inputs"])
+            manifest.forget(r.get("replaced", []))
+
+    return sorted(f"{r['year']}{r['suffix']}" for r in results)
+
+class _S3Index:
+    """Listing of a table's S3 prefix, fetched once on first use and shared by upload tasks."""
+
+    def __init__(self, dir_name):
+        self.dir_name = dir_name
+        self.lock = threading.Lock()
+        self.client = None
+        self.index = None
+
+    def get(self, s3_bucket):
+        from upload_check import get_s3_client, list_objects
+
+        with self.lock:
+            if self.index is None:
+                self.client = get_s3_client()
+                self.index = list_objects(self.client, s3_bucket, f"{self.dir_name}/")
+            return self.client, self.index
+
+def _upload(dir_name, parts, s3_index):
+    """Upload a year's PDFs that S3 does not already have."""
+    from upload_check import DEFAULT_BUCKET, sync_file
+
+    s3_client, index = s3_index.get(DEFAULT_BUCKET)
+    source_dir = PROJECT_ROOT / "data" / "annual-reports" / dir_name
+    return {
+        part: sync_file(s3_client, source_dir / f"{part}.pdf", DEFAULT_BUCKET, f"{dir_name}/{part}.pdf", index)
+        for part in parts
+    }
+
+def _analyze(dir_name, parts, backend, manifest, tools, s3_index):
+    """Run table extraction for a year's stale PDFs; returns part -> (result, inputs)."""
+    analyzed = {}
+    for part in parts:
+        source, inputs = _workbook_inputs(dir_name, part, backend, tools, s3_index)
+        excel_output_path = PROJECT_ROOT / "derived" / dir_name / f"{part}.xlsx"
+        manifest.adopt(excel_output_path, inputs)
+        if manifest.is_stale(excel_output_path, inputs):
+            analyzed[part] = (backend.analyze(part, source), inputs)
+
+    return analyzed
+
+def _export(output_dir, analyzed, backend, manifest):
+    """Write the workbooks for a year's analyzed PDFs."""
+    if analyzed:
+        output_dir.mkdir(exist_ok=True, parents=True)
+    for part, (result, inputs) in analyzed.items():
+        excel_output_path = output_dir / f"{part}.xlsx"
+        backend.export(result, part, excel_output_path)
+        manifest.record(excel_output_path, inputs)
+
+    return sorted(analyzed)
+
+def _print_task(task):
+    """Print a one-line status message for a finished or skipped task."""
+    reason = f": {task.error}" if task.error else ""
+    print(f"[{task.status:>7}] {task.name} ({task.elapsed:.1f}s){reason}", flush=True)
+
+def print_summary(tasks, elapsed):
+    """Print task counts and timings by stage."""
+    print("\nBuild Summary:")
+    print(f"{'stage':<8} {'ok':>4} {'failed':>6} {'skipped':>7} {'total s':>9} {'max s':>8}")
+    for stage in STAGES:
+        stage_tasks = [t for t in tasks if t.stage == stage]
+        if not stage_tasks:
+            continue
+        counts = {status: sum(t.status == status for t in stage_tasks) for status in ("ok", "failed", "skipped")}
+        times = [t.elapsed for t in stage_tasks]
+        print(f"{stage:<8} {counts['ok']:>4} {counts['failed']:>6} {counts['skipped']:>7} "
+              f"{sum(times):>9.1f} {max(times):>8.1f}")
+    print(f"Wall time: {elapsed:.1f}s")
+
+    failed = [t for t in tasks if t.status == "failed"]
+    if failed:
+        print("Failed tasks:")
+        for task in failed:
+            print(f"  - {task.name}: {task.error}")
+
+def databuild(tables=DEFAULT_TABLES, backend="textract", jobs=1, only=None, dry_run=False,
+              max_concurrent=DEFAULT_MAX_CONCURRENT, combine=False):
+    """
+    Build the derived tables, pipelining each year through extract, upload, analyze and export.
+
+    Args:
+        tables (list): Table directories to build, each with a crosswalk/<table>-pages.csv
+        backend (str): Table extraction backend, a key of table_backends.BACKENDS
+        jobs (int): Most local tasks (page extraction, local OCR) running at once
+        only (list): Years to build, or None for all years
+        dry_run (bool): Only print the tasks the manifest marks as stale,
+            without detecting orientations or writing anything
+        max_concurrent (int): Most remote (S3/Textract) tasks running at once
+        combine (bool): Whether to save multi-page tables as one PDF per table,
+            so each is uploaded and analyzed once and exported as one sheet
+
+    Returns:
+        list: Task objects with their status and timings
+    """
+    start_run()
+    table_backend = get_backend(backend, max_concurrent=max_concurrent) if backend == "textract" else get_backend(backend)
+    manifest = BuildManifest()
+    only = set(map(str, only)) if only else None
+
+    tasks = []
+    for dir_name in tables:
+        tasks.extend(build_tasks(dir_name, table_backend, manifest, only, combine, dry_run))
+
+    if dry_run:
+        stale = [task for task in tasks if task.stale]
+        stale_names = {task.name for task in stale}
+        print(f"\n{len(stale)} of {len(tasks)} tasks are stale (dry run):")
+        for task in sorted(stale, key=lambda t: (t.year, STAGES.index(t.stage), t.name)):
+            deps = [dep for dep in task.deps if dep in stale_names]
+            after = f" after {', '.join(deps)}" if deps else ""
+            print(f"  {task.name}{after}")
+        return stale
+
+    start = time.perf_counter()
+    try:
+        run_dag(tasks, limits={"local": jobs, "remote": max_concurrent})
+    finally:
+        manifest.save()
+
+    print_summary(tasks, time.perf_counter() - start)
+    print_report()
+    return tasks
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the table pipeline (extract -> upload -> analyze -> export) as a per-year task graph.",
+        epilog="Example: python program/databuild/databuild.py --jobs 8 --only 1995 1996"
+    )
+    parser.add_argument("--tables", nargs="+", default=DEFAULT_TABLES,
+                        help=f"Tables to build (default: {' '.join(DEFAULT_TABLES)})")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="textract",
+                        help="Table extraction backend (default: textract)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="Most local tasks running at once (default: number of CPUs)")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT,
+                        help=f"Most S3/Textract tasks running at once (default: {DEFAULT_MAX_CONCURRENT})")
+    parser.add_argument("--only", nargs="+", metavar="YEAR", help="Only build these years")
+    parser.add_argument("--combine", action="store_true",
+                        help="Extract each multi-page table as one PDF and export it as one stitched sheet")
+    parser.add_argument("--dry-run", action="store_true", help="Print the stale tasks without running or writing anything")
+    parser.add_argument("--max-pixels", type=int,
+                        help="Largest page image a task decodes for OCR; bigger renders are "
+                             f"downscaled (default: RASTER_MAX_PIXELS or {DEFAULT_MAX_PIXELS:,})")
+    args = parser.parse_args()
+
+    if args.max_pixels:
+        os.environ["RASTER_MAX_PIXELS"] = str(args.max_pixels)
+
+    tasks = databuild(tables=args.tables, backend=args.backend, jobs=args.jobs, only=args.only,
+                      dry_run=args.dry_run, max_concurrent=args.max_concurrent, combine=args.combine)
+    if any(task.status == "failed" for task in tasks):
+        sys.exit(1)
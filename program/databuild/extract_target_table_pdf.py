@@ -1,14 +1,95 @@
+import os
 import sys
 import re
-import subprocess
-import tempfile
+import time
 from pathlib import Path
-from PIL import Image
 import pytesseract
+from pypdf import PdfReader, PdfWriter
 
-def extract_and_save_page(pdf_path, page_num, verbose=True, dir_name="mill-levies", orientation=0, suffix=""):
+from instrument import span
+from raster_cache import PageRasterCache, open_page, upright
+from text_layer import has_text_layer, page_text
+
+# Title of the target table in each output directory, used to verify pages
+TABLE_TITLES = {
+    "mill-levies": "Assessed Valuation, Revenue, and Average Levies",
+    "county-valuation": "County Valuation by Classification",
+}
+
+# Share of title words that must appear in the OCR text for a match
+TITLE_MATCH_THRESHOLD = 0.8
+
+# Title checks OCR a page rendered at VERIFY_DPI / VERIFY_SCALE; the title
+# is large type, so the downscaled render reads as well as the full one
+VERIFY_DPI = 300
+VERIFY_SCALE = 2
+
+def get_output_path(pdf_path, dir_name="mill-levies", suffix=""):
+    """
+    Get the path an extracted page is saved to.
+
+    Args:
+        pdf_path (str or Path): Path to the annual report PDF
+        dir_name (str): Directory name where the extracted page is saved
+        suffix (str): Suffix appended to the year for multi-page tables
+
+    Returns:
+        Path: Output PDF path, or None if the year cannot be determined
+    """
+    year_match = re.search(r'(\d{4})', Path(pdf_path).stem)
+    if not year_match:
+        return None
+
+    return Path("data") / "annual-reports" / dir_name / f"{year_match.group(1)}{suffix}.pdf"
+
+def save_pages(reader, pages, output_path):
+    """
+    Copy page objects out of a report into one PDF without re-rendering them.
+
+    Pages are rotated by setting their /Rotate attribute, so the output
+    keeps the original scans at their original resolution.
+
+    Args:
+        reader (PdfReader): Open annual report
+        pages (list): (page number (1-indexed), counter-clockwise rotation in
+            degrees, a multiple of 90) for each page, in output order
+        output_path (Path): Where to write the PDF
+    """
+    writer = PdfWriter()
+    for page_num, orientation in pages:
+        if orientation % 90:
+            raise ValueError(f"Orientation must be a multiple of 90 degrees, got {orientation}")
+
+        page = writer.add_page(reader.pages[page_num - 1])
+
+        # /Rotate turns the page clockwise; crosswalk orientations are counter-clockwise
+        if orientation % 360:
+            page.rotate((360 - orientation) % 360)
+
+    # Write to a temporary name so an interrupted run never leaves a partial file
+    temp_path = output_path.with_name(f".{output_path.name}.tmp")
+    with open(temp_path, 'wb') as f:
+        writer.write(f)
+    os.replace(temp_path, output_path)
+
+def save_page(reader, page_num, output_path, orientation=0):
     """
-    Extract text from a PDF page and save it as a properly oriented single-page PDF.
+    Copy one page object out of a report into its own PDF without re-rendering it.
+
+    Args:
+        reader (PdfReader): Open annual report
+        page_num (int): Page number to copy (1-indexed)
+        output_path (Path): Where to write the single-page PDF
+        orientation (int): Counter-clockwise rotation angle in degrees, a multiple of 90
+    """
+    save_pages(reader, [(page_num, orientation)], output_path)
+
+def extract_and_save_page(pdf_path, page_num, verbose=True, dir_name="mill-levies", orientation=0, suffix="", reader=None, overwrite=False):
+    """
+    Save a PDF page as a properly oriented single-page PDF.
+
+    Pages are not OCR'd here; see verify_page_ocr for the optional check
+    that a page holds the expected table.
     
     Args:
         pdf_path (str or Path): Path to the PDF file
@@ -17,6 +98,10 @@ def extract_and_save_page(pdf_path, page_num, verbose=True, dir_name="mill-levie
         dir_name (str): Directory name where to save the extracted page
         orientation (int): Rotation angle in degrees
         suffix (str): Suffix to append to the year for multi-page tables
+        reader (PdfReader): Already open report to copy from, so a caller
+            saving several pages of one report only parses it once
+        overwrite (bool): Whether to replace an existing output, e.g. when
+            the build manifest shows it is stale
         
     Returns:
         bool: True if page was found and saved, False otherwise
@@ -26,127 +111,183 @@ def extract_and_save_page(pdf_path, page_num, verbose=True, dir_name="mill-levie
         print(f"Processing page {page_num} of {pdf_path.name}...")
 
     # Get year from filename
-    year_match = re.search(r'(\d{4})', pdf_path.stem)
-    if not year_match:
+    output_path = get_output_path(pdf_path, dir_name, suffix)
+    if output_path is None:
         print(f"Could not determine year from filename: {pdf_path.name}")
         return False
 
-    year = year_match.group(1)
+    year = output_path.stem[:4]
 
     # Create output directory structure
-    data_dir = Path("data")
-    data_dir.mkdir(exist_ok=True, parents=True)
-    
-    output_dir = data_dir / "annual-reports" / dir_name
-    output_dir.mkdir(exist_ok=True, parents=True)
-
-    output_path = output_dir / f"{year}{suffix}.pdf"
+    output_path.parent.mkdir(exist_ok=True, parents=True)
 
     # Skip if output file already exists
-    if output_path.exists():
+    if output_path.exists() and not overwrite:
         print(f"{dir_name} page for {year}{suffix} already exists at {output_path}")
         return True
 
-    # Create a temporary directory for working files
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
-        img_prefix = f"page_{page_num}"
-
-        # Convert PDF page to image using pdftoppm with higher resolution
-        pdftoppm_cmd = [
-            "pdftoppm", 
-            "-png",               # Output format
-            "-r", "300",          # Higher resolution for better OCR
-            "-f", str(page_num),  # First page to convert
-            "-l", str(page_num),  # Last page to convert
-            "-singlefile",        # Create only one file
-            str(pdf_path),
-            str(temp_path / img_prefix)
-        ]
-
-        subprocess.run(pdftoppm_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        # The output will be named page_{page_num}.png
-        png_path = temp_path / f"{img_prefix}.png"
-
-        if not png_path.exists():
-            print(f"Failed to extract page {page_num}")
-            return False
+    if reader is None:
+        reader = PdfReader(pdf_path)
 
-        # Open the image
-        try:
-            img = Image.open(png_path)
-        except Exception as e:
-            print(f"Error opening image: {e}")
-            return False
+    if not 1 <= page_num <= len(reader.pages):
+        print(f"Failed to extract page {page_num}: {pdf_path.name} has {len(reader.pages)} pages")
+        return False
+
+    if verbose and orientation:
+        print(f"Rotating page {page_num} by {orientation}°")
+
+    save_page(reader, page_num, output_path, orientation)
+
+    print(f"✓ {dir_name} page saved to {output_path}")
+    return True
+
+def replaced_parts(output_path, dir_name="mill-levies"):
+    """
+    Get the per-page outputs of earlier runs that a combined table PDF replaces.
+
+    Args:
+        output_path (Path): Combined PDF, data/annual-reports/<dir>/<year>.pdf
+        dir_name (str): Table directory name
+
+    Returns:
+        list: Part PDFs (<year>a.pdf, <year>b.pdf, ...) and their workbooks in derived/<dir>/
+    """
+    year = Path(output_path).stem
+    return (sorted(Path(output_path).parent.glob(f"{year}[a-z].pdf"))
+            + sorted((Path("derived") / dir_name).glob(f"{year}[a-z].xlsx")))
+
+def extract_and_save_pages(pdf_path, pages, dir_name="mill-levies", reader=None, overwrite=False):
+    """
+    Save all pages of a multi-page table as one PDF, data/annual-reports/<dir>/<year>.pdf.
+
+    Per-page parts of the same table from earlier runs (<year>a.pdf,
+    <year>b.pdf, ...) and the workbooks built from them are removed, so
+    they are not uploaded, analyzed or read alongside the combined file.
+
+    Args:
+        pdf_path (str or Path): Path to the annual report
+        pages (list): (page number, orientation) for each page of the table, in order
+        dir_name (str): Directory name where to save the combined PDF
+        reader (PdfReader): Already open report to copy from
+        overwrite (bool): Whether to replace an existing output
+
+    Returns:
+        bool: True if the pages were found and saved, False otherwise
+    """
+    pdf_path = Path(pdf_path)
+    output_path = get_output_path(pdf_path, dir_name)
+    if output_path is None:
+        print(f"Could not determine year from filename: {pdf_path.name}")
+        return False
 
-        # Try different orientations for better results
-        best_text = ""
-        best_orientation = orientation
-        max_text_len = 0
-
-        if orientation > 0:
-            rotated_img = img.rotate(orientation, expand=True)
-        else:
-            rotated_img = img
-
-        # Try with different page segmentation modes
-        for psm in [6]:  # Assume single uniform block
-            config = f'--psm {psm}'
-            text = pytesseract.image_to_string(rotated_img, config=config)
-
-            # Keep the result with the most characters
-            if len(text) > max_text_len:
-                max_text_len = len(text)
-                best_text = text
-                best_orientation = orientation
-                if verbose:
-                    print(f"Found better text with orientation {orientation}° and PSM {psm}")
-
-        # Create temporary PDF with correct orientation
-        if best_orientation != 0:
-            # First, save rotated image
-            rotated_img = img.rotate(best_orientation, expand=True)
-            rotated_img_path = temp_path / f"rotated_{img_prefix}.png"
-            rotated_img.save(rotated_img_path)
-
-            # Convert rotated image to PDF
-            img_to_pdf_cmd = [
-                "convert",
-                str(rotated_img_path),
-                str(temp_path / "rotated_page.pdf")
-            ]
-
-            try:
-                subprocess.run(img_to_pdf_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                temp_pdf_path = temp_path / "rotated_page.pdf"
-            except Exception as e:
-                print(f"Error converting image to PDF with ImageMagick: {e}")
-                print("Falling back to original orientation...")
-                temp_pdf_path = None
-        else:
-            temp_pdf_path = None
-
-        # If rotation was successful, use the rotated PDF, otherwise extract from original
-        if temp_pdf_path and temp_pdf_path.exists():
-            # Copy the rotated PDF to the output location
-            copy_cmd = ["cp", str(temp_pdf_path), str(output_path)]
-            subprocess.run(copy_cmd, check=True)
-        else:
-            # Extract original page to a PDF if rotation fails
-            extract_cmd = [
-                "pdftocairo", 
-                "-pdf",        # Output format
-                "-f", str(page_num),  # First page
-                "-l", str(page_num),  # Last page
-                str(pdf_path),
-                str(output_path.with_suffix('.pdf'))
-            ]
-            subprocess.run(extract_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        print(f"✓ {dir_name} page saved to {output_path}")
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    if output_path.exists() and not overwrite:
+        print(f"{dir_name} pages for {output_path.stem} already exist at {output_path}")
         return True
 
+    if reader is None:
+        reader = PdfReader(pdf_path)
+
+    for page_num, _ in pages:
+        if not 1 <= page_num <= len(reader.pages):
+            print(f"Failed to extract page {page_num}: {pdf_path.name} has {len(reader.pages)} pages")
+            return False
+
+    save_pages(reader, pages, output_path)
+
+    for part_path in replaced_parts(output_path, dir_name):
+        part_path.unlink(missing_ok=True)
+
+    print(f"✓ {dir_name} pages {', '.join(str(page_num) for page_num, _ in pages)} saved to {output_path}")
+    return True
+
+def title_score(text, title):
+    """
+    Score how much of a table title appears in OCR output.
+
+    Args:
+        text (str): OCR output for the page
+        title (str): Expected table title
+
+    Returns:
+        float: Share of the title's words found in the text (0 to 1)
+    """
+    words = set(re.findall(r'[a-z]+', text.lower()))
+    title_words = re.findall(r'[a-z]+', title.lower())
+    if not title_words:
+        return 0.0
+
+    return sum(word in words for word in title_words) / len(title_words)
+
+def verify_page_ocr(pdf_path, page_num, dir_name="mill-levies", orientation=0, scale=VERIFY_SCALE, reader=None):
+    """
+    Check that a page holds the expected table from its title.
+
+    The title is looked up in the page's text layer when it has one;
+    otherwise the page is rendered straight at VERIFY_DPI // scale and
+    OCR'd, so no full-resolution render is made or decoded just to be
+    thrown away. That render is cached under its own dpi; no later step
+    needs a 300 dpi render of the report page (table OCR renders the
+    extracted PDF instead).
+
+    Args:
+        pdf_path (str or Path): Path to the PDF file
+        page_num (int): Page number to check (1-indexed)
+        dir_name (str): Table directory name, used to look up the expected title
+        orientation (int): Rotation angle in degrees
+        scale (int): Factor to lower the resolution by from VERIFY_DPI
+        reader (PdfReader): Already open reader for pdf_path, to avoid parsing it again
+
+    Returns:
+        dict: Verification record with the expected title, whether it was found,
+            the share of title words found, where the text came from
+            ('text_layer' or 'ocr'), its character count and OCR time
+    """
+    title = TABLE_TITLES.get(dir_name, "")
+    record = {
+        "report": Path(pdf_path).name,
+        "page_num": page_num,
+        "dir_name": dir_name,
+        "orientation": orientation,
+        "expected_title": title,
+        "title_found": False,
+        "title_score": 0.0,
+        "text_source": None,
+        "ocr_chars": 0,
+        "ocr_seconds": 0.0,
+        "error": None,
+    }
+
+    if reader is None:
+        reader = PdfReader(pdf_path)
+
+    text = page_text(reader.pages[page_num - 1])
+    if has_text_layer(text=text):
+        record["text_source"] = "text_layer"
+        record["ocr_chars"] = len(text)
+        record["title_score"] = title_score(text, title)
+        record["title_found"] = record["title_score"] >= TITLE_MATCH_THRESHOLD
+        return record
+
+    png_path = PageRasterCache().get(pdf_path, page_num, dpi=VERIFY_DPI // scale)
+    if png_path is None:
+        record["error"] = "page could not be rendered"
+        return record
+
+    small_img = upright(open_page(png_path), orientation)
+
+    start = time.perf_counter()
+    with span("tesseract", pixels=small_img.width * small_img.height):
+        text = pytesseract.image_to_string(small_img, config="--psm 6")  # Assume single uniform block
+    record["ocr_seconds"] = time.perf_counter() - start
+
+    record["text_source"] = "ocr"
+    record["ocr_chars"] = len(text)
+    record["title_score"] = title_score(text, title)
+    record["title_found"] = record["title_score"] >= TITLE_MATCH_THRESHOLD
+
+    return record
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Usage:")
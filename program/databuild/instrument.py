@@ -0,0 +1,268 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+# Spans of every run are appended here; set INSTRUMENT_TRACE to write elsewhere
+TRACE_PATH = Path(os.environ.get("INSTRUMENT_TRACE", PROJECT_ROOT / "derived" / "trace.jsonl"))
+
+# A run starting on a trace larger than this rotates it to trace.jsonl.1,
+# .2, ..., keeping this many old files
+MAX_TRACE_BYTES = int(os.environ.get("INSTRUMENT_TRACE_MAX_BYTES", 50 * 2**20))
+TRACE_BACKUPS = 3
+
+# Run ID shared with worker processes through the environment
+RUN_ENV = "INSTRUMENT_RUN"
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+# Stage, year and nesting depth of the innermost open span
+_current = ContextVar("instrument_span", default={"stage": None, "year": None, "depth": 0})
+_write_lock = threading.Lock()
+
+def start_run():
+    """
+    Start a new run; spans recorded from here on, also in worker processes started later, share its ID.
+
+    Rotates the trace first if it has grown past MAX_TRACE_BYTES, so a run's
+    spans stay in one file.
+
+    Returns:
+        str: The run ID
+    """
+    try:
+        rotate_trace()
+    except OSError:
+        pass  # never fail the pipeline over its trace
+
+    run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    os.environ[RUN_ENV] = run_id
+    return run_id
+
+def trace_files(path=None):
+    """Get the trace and its rotated copies that exist, newest first."""
+    path = Path(path or TRACE_PATH)
+    candidates = [path] + [path.with_name(f"{path.name}.{i}") for i in range(1, TRACE_BACKUPS + 1)]
+    return [candidate for candidate in candidates if candidate.exists()]
+
+def rotate_trace(path=None, max_bytes=None):
+    """
+    Move the trace to trace.jsonl.1 (and older copies up by one) if it is larger than max_bytes.
+
+    Returns:
+        bool: True if the trace was rotated
+    """
+    path = Path(path or TRACE_PATH)
+    max_bytes = MAX_TRACE_BYTES if max_bytes is None else max_bytes
+    if not path.exists() or path.stat().st_size <= max_bytes:
+        return False
+
+    for i in range(TRACE_BACKUPS - 1, 0, -1):
+        older = path.with_name(f"{path.name}.{i}")
+        if older.exists():
+            os.replace(older, path.with_name(f"{path.name}.{i + 1}"))
+    os.replace(path, path.with_name(f"{path.name}.1"))
+    return True
+
+def run_id():
+    """Get the ID of the current run, starting one if needed."""
+    return os.environ.get(RUN_ENV) or start_run()
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * RSS_UNIT / 2**20, 1)
+
+def _write(record, path=None):
+    """Append one span as a JSON line; one write per line so processes can share the file."""
+    path = Path(path or TRACE_PATH)
+    line = (json.dumps(record, default=str) + "\n").encode()
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with _write_lock:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+@contextmanager
+def span(name, stage=None, year=None, cpu=True, **fields):
+    """
+    Time a block of work and append it to the trace as one JSON line.
+
+    Stage and year default to those of the enclosing span, so operations
+    deep in the pipeline (a pdftoppm call, an S3 request) are attributed
+    to the page or table they were done for.
+
+    Records wall time, CPU time of the calling thread plus any child
+    processes it waited for (pdftoppm, tesseract), the process's peak RSS
+    so far, and bytes_in/bytes_out if the block sets them on the yielded
+    record. With threads running subprocesses concurrently, child CPU time
+    is shared out among their spans only approximately.
+
+    Args:
+        name (str): Operation, e.g. 'pdftoppm', 's3_upload', 'textract_poll'
+        stage (str): Pipeline stage (extract, upload, analyze, export)
+        year (str): Year or year/part the work is for
+        cpu (bool): Whether to measure CPU time; off for spans around
+            coroutines, whose thread runs other work while they wait
+        **fields: Extra fields to record
+
+    Yields:
+        dict: The record, for the block to add fields such as bytes_out
+    """
+    parent = _current.get()
+    context = {
+        "stage": stage or parent["stage"],
+        "year": str(year) if year is not None else parent["year"],
+        "depth": parent["depth"] + 1,
+    }
+    token = _current.set(context)
+
+    record = {"run": run_id(), "name": name, "stage": context["stage"], "year": context["year"],
+              "depth": parent["depth"], "bytes_in": None, "bytes_out": None, **fields}
+    started = time.time()
+    wall = time.perf_counter()
+    thread_cpu, children_cpu = time.thread_time(), _children_cpu()
+    record["status"] = "ok"
+
+    try:
+        yield record
+    except BaseException as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        record.update(
+            start=round(started, 3),
+            wall=round(time.perf_counter() - wall, 4),
+            cpu=round(time.thread_time() - thread_cpu + _children_cpu() - children_cpu, 4) if cpu else None,
+            peak_rss_mb=_peak_rss_mb(),
+            pid=os.getpid(),
+        )
+        try:
+            _write(record)
+        except OSError:
+            pass  # never fail the pipeline over its trace
+
+def traced(fn, name, **span_args):
+    """Wrap fn so each call runs in a span, e.g. for a call handed to asyncio.to_thread."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(name, **span_args):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def load_spans(run=None, path=None):
+    """
+    Read the spans of one run from the trace, looking in its rotated copies for older runs.
+
+    Args:
+        run (str): Run ID, or None for the run of the last span written
+
+    Returns:
+        list: Span records
+    """
+    for trace_path in trace_files(path):
+        spans = []
+        with open(trace_path, 'r') as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # line cut short by an interrupted write
+
+        if run is None and spans:
+            run = spans[-1]["run"]
+        spans = [s for s in spans if s["run"] == run]
+        if spans:
+            return spans
+
+    return []
+
+def summarize(spans):
+    """
+    Total the spans of a run by stage and year, and by operation.
+
+    Stage/year totals use the outermost spans only, so nested operations
+    are not counted twice; operation totals count every span.
+
+    Returns:
+        tuple: (stage rows, operation rows), each a list of dicts
+    """
+    def add(totals, key, s):
+        row = totals.setdefault(key, {"spans": 0, "failed": 0, "wall": 0.0, "cpu": 0.0,
+                                      "peak_rss_mb": 0.0, "bytes_in": 0, "bytes_out": 0})
+        row["spans"] += 1
+        row["failed"] += s["status"] != "ok"
+        row["wall"] += s["wall"]
+        row["cpu"] += s["cpu"] or 0.0
+        row["peak_rss_mb"] = max(row["peak_rss_mb"], s["peak_rss_mb"] or 0.0)
+        row["bytes_in"] += s["bytes_in"] or 0
+        row["bytes_out"] += s["bytes_out"] or 0
+
+    stages, operations = {}, {}
+    for s in spans:
+        if s["depth"] == 0:
+            add(stages, (s["stage"] or "-", s["year"] or "-"), s)
+        add(operations, (s["stage"] or "-", s["name"]), s)
+
+    stage_rows = [{"stage": stage, "year": year, **row} for (stage, year), row in sorted(stages.items())]
+    operation_rows = [{"stage": stage, "name": name, **row}
+                      for (stage, name), row in sorted(operations.items(), key=lambda item: -item[1]["wall"])]
+    return stage_rows, operation_rows
+
+def print_report(run=None, path=None):
+    """Print per-stage/per-year and per-operation totals for a run (default: the current one)."""
+    path = Path(path or TRACE_PATH)
+    run = run or os.environ.get(RUN_ENV)
+    spans = load_spans(run, path)
+    if not spans:
+        print(f"\nNo spans recorded in {path}")
+        return
+
+    stage_rows, operation_rows = summarize(spans)
+    wall = max(s["start"] + s["wall"] for s in spans) - min(s["start"] for s in spans)
+
+    print(f"\nRun Report ({spans[0]['run']}, {len(spans)} spans, {wall:.1f}s):")
+    print(f"{'Stage':<10} {'Year':<7} {'Spans':>6} {'Failed':>6} {'Wall (s)':>9} {'CPU (s)':>8} {'Peak RSS (MB)':>14}")
+    for row in stage_rows:
+        print(f"{row['stage']:<10} {row['year']:<7} {row['spans']:>6} {row['failed']:>6} "
+              f"{row['wall']:>9.1f} {row['cpu']:>8.1f} {row['peak_rss_mb']:>14.0f}")
+
+    print(f"\n{'Stage':<10} {'Operation':<18} {'Calls':>6} {'Wall (s)':>9} {'CPU (s)':>8} {'MB in':>8} {'MB out':>8}")
+    for row in operation_rows:
+        print(f"{row['stage']:<10} {row['name']:<18} {row['spans']:>6} {row['wall']:>9.1f} {row['cpu']:>8.1f} "
+              f"{row['bytes_in'] / 2**20:>8.1f} {row['bytes_out'] / 2**20:>8.1f}")
+    print(f"Trace: {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the timing trace of a pipeline run.")
+    parser.add_argument("--run", help="Run ID (default: the most recent run in the trace)")
+    parser.add_argument("--trace", type=Path, default=TRACE_PATH, help=f"Trace file (default: {TRACE_PATH})")
+    args = parser.parse_args()
+
+    print_report(args.run, args.trace)
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+from pathlib import Path
+import argparse
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from instrument import print_report, span, start_run
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+# Shared by every worker draining the queue; put it on a shared filesystem
+# to drain it from several machines. Override with JOBQUEUE_PATH
+QUEUE_PATH = Path(os.environ.get("JOBQUEUE_PATH", PROJECT_ROOT / "derived" / "jobs.sqlite"))
+
+# SQLite's WAL mode needs shared memory, which network filesystems do not
+# provide; queues on these use the rollback journal instead
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "9p", "ceph", "glusterfs",
+                       "lustre", "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs"}
+
+# Stages in dependency order: a part's tables are extracted once its PDF is uploaded
+STAGES = ["upload", "tables"]
+
+# A task is failed for good after this many attempts, until retry-failed
+MAX_ATTEMPTS = 3
+
+# Seconds a worker holds a task before another worker may take it over;
+# longer than a Textract job's max_wait_time
+LEASE_SECONDS = 1800
+
+# Seconds an idle worker waits before looking for tasks again while others
+# hold the tasks it depends on
+IDLE_SLEEP = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    stage TEXT NOT NULL,
+    dir_name TEXT NOT NULL,
+    part TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    external_id TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    enqueued REAL,
+    started REAL,
+    finished REAL,
+    elapsed REAL,
+    PRIMARY KEY (stage, dir_name, part)
+)
+"""
+
+def filesystem_type(path):
+    """Get the type of the filesystem a path is on from /proc/mounts, or None where that is unavailable."""
+    try:
+        with open("/proc/mounts", 'r') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return None
+
+    path = str(Path(path).resolve())
+    best = ("", None)
+    for mount_point, fs_type in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) > len(best[0]):
+            best = (mount_point, fs_type)
+    return best[1]
+
+class JobQueue:
+    """
+    Durable queue of pipeline tasks in SQLite, one row per (stage, table, year/part).
+
+    Tasks move pending -> leased -> done, or back to pending after a
+    failed attempt until MAX_ATTEMPTS is reached, then failed. A lease
+    expires after lease_seconds, so tasks held by a worker that crashed
+    or was killed are picked up again by the others. Tasks whose earlier
+    stage failed for good are blocked until retry-failed resets it.
+
+    Every state change is its own transaction, so the queue can be shared
+    by worker threads, processes and (on a shared filesystem) machines.
+    """
+
+    def __init__(self, path=QUEUE_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, shared=None):
+        """
+        Args:
+            path (Path): Queue database
+            lease_seconds (int): Seconds before a silent worker's task is reassigned
+            max_attempts (int): Attempts before a task is marked failed
+            shared (bool): Whether workers on other machines use the database;
+                detected from its filesystem type by default
+        """
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._local = threading.local()
+
+        if shared is None:
+            shared = filesystem_type(self.path.parent) in NETWORK_FILESYSTEMS
+        self.shared = shared
+
+        # WAL lets readers (status) run while a worker writes, but only on a local disk
+        self._connect().db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        with self._connect() as db:
+            db.execute(SCHEMA)
+
+    def _connect(self):
+        """Get this thread's connection; sqlite3 connections cannot be shared across threads."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return _Transaction(db)
+
+    def enqueue(self, stage, dir_name, part, backend):
+        """
+        Add a task, or make a finished one pending again so its output is rechecked.
+
+        Idempotent: pending, leased and failed tasks are left as they are.
+
+        Returns:
+            bool: True if the task was added or reset
+        """
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO tasks (stage, dir_name, part, backend, enqueued) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (stage, dir_name, part) DO UPDATE SET status = 'pending', attempts = 0, "
+                "external_id = NULL, backend = excluded.backend, enqueued = excluded.enqueued "
+                "WHERE status = 'done'",
+                (stage, dir_name, part, backend, now),
+            )
+            return cursor.rowcount > 0
+
+    def lease(self, owner, stages=None):
+        """
+        Claim the next runnable task.
+
+        A task is runnable when it is pending, or leased with an expired
+        lease, and every earlier stage of the same part is done.
+
+        Args:
+            owner (str): Worker ID holding the lease
+            stages (list): Only lease tasks of these stages
+
+        Returns:
+            sqlite3.Row: The leased task, or None if nothing is runnable now
+        """
+        now = time.time()
+        stages = stages or STAGES
+        with self._connect() as db:
+            # A worker that keeps dying on a task uses up its attempts too
+            db.execute(
+                "UPDATE tasks SET status = 'failed', last_error = 'lease expired ' || attempts || ' times', "
+                "lease_owner = NULL, lease_expires = NULL "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            self._block_dependents(db)
+            row = db.execute(
+                f"""
+                SELECT * FROM tasks AS t
+                WHERE (t.status = 'pending' OR (t.status = 'leased' AND t.lease_expires < ?))
+                  AND t.stage IN ({','.join('?' * len(stages))})
+                  AND NOT EXISTS (
+                      SELECT 1 FROM tasks AS d
+                      WHERE d.dir_name = t.dir_name AND d.part = t.part AND d.status != 'done'
+                        AND instr(?, d.stage) < instr(?, t.stage)
+                  )
+                ORDER BY t.part, instr(?, t.stage), t.dir_name
+                LIMIT 1
+                """,
+                (now, *stages, *[" ".join(STAGES)] * 3),
+            ).fetchone()
+            if row is None:
+                return None
+
+            key = (row["stage"], row["dir_name"], row["part"])
+            db.execute(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, started = ?, finished = NULL WHERE stage = ? AND dir_name = ? AND part = ?",
+                (owner, now + self.lease_seconds, now, *key),
+            )
+            return db.execute("SELECT * FROM tasks WHERE stage = ? AND dir_name = ? AND part = ?", key).fetchone()
+
+    @staticmethod
+    def _block_dependents(db):
+        """Block pending tasks whose earlier stage failed for good, so workers stop waiting on them."""
+        db.execute(
+            """
+            UPDATE tasks SET status = 'blocked', last_error = 'an earlier stage failed'
+            WHERE status = 'pending' AND EXISTS (
+                SELECT 1 FROM tasks AS d
+                WHERE d.dir_name = tasks.dir_name AND d.part = tasks.part
+                  AND d.status IN ('failed', 'blocked') AND instr(?, d.stage) < instr(?, tasks.stage)
+            )
+            """,
+            (" ".join(STAGES),) * 2,
+        )
+
+    def _finish(self, task, owner, assignments, values):
+        with self._connect() as db:
+            cursor = db.execute(
+                f"UPDATE tasks SET {assignments}, lease_owner = NULL, lease_expires = NULL, finished = ?, "
+                "elapsed = ? - started WHERE stage = ? AND dir_name = ? AND part = ? AND lease_owner = ?",
+                (*values, time.time(), time.time(), task["stage"], task["dir_name"], task["part"], owner),
+            )
+            if not cursor.rowcount:
+                print(f"Lease on {task_label(task)} expired and was taken over; result not recorded")
+            self._block_dependents(db)
+
+    def set_external_id(self, task, external_id):
+        """Record the ID of the external job (e.g. Textract) a task is waiting on."""
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET external_id = ? WHERE stage = ? AND dir_name = ? AND part = ?",
+                       (external_id, task["stage"], task["dir_name"], task["part"]))
+
+    def complete(self, task, owner):
+        """Mark a leased task done."""
+        self._finish(task, owner, "status = 'done', last_error = NULL", ())
+
+    def fail(self, task, owner, error):
+        """Record a failed attempt; the task goes back to pending unless it is out of attempts."""
+        status = "failed" if task["attempts"] >= self.max_attempts else "pending"
+        self._finish(task, owner, "status = ?, last_error = ?", (status, error))
+
+    def release(self, task, owner):
+        """Give back a task that was interrupted before it ran to completion, without counting the attempt."""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE tasks SET status = 'pending', attempts = attempts - 1, lease_owner = NULL, "
+                "lease_expires = NULL WHERE stage = ? AND dir_name = ? AND part = ? AND lease_owner = ?",
+                (task["stage"], task["dir_name"], task["part"], owner),
+            )
+
+    def retry_failed(self, stage=None, dir_name=None):
+        """
+        Make failed tasks pending again with a fresh set of attempts.
+
+        Tasks blocked on them become pending again too; tasks whose
+        earlier stage is still failed stay blocked.
+
+        Returns:
+            int: Number of failed tasks reset
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET status = 'pending', attempts = 0 WHERE status = 'failed' "
+                "AND (? IS NULL OR stage = ?) AND (? IS NULL OR dir_name = ?)",
+                (stage, stage, dir_name, dir_name),
+            )
+            db.execute("UPDATE tasks SET status = 'pending', last_error = NULL WHERE status = 'blocked'")
+            self._block_dependents(db)
+            return cursor.rowcount
+
+    def counts(self):
+        """Get the number of tasks by (stage, status)."""
+        with self._connect() as db:
+            rows = db.execute("SELECT stage, status, COUNT(*) AS n FROM tasks GROUP BY stage, status").fetchall()
+        return {(row["stage"], row["status"]): row["n"] for row in rows}
+
+    def tasks(self, status=None):
+        """List tasks, optionally only those with a status, in pipeline order."""
+        with self._connect() as db:
+            return db.execute(
+                "SELECT * FROM tasks WHERE (? IS NULL OR status = ?) ORDER BY dir_name, part, instr(?, stage)",
+                (status, status, " ".join(STAGES)),
+            ).fetchall()
+
+    def remaining(self, stages=None):
+        """
+        Get the number of tasks that can still run: pending or leased, and not blocked by a failed stage.
+
+        Args:
+            stages (list): Only count tasks of these stages
+        """
+        stages = stages or STAGES
+        with self._connect() as db:
+            self._block_dependents(db)
+            return db.execute(
+                f"SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased') "
+                f"AND stage IN ({','.join('?' * len(stages))})",
+                stages,
+            ).fetchone()[0]
+
+class _Transaction:
+    """Run a block in an immediate transaction, so a read-then-update (like leasing) is atomic."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+def task_label(task):
+    return f"{task['stage']}:{task['dir_name']}/{task['part']}"
+
+def enqueue_table(queue, dir_name, backend="textract", only=None):
+    """
+    Add an upload task (if the backend reads from S3) and a tables task for each extracted PDF of a table.
+
+    Args:
+        queue (JobQueue): Queue to add to
+        dir_name (str): Table directory in data/annual-reports/
+        backend (str): Table extraction backend the tables tasks use
+        only (set): Years to enqueue, or None for all
+
+    Returns:
+        int: Number of tasks added or reset
+    """
+    from table_backends import BACKENDS
+
+    stages = STAGES if BACKENDS[backend].requires_upload else ["tables"]
+    pdf_dir = PROJECT_ROOT / "data" / "annual-reports" / dir_name
+
+    n_tasks = 0
+    for pdf_path in sorted(pdf_dir.glob("*.pdf")):
+        if only is not None and pdf_path.stem[:4] not in only:
+            continue
+        for stage in stages:
+            n_tasks += queue.enqueue(stage, dir_name, pdf_path.stem, backend)
+
+    return n_tasks
+
+class TaskRunner:
+    """
+    Runs queued tasks with the pipeline's own upload and table extraction code.
+
+    Clients, S3 listings and backends are created once and shared by the
+    worker threads of a process.
+    """
+
+    def __init__(self, s3_bucket=None):
+        from upload_check import DEFAULT_BUCKET
+        from manifest import BuildManifest
+
+        self.s3_bucket = s3_bucket or DEFAULT_BUCKET
+        self.manifest = BuildManifest()
+        self.manifest_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.s3_client = None
+        self.listings = {}
+        self.backends = {}
+
+    def s3_listing(self, dir_name):
+        """Get the S3 client and the listing of a table's prefix, fetched once per process."""
+        from upload_check import get_s3_client, list_objects
+
+        with self.lock:
+            if self.s3_client is None:
+                self.s3_client = get_s3_client()
+            if dir_name not in self.listings:
+                self.listings[dir_name] = list_objects(self.s3_client, self.s3_bucket, f"{dir_name}/")
+            return self.s3_client, self.listings[dir_name]
+
+    def backend(self, name):
+        from table_backends import get_backend
+
+        with self.lock:
+            if name not in self.backends:
+                options = {"s3_bucket": self.s3_bucket} if name == "textract" else {}
+                self.backends[name] = get_backend(name, **options)
+            return self.backends[name]
+
+    def run(self, queue, task):
+        """Run one task; raises if it fails."""
+        if task["stage"] == "upload":
+            self.upload(task)
+        else:
+            self.tables(queue, task)
+
+    def upload(self, task):
+        from upload_check import sync_file
+
+        pdf_path = PROJECT_ROOT / "data" / "annual-reports" / task["dir_name"] / f"{task['part']}.pdf"
+        s3_client, listing = self.s3_listing(task["dir_name"])
+        sync_file(s3_client, pdf_path, self.s3_bucket, f"{task['dir_name']}/{pdf_path.name}", listing)
+
+    def tables(self, queue, task):
+        from manifest import table_inputs
+
+        backend = self.backend(task["backend"])
+        part = task["part"]
+        source = backend.source_for(task["dir_name"], part)
+        excel_output_path = PROJECT_ROOT / "derived" / task["dir_name"] / f"{part}.xlsx"
+        excel_output_path.parent.mkdir(exist_ok=True, parents=True)
+
+        # The object's ETag is read fresh: the upload may have run in another worker
+        s3_etag = None
+        if backend.requires_upload:
+            from upload_check import object_etag
+
+            s3_client, _ = self.s3_listing(task["dir_name"])
+            s3_etag = object_etag(s3_client, self.s3_bucket, f"{task['dir_name']}/{part}.pdf")
+
+        inputs = table_inputs(source, backend.name, backend.versions(), s3_etag)
+        with self.manifest_lock:
+            self.manifest.adopt(excel_output_path, inputs)
+            stale = self.manifest.is_stale(excel_output_path, inputs)
+        if not stale:
+            return
+
+        # The Textract job ID is recorded as soon as the job starts, so a
+        # worker that dies while polling leaves it for the next attempt
+        with span("analyze", stage="analyze", year=part):
+            result = backend.analyze(part, source, job_id=task["external_id"],
+                                     on_job=lambda job_id: queue.set_external_id(task, job_id))
+
+        with span("export", stage="export", year=part):
+            backend.export(result, part, excel_output_path)
+
+        with self.manifest_lock:
+            self.manifest.record(excel_output_path, inputs)
+            self.manifest.save()
+
+def work(queue, workers=4, stages=None, s3_bucket=None, wait=True):
+    """
+    Drain the queue with worker threads until no task is pending or leased.
+
+    Tasks that fail are retried (by this or any other worker) until they
+    run out of attempts. On Ctrl-C, tasks this process holds are handed
+    back without counting the attempt.
+
+    Args:
+        queue (JobQueue): Queue to drain
+        workers (int): Tasks to run at once in this process
+        stages (list): Only run tasks of these stages
+        s3_bucket (str): Bucket PDFs are uploaded to and read from
+        wait (bool): Whether to wait for tasks held by other workers
+            instead of exiting when nothing is runnable
+
+    Returns:
+        dict: Counts of tasks this process completed and failed
+    """
+    start_run()
+    runner = TaskRunner(s3_bucket)
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    counts = {"done": 0, "failed": 0}
+    counts_lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(n):
+        owner = f"{host}:{n}"
+        while not stop.is_set():
+            task = queue.lease(owner, stages)
+            if task is None:
+                if not wait or not queue.remaining(stages):
+                    return
+                stop.wait(IDLE_SLEEP)
+                continue
+
+            label = task_label(task)
+            start = time.perf_counter()
+            try:
+                runner.run(queue, task)
+            except Exception as e:
+                queue.fail(task, owner, str(e))
+                with counts_lock:
+                    counts["failed"] += 1
+                print(f"[ failed] {label} attempt {task['attempts']}: {e}")
+                continue
+            except BaseException:
+                queue.release(task, owner)
+                raise
+
+            queue.complete(task, owner)
+            with counts_lock:
+                counts["done"] += 1
+            print(f"[     ok] {label} ({time.perf_counter() - start:.1f}s)")
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        print("\nInterrupted; handing back leased tasks")
+        stop.set()
+        for task in queue.tasks("leased"):
+            if task["lease_owner"] and task["lease_owner"].startswith(f"{host}:"):
+                queue.release(task, task["lease_owner"])
+        raise
+
+    # Print summary
+    print("\nWork Summary:")
+    print(f"Completed: {counts['done']} tasks")
+    print(f"Failed attempts: {counts['failed']}")
+    print_status(queue)
+    print_report()
+    return counts
+
+def print_status(queue, show_failed=True):
+    """Print task counts by stage and status, and the failed tasks with their last error."""
+    counts = queue.counts()
+    statuses = ["pending", "leased", "done", "failed", "blocked"]
+    print(f"\n{'Stage':<8} " + " ".join(f"{status:>8}" for status in statuses))
+    for stage in STAGES:
+        print(f"{stage:<8} " + " ".join(f"{counts.get((stage, status), 0):>8}" for status in statuses))
+
+    if show_failed:
+        failed = queue.tasks("failed")
+        if failed:
+            print("Failed tasks:")
+        for task in failed:
+            print(f"  - {task_label(task)} after {task['attempts']} attempts: {task['last_error']}")
+
+    leased = queue.tasks("leased")
+    for task in leased:
+        expires = task["lease_expires"] - time.time()
+        external = f", job {task['external_id']}" if task["external_id"] else ""
+        print(f"  * {task_label(task)} leased by {task['lease_owner']} "
+              f"({'expired' if expires < 0 else f'{expires:.0f}s left'}{external})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Durable task queue for uploading table PDFs and extracting their tables.",
+        epilog="Example: python program/databuild/jobqueue.py enqueue mill-levies county-valuation && "
+               "python program/databuild/jobqueue.py work --workers 8"
+    )
+    parser.add_argument("--queue", type=Path, default=QUEUE_PATH,
+                        help=f"Queue database (default: {QUEUE_PATH}; JOBQUEUE_PATH overrides it)")
+    parser.add_argument("--shared", action="store_true", default=None,
+                        help="Use the rollback journal instead of WAL, for a queue on a network filesystem "
+                             "that is not detected as one")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Add tasks for the extracted PDFs of one or more tables")
+    enqueue_parser.add_argument("tables", nargs="+", help="Table directories, e.g. mill-levies")
+    enqueue_parser.add_argument("--backend", choices=["textract", "local"], default="textract",
+                                help="Table extraction backend (default: textract)")
+    enqueue_parser.add_argument("--only", nargs="+", metavar="YEAR", help="Only enqueue these years")
+
+    work_parser = commands.add_parser("work", help="Run queued tasks until the queue is drained")
+    work_parser.add_argument("--workers", type=int, default=4, help="Tasks to run at once (default: 4)")
+    work_parser.add_argument("--stages", nargs="+", choices=STAGES, help="Only run these stages")
+    work_parser.add_argument("--bucket", help="S3 bucket (default: upload_check.DEFAULT_BUCKET)")
+    work_parser.add_argument("--no-wait", action="store_true",
+                             help="Exit when nothing is runnable instead of waiting on tasks other workers hold")
+    work_parser.add_argument("--lease", type=int, default=LEASE_SECONDS,
+                             help=f"Seconds before a task held by a silent worker is reassigned (default: {LEASE_SECONDS})")
+    work_parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                             help=f"Attempts before a task is marked failed (default: {MAX_ATTEMPTS})")
+
+    retry_parser = commands.add_parser("retry-failed", help="Make failed tasks, and those blocked on them, pending again")
+    retry_parser.add_argument("--stage", choices=STAGES, help="Only tasks of this stage")
+    retry_parser.add_argument("--table", help="Only tasks of this table")
+
+    commands.add_parser("status", help="Show task counts, failed tasks and current leases")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        queue = JobQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts, shared=args.shared)
+    else:
+        queue = JobQueue(args.queue, shared=args.shared)
+
+    if args.command == "enqueue":
+        only = set(args.only) if args.only else None
+        for dir_name in args.tables:
+            print(f"{dir_name}: {enqueue_table(queue, dir_name, args.backend, only)} tasks added or reset")
+        print_status(queue, show_failed=False)
+    elif args.command == "work":
+        work(queue, workers=args.workers, stages=args.stages, s3_bucket=args.bucket,
+             wait=not args.no_wait)
+        if queue.tasks("failed"):
+            sys.exit(1)
+    elif args.command == "retry-failed":
+        print(f"{queue.retry_failed(args.stage, args.table)} failed tasks made pending again")
+    else:
+        print_status(queue)
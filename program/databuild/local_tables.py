@@ -0,0 +1,288 @@
+from pathlib import Path
+from statistics import median
+import re
+
+import pandas as pd
+from pypdf import PdfReader
+
+from instrument import span
+from raster_cache import PageRasterCache, open_page
+from text_layer import has_text_layer, page_words
+
+# Tesseract words below this confidence are treated as noise
+MIN_WORD_CONFIDENCE = 30
+
+# Rows at the top of a table's first page that continuation pages may repeat
+HEADER_ROWS = 3
+
+def ocr_words(img):
+    """
+    OCR an image into positioned words.
+
+    Args:
+        img (PIL.Image): Upright page image
+
+    Returns:
+        list: Word dicts with text, left, top, width and height in pixels
+    """
+    import pytesseract  # only needed for pages without a text layer
+
+    with span("tesseract", pixels=img.width * img.height):
+        data = pytesseract.image_to_data(img, config="--psm 6", output_type=pytesseract.Output.DICT)
+
+    words = []
+    for text, conf, left, top, width, height in zip(
+            data["text"], data["conf"], data["left"], data["top"], data["width"], data["height"]):
+        text = text.strip()
+        if text and float(conf) >= MIN_WORD_CONFIDENCE:
+            words.append({"text": text, "left": left, "top": top, "width": width, "height": height})
+
+    return words
+
+def group_rows(words):
+    """
+    Group words into table rows by their vertical centers.
+
+    Args:
+        words (list): Word dicts with text, left, top, width and height
+
+    Returns:
+        list: Rows, top to bottom, each a list of words sorted left to right
+    """
+    if not words:
+        return []
+
+    tolerance = 0.5 * median(w["height"] for w in words)
+
+    rows = []
+    for word in sorted(words, key=lambda w: w["top"] + w["height"] / 2):
+        center = word["top"] + word["height"] / 2
+        if rows and abs(center - rows[-1]["center"]) <= tolerance:
+            row = rows[-1]
+            row["words"].append(word)
+            row["center"] += (center - row["center"]) / len(row["words"])
+        else:
+            rows.append({"center": center, "words": [word]})
+
+    return [sorted(row["words"], key=lambda w: w["left"]) for row in rows]
+
+def _phrases(row, min_gap):
+    """Merge a row's word extents into phrases: runs of words closer than min_gap."""
+    phrases = []
+    for word in row:
+        left, right = word["left"], word["left"] + word["width"]
+        if phrases and left - phrases[-1][1] < min_gap:
+            phrases[-1][1] = max(phrases[-1][1], right)
+        else:
+            phrases.append([left, right])
+    return phrases
+
+def _open_gaps(row_phrases):
+    """
+    Find the x intervals that most rows leave empty, between the first and last covered position.
+
+    Returns:
+        list: (left, right) intervals covered by fewer than half the rows
+    """
+    events = sorted([(left, 1) for phrases in row_phrases for left, _ in phrases]
+                    + [(right, -1) for phrases in row_phrases for _, right in phrases])
+    majority = len(row_phrases) / 2
+
+    gaps = []
+    count, gap_start, seen_covered = 0, None, False
+    for x, delta in events:
+        count += delta
+        if count >= majority:
+            if gap_start is not None and seen_covered:
+                gaps.append((gap_start, x))
+            gap_start, seen_covered = None, True
+        elif gap_start is None:
+            gap_start = x
+    return gaps
+
+def find_column_bounds(rows, min_words=3, gap_factor=1.0):
+    """
+    Find column boundaries from the horizontal gaps shared by the table's rows.
+
+    Only rows with at least min_words words vote. Of those, rows with a
+    phrase that bridges a gap most rows leave open (a title or a heading
+    spanning several columns) are set aside before the gaps are measured,
+    so they cannot close the gaps between columns.
+
+    Args:
+        rows (list): Rows from group_rows
+        min_words (int): Fewest words for a row to count as part of the table body
+        gap_factor (float): Smallest gap, as a multiple of the median word
+            height, that separates two columns
+
+    Returns:
+        list: x coordinates of the boundaries between columns
+    """
+    body = [row for row in rows if len(row) >= min_words]
+    if not body:
+        return []
+
+    min_gap = gap_factor * median(w["height"] for row in body for w in row)
+
+    # First pass: drop rows whose phrases span a gap the majority of rows leave open
+    row_phrases = [_phrases(row, min_gap) for row in body]
+    gaps = _open_gaps(row_phrases)
+    layout = [row for row, phrases in zip(body, row_phrases)
+              if not any(left < gap_left and right > gap_right
+                         for left, right in phrases for gap_left, gap_right in gaps)]
+    body = layout or body
+
+    # Second pass: merge the x-extents of every remaining word into covered intervals
+    spans = sorted((w["left"], w["left"] + w["width"]) for row in body for w in row)
+    covered = [list(spans[0])]
+    for left, right in spans[1:]:
+        if left <= covered[-1][1]:
+            covered[-1][1] = max(covered[-1][1], right)
+        else:
+            covered.append([left, right])
+
+    return [
+        (prev[1] + nxt[0]) / 2
+        for prev, nxt in zip(covered, covered[1:])
+        if nxt[0] - prev[1] >= min_gap
+    ]
+
+def words_to_table(words, min_cells=None, gap_factor=1.0):
+    """
+    Lay positioned words out as a table of cell strings.
+
+    Rows with a phrase running across a column boundary, such as the table
+    title, are not part of the table and are dropped.
+
+    Args:
+        words (list): Word dicts with text, left, top, width and height
+        min_cells (int): Fewest filled cells for a row to be kept; defaults to
+            half the number of columns, which drops footnotes
+        gap_factor (float): Smallest gap between columns, as in find_column_bounds
+
+    Returns:
+        list: Rows of cell strings, all padded to the same number of columns
+    """
+    rows = group_rows(words)
+    bounds = find_column_bounds(rows, gap_factor=gap_factor)
+    min_gap = gap_factor * median(w["height"] for w in words) if words else 0
+    n_cols = len(bounds) + 1
+    if min_cells is None:
+        min_cells = max(2, n_cols // 2) if n_cols > 1 else 1
+
+    table = []
+    for row in rows:
+        if any(left < bound < right for left, right in _phrases(row, min_gap) for bound in bounds):
+            continue
+
+        cells = [[] for _ in range(n_cols)]
+        for word in row:
+            center = word["left"] + word["width"] / 2
+            col = sum(center > bound for bound in bounds)
+            cells[col].append(word["text"])
+
+        cells = [" ".join(cell) for cell in cells]
+        if sum(bool(cell) for cell in cells) >= min_cells:
+            table.append(cells)
+
+    return table
+
+def extract_pdf_tables(pdf_path, dpi=300):
+    """
+    Extract one table per page of a PDF, with Tesseract where needed.
+
+    Pages with a usable text layer are read straight from the PDF. The
+    others are rendered upright (pdftoppm honors the /Rotate set when the
+    pages were extracted), OCR'd into word boxes; both are laid out by row
+    and column clustering.
+
+    Args:
+        pdf_path (str or Path): Path to the extracted table PDF
+        dpi (int): Render resolution
+
+    Returns:
+        list: One table (list of rows of cell strings) per page
+    """
+    pages = PdfReader(pdf_path).pages
+    words = {page_num: page_words(page) for page_num, page in enumerate(pages, start=1) if has_text_layer(page)}
+
+    to_ocr = [page_num for page_num in range(1, len(pages) + 1) if page_num not in words]
+    rendered = PageRasterCache().render_pages(pdf_path, to_ocr, dpi=dpi) if to_ocr else {}
+
+    for page_num in to_ocr:
+        if page_num not in rendered:
+            raise RuntimeError(f"Could not render page {page_num} of {Path(pdf_path).name}")
+
+        words[page_num] = ocr_words(open_page(rendered[page_num]))
+
+    return [words_to_table(words[page_num]) for page_num in range(1, len(pages) + 1)]
+
+def _row_key(row):
+    """Normalize a row for comparing repeated header rows across pages."""
+    return re.sub(r"[^a-z0-9]", "", "".join(str(cell or "") for cell in row).lower())
+
+def _is_data_row(row):
+    """Check whether a row holds a number cell, i.e. is not a header row."""
+    for cell in row:
+        chars = re.sub(r"[^0-9A-Za-z]", "", str(cell or ""))
+        if chars and sum(char.isdigit() for char in chars) / len(chars) > 0.5:
+            return True
+    return False
+
+def stitch_tables(tables, match_columns=False, header_rows=HEADER_ROWS):
+    """
+    Join the per-page pieces of a multi-page table into one table.
+
+    Each continuation page repeats the column headings, so its leading rows
+    that match one of the first header_rows rows of the first page are
+    dropped, leaving a single header at the top. Only rows above the first
+    row with a number cell count as headers.
+
+    Args:
+        tables (list): Tables as lists of rows of cell strings, in page order
+        match_columns (bool): Only stitch tables with as many columns as the
+            first one; others (e.g. footnote boxes) are returned separately
+        header_rows (int): Rows at the top of the first table that may repeat
+
+    Returns:
+        tuple: (stitched table, list of tables that were not stitched)
+    """
+    tables = [table for table in tables if table]
+    if not tables:
+        return [], []
+
+    first = tables[0]
+    n_cols = max(len(row) for row in first)
+    headers = set()
+    for row in first[:header_rows]:
+        if _is_data_row(row):
+            break
+        headers.add(_row_key(row))
+    headers.discard("")
+
+    stitched = [list(row) for row in first]
+    others = []
+    for table in tables[1:]:
+        if match_columns and max(len(row) for row in table) != n_cols:
+            others.append(table)
+            continue
+
+        start = 0
+        while start < len(table) and _row_key(table[start]) in headers:
+            start += 1
+        stitched.extend(list(row) for row in table[start:])
+
+    width = max(len(row) for row in stitched)
+    return [row + [""] * (width - len(row)) for row in stitched], others
+
+def export_tables_to_excel(tables, excel_output_path):
+    """
+    Write tables to a workbook with one sheet per table, like Textractor does.
+
+    Args:
+        tables (list): Tables as lists of rows of cell strings
+        excel_output_path (str or Path): Path of the workbook to write
+    """
+    with pd.ExcelWriter(excel_output_path, engine="openpyxl") as writer:
+        for i, table in enumerate(tables or [[]], start=1):
+            pd.DataFrame(table).to_excel(writer, sheet_name=f"Table_{i}", header=False, index=False)
@@ -0,0 +1,276 @@
+from pathlib import Path
+import argparse
+import csv
+import json
+import os
+import re
+
+from pypdf import PdfReader
+
+from extract_target_table_pdf import TABLE_TITLES, TITLE_MATCH_THRESHOLD, title_score
+from instrument import span
+from raster_cache import PageRasterCache, file_hash, open_page, upright
+from text_layer import has_text_layer, page_text_orientation
+
+INDEX_DIR = Path("data") / "page-index"
+
+# Bump when the way pages with a text layer are indexed changes; cached
+# entries of scanned pages are kept, since OCR is the slow part
+INDEX_VERSION = 2
+
+# Scanned pages are indexed by OCRing a low-resolution strip along the
+# edge that is the top of the page when upright
+INDEX_DPI = 100
+HEADER_SHARE = 0.2
+
+# Orientations tried for scanned pages, most common first; a strip is
+# accepted once it yields this many dictionary-like words
+ORIENTATIONS = [0, 270, 90, 180]
+MIN_HEADER_WORDS = 4
+
+# Pages with a text layer are indexed by their first lines, which hold the title
+HEADER_LINES = 8
+
+# Dot leaders mark a table of contents, which lists every table title
+CONTENTS_PATTERN = re.compile(r"(\.\s?){5,}")
+
+def get_index_path(pdf_path, index_dir=INDEX_DIR):
+    """Get the cache file of a report's page index, keyed by the report's content hash."""
+    return Path(index_dir) / f"{Path(pdf_path).stem}-{file_hash(pdf_path)[:16]}.json"
+
+def header_strip(img, orientation):
+    """
+    Crop the strip of a raw page image that is the top of the page once rotated upright.
+
+    Orientation is the counterclockwise rotation that makes the page upright,
+    as in the crosswalks.
+    """
+    width, height = img.size
+    strip_w, strip_h = int(width * HEADER_SHARE), int(height * HEADER_SHARE)
+    box = {
+        0: (0, 0, width, strip_h),
+        90: (width - strip_w, 0, width, height),
+        180: (0, height - strip_h, width, height),
+        270: (0, 0, strip_w, height),
+    }[orientation]
+    strip = img.crop(box)
+    return upright(strip, orientation)
+
+def ocr_header(png_path):
+    """
+    OCR the header strip of a scanned page, trying each orientation until one reads as text.
+
+    Returns:
+        tuple: (header text, orientation it was read at)
+    """
+    import pytesseract
+
+    best = ("", 0, -1)
+    img = open_page(png_path)
+    for orientation in ORIENTATIONS:
+        strip = header_strip(img, orientation)
+        with span("tesseract", pixels=strip.width * strip.height):
+            text = pytesseract.image_to_string(strip, config="--psm 6")
+        n_words = len(re.findall(r"\b[A-Za-z]{3,}\b", text))
+        if n_words > best[2]:
+            best = (text, orientation, n_words)
+        if n_words >= MIN_HEADER_WORDS:
+            break
+
+    return best[0], best[1]
+
+def build_page_index(pdf_path, index_dir=INDEX_DIR, save_every=25):
+    """
+    Index the text at the top of every page of a report, reusing the cached index.
+
+    Pages with a text layer are indexed from it; scanned pages from a low
+    resolution OCR of their header strip. The index is saved every
+    save_every pages so an interrupted run resumes where it stopped.
+
+    Args:
+        pdf_path (Path): Annual report PDF
+        index_dir (Path): Directory of cached indexes
+
+    Returns:
+        dict: Page number (as a string) -> {"text", "orientation", "source"};
+            text-layer pages also record whether they look like a table of contents
+    """
+    index_path = get_index_path(pdf_path, index_dir)
+    index = {}
+    if index_path.exists():
+        with open(index_path, 'r') as f:
+            cached = json.load(f)
+        index = cached["pages"]
+        if cached.get("version") != INDEX_VERSION:
+            index = {page: entry for page, entry in index.items() if entry["source"] != "text_layer"}
+
+    reader = PdfReader(pdf_path)
+    n_pages = len(reader.pages)
+    missing = [page_num for page_num in range(1, n_pages + 1) if str(page_num) not in index]
+    if not missing:
+        return index
+
+    print(f"Indexing {len(missing)} of {n_pages} pages of {Path(pdf_path).name}")
+    raster_cache = PageRasterCache()
+    scanned = []
+
+    for page_num in missing:
+        text, orientation = page_text_orientation(reader.pages[page_num - 1])
+        if has_text_layer(text=text):
+            header = "\n".join([line for line in text.splitlines() if line.strip()][:HEADER_LINES])
+            contents = len(CONTENTS_PATTERN.findall(text)) >= 5
+            index[str(page_num)] = {"text": header, "orientation": orientation, "source": "text_layer",
+                                    "contents": contents}
+        else:
+            scanned.append(page_num)
+
+    for start in range(0, len(scanned), save_every):
+        batch = scanned[start:start + save_every]
+        rendered = raster_cache.render_pages(pdf_path, batch, dpi=INDEX_DPI)
+        for page_num in batch:
+            if page_num in rendered:
+                text, orientation = ocr_header(rendered[page_num])
+                index[str(page_num)] = {"text": text, "orientation": orientation, "source": "ocr"}
+        _save_index(index_path, pdf_path, index)
+
+    _save_index(index_path, pdf_path, index)
+    return index
+
+def _save_index(index_path, pdf_path, index):
+    index_path.parent.mkdir(exist_ok=True, parents=True)
+    temp_path = index_path.with_name(f".{index_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, 'w') as f:
+        json.dump({"report": Path(pdf_path).name, "version": INDEX_VERSION, "pages": index}, f)
+    os.replace(temp_path, index_path)
+
+def find_table_pages(index, title, threshold=TITLE_MATCH_THRESHOLD):
+    """
+    Find the pages whose header holds a table title, grouped into runs of consecutive pages.
+
+    A run is split where the orientation changes, since a table printed
+    sideways next to an upright one is a different table.
+
+    Returns:
+        list: Spans, each a dict with pages (list), score (lowest page score)
+            and orientation
+    """
+    matches = []
+    for page, entry in index.items():
+        if entry.get("contents"):
+            continue
+        score = title_score(entry["text"], title)
+        if score >= threshold:
+            matches.append((int(page), score, entry["orientation"]))
+
+    spans = []
+    for page_num, score, orientation in sorted(matches):
+        if spans and page_num == spans[-1]["pages"][-1] + 1 and orientation == spans[-1]["orientation"]:
+            span = spans[-1]
+            span["pages"].append(page_num)
+            span["score"] = min(span["score"], score)
+        else:
+            spans.append({"pages": [page_num], "score": score, "orientation": orientation})
+
+    return spans
+
+def propose_rows(year, spans):
+    """
+    Turn the spans found in one report into crosswalk rows.
+
+    The highest scoring span is proposed, the later one on ties since the
+    tables are near the end of each report; the others are listed as alternatives.
+    Spans that border another span (split by find_table_pages where the
+    orientation changes) are flagged, as they may be one table.
+
+    Returns:
+        list: Row dicts with year, page, orientation, score and flags
+    """
+    matched = {page for span in spans for page in span["pages"]}
+    rows = []
+    for rank, span in enumerate(sorted(spans, key=lambda span: (-span["score"], -span["pages"][0]))):
+        pages = span["pages"]
+        flags = []
+        if len(pages) > 1:
+            flags.append("multi-page")
+        if rank:
+            flags.append("alternative")
+        if span["orientation"] is None:
+            flags.append("check-orientation")
+        elif pages[0] - 1 in matched or pages[-1] + 1 in matched:
+            flags.append("orientation-change")
+        rows.append({
+            "year": year,
+            "page": f"{pages[0]}-{pages[-1]}" if len(pages) > 1 else str(pages[0]),
+            "orientation": span["orientation"] if span["orientation"] is not None else "auto",
+            "score": round(span["score"], 2),
+            "flags": " ".join(flags),
+        })
+
+    if not rows:
+        rows.append({"year": year, "page": "", "orientation": "", "score": 0.0, "flags": "not-found"})
+
+    return rows
+
+def load_crosswalk(csv_path):
+    """Load the existing page crosswalk as year -> page string."""
+    if not Path(csv_path).exists():
+        return {}
+
+    with open(csv_path, 'r', newline='') as f:
+        return {row["year"]: row["page"] for row in csv.DictReader(f)}
+
+def locate_tables(dir_name, years, output_path=None):
+    """
+    Propose crosswalk rows for a table by searching each report's page index for the table title.
+
+    Args:
+        dir_name (str): Table directory, a key of TABLE_TITLES
+        years (list): Years of the reports to search
+        output_path (Path): Where to write the proposed rows; defaults to
+            crosswalk/<dir_name>-pages-proposed.csv
+
+    Returns:
+        list: Proposed row dicts
+    """
+    from process_pages import get_annual_report_path
+
+    title = TABLE_TITLES[dir_name]
+    crosswalk = load_crosswalk(Path("crosswalk") / f"{dir_name}-pages.csv")
+    output_path = output_path or Path("crosswalk") / f"{dir_name}-pages-proposed.csv"
+
+    rows = []
+    for year in years:
+        pdf_path = get_annual_report_path(year)
+        if pdf_path is None:
+            continue
+
+        index = build_page_index(pdf_path)
+        year_rows = propose_rows(str(year), find_table_pages(index, title))
+
+        current = crosswalk.get(str(year))
+        for row in year_rows:
+            if current is not None and row["page"] != current and "alternative" not in row["flags"]:
+                row["flags"] = f"{row['flags']} differs-from-crosswalk:{current}".strip()
+            print(f"{year}: page {row['page'] or '-'} orientation {row['orientation'] or '-'} "
+                  f"score {row['score']:.2f} {row['flags']}")
+        rows.extend(year_rows)
+
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["year", "page", "orientation", "score", "flags"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"\nWrote {len(rows)} proposed rows to {output_path}")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Propose crosswalk/<table>-pages.csv rows by searching the annual reports for table titles.",
+        epilog="Example: python program/databuild/locate_tables.py mill-levies 2006 2007"
+    )
+    parser.add_argument("dir_name", choices=sorted(TABLE_TITLES), help="Table to locate")
+    parser.add_argument("years", nargs="+", help="Report years to search")
+    parser.add_argument("--output", type=Path, help="Proposed rows CSV (default: crosswalk/<table>-pages-proposed.csv)")
+    args = parser.parse_args()
+
+    locate_tables(args.dir_name, args.years, args.output)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+from importlib import metadata
+from pathlib import Path
+
+from raster_cache import file_hash
+from text_layer import local_pdf_for
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+MANIFEST_PATH = PROJECT_ROOT / "derived" / ".build-manifest.json"
+
+def tool_version(package):
+    """Get the installed version of a Python package, or 'unknown'."""
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+def hash_inputs(inputs):
+    """
+    Hash a dict of build inputs.
+
+    Args:
+        inputs (dict): JSON-serializable inputs; file contents should already
+            be reduced to hashes with file_hash
+
+    Returns:
+        str: Hex digest of the canonical JSON encoding
+    """
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def artifact_key(path):
+    """Get the manifest key of an output file: its path relative to the project root."""
+    path = Path(path).resolve()
+    try:
+        return str(path.relative_to(PROJECT_ROOT))
+    except ValueError:
+        return str(path)
+
+class BuildManifest:
+    """
+    Record of the inputs each build artifact was produced from.
+
+    Each entry maps an artifact (an output path relative to the project
+    root) to the hash of its inputs: source file hashes, crosswalk row,
+    parameters and tool versions. A stage rebuilds an artifact only when
+    it is missing or its inputs hash has changed.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = Path(path)
+        self.entries = self._load()
+        self.changed = {}
+        self.removed = set()
+
+    def _load(self):
+        if not self.path.exists():
+            return {}
+
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def is_stale(self, output_path, inputs):
+        """
+        Check whether an artifact needs to be rebuilt.
+
+        Only reads the manifest: an output with no entry counts as stale.
+        Stages that should keep outputs built before the manifest was kept
+        call adopt first.
+
+        Args:
+            output_path (str or Path): Path of the artifact
+            inputs (dict): Inputs the artifact would be built from now
+
+        Returns:
+            bool: True if the artifact is missing, unrecorded or its inputs changed
+        """
+        if not Path(output_path).exists():
+            return True
+
+        entry = self.entries.get(artifact_key(output_path))
+        return entry is None or entry["inputs_hash"] != hash_inputs(inputs)
+
+    def is_adoptable(self, output_path, inputs):
+        """
+        Check whether an existing artifact can be adopted with the current inputs instead of rebuilt.
+
+        That is the case when it was built before the manifest was kept, or
+        recorded before some of the inputs (e.g. the S3 ETag of a workbook's
+        source) were tracked, with the inputs it does record unchanged.
+        """
+        if not Path(output_path).exists():
+            return False
+
+        entry = self.entries.get(artifact_key(output_path))
+        if entry is None:
+            return True
+
+        recorded = entry.get("inputs")
+        return (recorded is not None and recorded.keys() < inputs.keys()
+                and hash_inputs(recorded) == hash_inputs({key: inputs[key] for key in recorded}))
+
+    def adopt(self, output_path, inputs):
+        """
+        Record an adoptable artifact (see is_adoptable) as built from the current inputs, so it is not rebuilt.
+
+        Args:
+            output_path (str or Path): Path of the artifact
+            inputs (dict): Inputs the artifact would be built from now
+
+        Returns:
+            bool: True if the artifact was adopted
+        """
+        if not self.is_adoptable(output_path, inputs):
+            return False
+
+        self.record(output_path, inputs)
+        return True
+
+    def record(self, output_path, inputs):
+        """Record that an artifact was built from the given inputs."""
+        key = artifact_key(output_path)
+        entry = {"inputs_hash": hash_inputs(inputs), "inputs": inputs}
+        self.entries[key] = entry
+        self.changed[key] = entry
+
+    def forget(self, output_paths):
+        """Drop the entries of artifacts that were removed, e.g. page parts replaced by a combined table."""
+        for output_path in output_paths:
+            key = artifact_key(output_path)
+            self.entries.pop(key, None)
+            self.changed.pop(key, None)
+            self.removed.add(key)
+
+    def save(self):
+        """
+        Write the manifest, merging in entries saved by other processes since it was loaded.
+        """
+        if not self.changed and not self.removed:
+            return
+
+        entries = self._load()
+        entries.update(self.changed)
+        for key in self.removed:
+            entries.pop(key, None)
+
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+        self.entries = entries
+        self.changed = {}
+        self.removed = set()
+
+def page_inputs(job):
+    """
+    Get the build inputs of an extracted page PDF.
+
+    Args:
+        job (dict): Page job from process_pages.get_page_jobs (or a combined
+            job from process_pages.combine_page_jobs) with a resolved orientation
+    """
+    crosswalk_row = {
+        "year": job["year"],
+        "page": job["page_num"],
+        "suffix": job["suffix"],
+        "orientation": job["orientation"],
+    }
+    if "pages" in job:
+        # Multi-page table combined into one PDF by process_pages.combine_page_jobs
+        crosswalk_row["pages"] = [list(page) for page in job["pages"]]
+
+    return {
+        "stage": "extract",
+        "source": file_hash(job["pdf_path"]),
+        "crosswalk_row": crosswalk_row,
+        "tools": {"pypdf": tool_version("pypdf")},
+    }
+
+def table_inputs(source, backend_name, tools, s3_etag=None):
+    """
+    Get the build inputs of a table workbook.
+
+    Args:
+        source (str or Path): Source the backend reads (local path or S3 URI)
+        backend_name (str): Name of the backend the workbook is built with
+        tools (dict): Tool versions from the backend's versions()
+        s3_etag (str): ETag of the S3 object for S3 sources, from the
+            upload or a listing of the bucket; the local copy's hash alone
+            does not show whether the object Textract reads was updated
+    """
+    local_pdf = local_pdf_for(source)
+
+    inputs = {
+        "stage": "tables",
+        "source": file_hash(local_pdf) if local_pdf is not None else str(source),
+        "backend": backend_name,
+        "tools": tools,
+    }
+    if str(source).startswith("s3://"):
+        inputs["s3_etag"] = s3_etag
+
+    return inputs
@@ -1,135 +1,111 @@
-from textractor import Textractor
-from textractor.data.constants import TextractFeatures
 from pathlib import Path
-import time
-import os
-import boto3
-import pandas as pd
+import argparse
 import sys
 
-def extract_tables(dir_name):
+from instrument import print_report, start_run
+from manifest import BuildManifest, table_inputs
+from table_backends import BACKENDS, DEFAULT_MAX_CONCURRENT, get_backend
+
+def extract_tables(dir_name, backend="textract", **options):
     """
-    Extract tables from PDFs using Amazon Textract.
-    
+    Extract tables from PDFs with a table extraction backend.
+
+    The "textract" backend analyzes PDFs uploaded to S3 with Amazon
+    Textract; the "local" backend OCRs the PDFs in data/annual-reports/
+    with Tesseract. Both write derived/<dir_name>/<year>.xlsx.
+
     Args:
-        dir_name (str): Name of the directory containing PDFs in S3 and where to save results
+        dir_name (str): Name of the directory containing PDFs and where to save results
+        backend (str): Name of the backend, a key of table_backends.BACKENDS
+        **options: Backend options, e.g. max_concurrent and max_wait_time for Textract
+
+    Returns:
+        tuple: (successful, failed) lists of year/part names
     """
     # Set paths
     project_root = Path(__file__).resolve().parent.parent.parent
     output_dir = project_root / "derived" / dir_name
     output_dir.mkdir(exist_ok=True, parents=True)
-    
-    s3_bucket = "colorado-data-bucket"
-    s3_client = boto3.client('s3')
-    
-    # Get list of all PDFs in S3 bucket
+
+    start_run()
+    table_backend = get_backend(backend, **options)
+
+    # Get list of all available PDFs
     try:
-        response = s3_client.list_objects_v2(Bucket=s3_bucket, Prefix=f"{dir_name}/")
-        
-        if 'Contents' not in response:
-            print(f"No PDFs found in S3 bucket under prefix {dir_name}/")
-            return
-            
-        pdf_keys = [obj['Key'] for obj in response['Contents'] if obj['Key'].endswith('.pdf')]
-        
-        if not pdf_keys:
-            print(f"No PDFs found in S3 bucket under prefix {dir_name}/")
-            return
-            
-        print(f"Found {len(pdf_keys)} PDFs in S3 bucket under prefix {dir_name}/")
-        
-        # Initialize Textract client
-        print("Initializing Textractor...")
-        extractor = Textractor(profile_name="default")
-        
-        # Process each PDF
-        successful = []
-        failed = []
-        
-        for s3_key in pdf_keys:
-            year = s3_key.split('/')[-1].split('.')[0]  # Extract year/part from filename
-            s3_uri = f"s3://{s3_bucket}/{s3_key}"
-            excel_output_path = output_dir / f"{year}.xlsx"
-            
-            # Skip if Excel file already exists
-            if excel_output_path.exists():
-                print(f"Excel file for {year} already exists at {excel_output_path}")
-                successful.append(year)
-                continue
-                
-            print(f"\nProcessing {year} PDF at {s3_uri}")
-            
-            try:
-                # Start asynchronous document analysis
-                print(f"Starting Textract analysis on {s3_uri}")
-                job = extractor.start_document_analysis(
-                    file_source=s3_uri, 
-                    features=[TextractFeatures.TABLES, TextractFeatures.FORMS], 
-                    save_image=False
-                )
-                
-                # Set timeout parameters
-                max_wait_time = 900  # 15 minutes
-                wait_time = 0
-                poll_interval = 60  # Check status every 60 seconds
-                
-                # Wait for job to complete
-                print("Waiting for Textract job to complete...")
-                response = extractor.textract_client.get_document_analysis(JobId=job.job_id)
-                status = response["JobStatus"]
-                
-                while status != "SUCCEEDED" and wait_time < max_wait_time:
-                    if status in ["FAILED", "ERROR"]:
-                        raise Exception(f"Textract job failed with status: {status}")
-                    
-                    print(f"Current status: {status}. Waiting {poll_interval} seconds...")
-                    time.sleep(poll_interval)
-                    wait_time += poll_interval
-                    
-                    response = extractor.textract_client.get_document_analysis(JobId=job.job_id)
-                    status = response["JobStatus"]
-                    
-                    print(f"Still waiting... (elapsed time: {wait_time}s)")
-                
-                if wait_time >= max_wait_time:
-                    raise Exception("Textract job timed out")
-                
-                if status == "SUCCEEDED":
-                    print("Job completed, exporting tables to Excel...")
-                    
-                    # Check if tables were extracted
-                    if not job.tables:
-                        print(f"Warning: No tables found in {year} PDF")
-                        
-                    # Export tables to Excel
-                    job.export_tables_to_excel(excel_output_path)
-                    print(f"Successfully exported {len(job.tables)} tables to {excel_output_path}")
-                                    
-                    successful.append(year)
-            
-            except Exception as e:
-                print(f"Error processing {year} PDF: {e}")
-                failed.append(year)
-        
-        # Print summary
-        print("\nExtraction Summary:")
-        print(f"Successfully processed: {len(successful)} files")
-        print(f"Failed: {len(failed)} files")
-        
-        if failed:
-            print("Failed files:")
-            for year in failed:
-                print(f"  - {year}")
-                
+        sources = table_backend.sources(dir_name)
     except Exception as e:
-        print(f"Error listing objects in S3 bucket: {e}")
+        print(f"Error listing PDFs for {dir_name}: {e}")
+        return [], []
+
+    if not sources:
+        print(f"No PDFs found for {dir_name} with the {backend} backend")
+        return [], []
+
+    print(f"Found {len(sources)} PDFs for {dir_name} with the {backend} backend")
+
+    manifest = BuildManifest()
+    tools = table_backend.versions()
+    successful = []
+    jobs = {}
+    inputs = {}
+
+    etags = table_backend.source_etags(dir_name) if table_backend.requires_upload else {}
+
+    for year, source in sources.items():
+        excel_output_path = output_dir / f"{year}.xlsx"
+        inputs[year] = table_inputs(source, backend, tools, etags.get(year))
+
+        # Skip if the Excel file is up to date with its PDF and backend
+        manifest.adopt(excel_output_path, inputs[year])
+        if not manifest.is_stale(excel_output_path, inputs[year]):
+            print(f"Excel file for {year} is up to date at {excel_output_path}")
+            successful.append(year)
+            continue
+
+        jobs[year] = source
+
+    failed = []
+    if jobs:
+        new_successful, failed = table_backend.extract_all(jobs, output_dir)
+        successful.extend(new_successful)
+
+        for year in new_successful:
+            manifest.record(output_dir / f"{year}.xlsx", inputs[year])
+
+    manifest.save()
+
+    # Print summary
+    print("\nExtraction Summary:")
+    print(f"Successfully processed: {len(successful)} files")
+    print(f"Failed: {len(failed)} files")
+
+    if failed:
+        print("Failed files:")
+        for year in sorted(failed):
+            print(f"  - {year}")
+
+    print_report()
+    return successful, failed
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python ocr_tables.py <directory_name>")
-        print("Example: python ocr_tables.py mill-levies")
-        print("Directory name should match the prefix used in S3 and will be used for the output directory in derived/")
+    parser = argparse.ArgumentParser(
+        description="Extract tables from extracted table PDFs into derived/<directory_name>/<year>.xlsx.",
+        epilog="Directory name should match the prefix used in S3 (textract) or the "
+               "subfolder of data/annual-reports/ (local)."
+    )
+    parser.add_argument("dir_name", help="Table directory, e.g. mill-levies")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="textract",
+                        help="Table extraction backend (default: textract)")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT,
+                        help=f"Textract: most jobs in flight at once (default: {DEFAULT_MAX_CONCURRENT})")
+    parser.add_argument("--max-wait", type=int, default=900,
+                        help="Textract: seconds to wait for a job before leaving it to the next run (default: 900)")
+    args = parser.parse_args()
+
+    options = {}
+    if args.backend == "textract":
+        options = {"max_concurrent": args.max_concurrent, "max_wait_time": args.max_wait}
+
+    _, failed = extract_tables(args.dir_name, backend=args.backend, **options)
+    if failed:
         sys.exit(1)
-    
-    dir_name = sys.argv[1]
-    extract_tables(dir_name)
@@ -0,0 +1,131 @@
+import csv
+from pathlib import Path
+
+import pytesseract
+
+from instrument import span
+from raster_cache import PageRasterCache, file_hash, open_page, upright
+
+# Resolution of the thumbnail used for orientation/script detection
+OSD_DPI = 100
+
+# Below this Tesseract OSD confidence, fall back to OCR trials on the 300 dpi
+# render downscaled by TRIAL_SCALE, which is plenty to tell the angles apart
+MIN_OSD_CONFIDENCE = 2.0
+TRIAL_SCALE = 2
+
+SIDECAR_FIELDS = ["year", "page", "orientation", "confidence", "method", "report_hash"]
+
+def detect_orientation(pdf_path, page_num, min_confidence=MIN_OSD_CONFIDENCE):
+    """
+    Detect the rotation that makes a page upright.
+
+    Runs Tesseract orientation/script detection on a low-resolution
+    thumbnail and only tries all four angles at full resolution when OSD
+    is not confident.
+
+    Args:
+        pdf_path (str or Path): Path to the annual report PDF
+        page_num (int): Page number (1-indexed)
+        min_confidence (float): Lowest OSD confidence to accept
+
+    Returns:
+        dict: orientation (counter-clockwise degrees, as used in the crosswalks),
+            confidence and method ('osd' or 'trials')
+    """
+    cache = PageRasterCache()
+    thumbnail_path = cache.get(pdf_path, page_num, dpi=OSD_DPI)
+
+    if thumbnail_path is not None:
+        try:
+            img = open_page(thumbnail_path)
+            with span("tesseract_osd", pixels=img.width * img.height):
+                osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT)
+
+            if osd["orientation_conf"] >= min_confidence:
+                # OSD reports the clockwise rotation needed; PIL rotates counter-clockwise
+                return {
+                    "orientation": (360 - osd["rotate"]) % 360,
+                    "confidence": osd["orientation_conf"],
+                    "method": "osd",
+                }
+        except pytesseract.TesseractError:
+            pass  # too little text on the thumbnail for OSD
+
+    png_path = cache.get(pdf_path, page_num, dpi=300)
+    if png_path is None:
+        raise RuntimeError(f"Could not render page {page_num} of {Path(pdf_path).name}")
+
+    # One decoded buffer; each angle is a lossless transpose scored and dropped in turn
+    img = open_page(png_path, scale=TRIAL_SCALE)
+    scores = {angle: _ocr_confidence(upright(img, angle)) for angle in (0, 90, 180, 270)}
+
+    best_orientation = max(scores, key=scores.get)
+    return {
+        "orientation": best_orientation,
+        "confidence": scores[best_orientation],
+        "method": "trials",
+    }
+
+def _ocr_confidence(img):
+    """Score an image by the summed confidence of the words Tesseract reads on it."""
+    with span("tesseract", pixels=img.width * img.height):
+        data = pytesseract.image_to_data(img, config="--psm 6", output_type=pytesseract.Output.DICT)
+    return sum(
+        float(conf) for conf, text in zip(data["conf"], data["text"])
+        if float(conf) > 0 and any(c.isalnum() for c in text)
+    )
+
+def get_sidecar_path(csv_path):
+    """Get the orientation sidecar file that sits next to a pages CSV file."""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(f"{csv_path.stem}-orientation.csv")
+
+def load_orientations(sidecar_path):
+    """
+    Load detected orientations from a sidecar file.
+
+    Args:
+        sidecar_path (str or Path): Path to the sidecar CSV file
+
+    Returns:
+        dict: (year, page, report_hash) -> detection record
+    """
+    sidecar_path = Path(sidecar_path)
+    if not sidecar_path.exists():
+        return {}
+
+    with open(sidecar_path, 'r') as f:
+        return {
+            (row["year"], int(row["page"]), row["report_hash"]): {
+                "orientation": int(row["orientation"]),
+                "confidence": float(row["confidence"]),
+                "method": row["method"],
+            }
+            for row in csv.DictReader(f)
+        }
+
+def save_orientations(sidecar_path, orientations):
+    """
+    Write detected orientations to a sidecar file.
+
+    Args:
+        sidecar_path (str or Path): Path to the sidecar CSV file
+        orientations (dict): (year, page, report_hash) -> detection record
+    """
+    with open(sidecar_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SIDECAR_FIELDS)
+        writer.writeheader()
+        for (year, page, report_hash), record in sorted(orientations.items()):
+            writer.writerow({
+                "year": year,
+                "page": page,
+                "orientation": record["orientation"],
+                "confidence": f"{record['confidence']:.2f}",
+                "method": record["method"],
+                "report_hash": report_hash,
+            })
+
+def orientation_key(job):
+    """Get the sidecar key of a page job from process_pages."""
+    return (job["year"], job["page_num"], file_hash(job["pdf_path"])[:16])
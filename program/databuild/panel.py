@@ -0,0 +1,275 @@
+from pathlib import Path
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from manifest import BuildManifest, tool_version
+from raster_cache import file_hash
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+PANEL_PATH = PROJECT_ROOT / "derived" / "panel.parquet"
+RATES_PATH = PROJECT_ROOT / "data" / "assessment_rates.csv"
+HPI_PATH = PROJECT_ROOT / "derived" / "hpi-bdl.csv"
+MEASURES_PATH = PROJECT_ROOT / "derived" / "panel-measures.parquet"
+
+# Bump when a derivation below changes, so cached measures are rebuilt
+MEASURES_VERSION = 1
+
+# Year whose residential shares fix the Gallagher instrument and the resi_group split
+BASE_YEAR = 1980
+
+# Measures with a log column (<measure>_ln), as in databuild.R
+LOG_MEASURES = [
+    "tax_rate", "revenue", "gallagher", "mkt_val_total",
+    "eff_ar", "mkt_val_resi", "mkt_val_other", "hpi",
+    "tax_rate_res", "rar",
+]
+
+KEY_COLUMNS = ["countyfp", "county", "year"]
+GROUPS = ["year", "county", "resi_group"]
+STATS = ["mean", "median", "sum", "min", "max", "count"]
+
+def measures_inputs(panel_path, rates_path, hpi_path):
+    """Get the build inputs of the measures table: the panel, assessment rates, HPI and the derivations' version."""
+    return {
+        "stage": "measures",
+        "version": MEASURES_VERSION,
+        "panel": file_hash(panel_path),
+        "rates": file_hash(rates_path),
+        "hpi": file_hash(hpi_path) if Path(hpi_path).exists() else None,
+        "tools": {"pandas": tool_version("pandas"), "pyarrow": tool_version("pyarrow")},
+    }
+
+def derive_measures(panel, rates, hpi=None):
+    """
+    Join the panel with the assessment rates and derive the measures used by estimate.R and plot.R.
+
+    Follows databuild.R: implied market values from assessed values and
+    the residential (rar) and non-residential (nrar) assessment rates, the
+    effective assessment ratio, tax rates, and the Gallagher instrument
+    built from each county's 1980 residential share of assessed value.
+    Logs of non-positive values are left missing.
+
+    Args:
+        panel (pd.DataFrame): Panel written by consolidate.py
+        rates (pd.DataFrame): year, rar and nrar in percent
+        hpi (pd.DataFrame): countyfp, year and hpi, or None
+
+    Returns:
+        pd.DataFrame: One row per county-year, sorted by county and year
+    """
+    rates = rates[["year", "rar", "nrar"]].astype({"year": "int64"})
+    rates[["rar", "nrar"]] = rates[["rar", "nrar"]] / 100
+
+    dt = panel.astype({"countyfp": "int64", "year": "int64"}).merge(rates, on="year", how="left")
+    if hpi is not None:
+        hpi = hpi[["countyfp", "year", "hpi"]].astype({"countyfp": "int64", "year": "int64"})
+        dt = dt.merge(hpi, on=["countyfp", "year"], how="left")
+    else:
+        dt["hpi"] = np.nan
+
+    # implied market valuations
+    dt["mkt_val_resi"] = dt["assessed_resi"] / dt["rar"]
+    dt["mkt_val_other"] = (dt["assessed_valuation"] - dt["assessed_resi"]) / dt["nrar"]
+    dt["mkt_val_total"] = dt["mkt_val_resi"] + dt["mkt_val_other"]
+    dt["val_share_resi"] = dt["mkt_val_resi"] / dt["mkt_val_total"]
+    dt["assessed_share_resi"] = dt["assessed_resi"] / dt["assessed_valuation"]
+
+    # tax rates and revenue
+    dt["tax_rate"] = dt["county_mill_levy"] / 1000
+    dt["tax_rate_res"] = dt["tax_rate"] * dt["rar"]
+    dt["revenue"] = dt["assessed_valuation"] * dt["tax_rate"]
+
+    # value-weighted average assessment ratio and tax rate
+    dt["eff_ar"] = dt["val_share_resi"] * dt["rar"] + (1 - dt["val_share_resi"]) * dt["nrar"]
+    dt["tax_rate_avg"] = dt["eff_ar"] * dt["tax_rate"]
+
+    # instrument for the effective assessment ratio from pre-determined shares
+    base = dt[dt["year"] == BASE_YEAR].set_index("countyfp")
+    share_base = base["assessed_resi"] / base["assessed_total"]
+    dt["assessed_share_resi_1980"] = dt["countyfp"].map(share_base)
+    dt["gallagher"] = (dt["assessed_share_resi_1980"] * dt["rar"]
+                       + (1 - dt["assessed_share_resi_1980"]) * dt["nrar"])
+
+    # high- and low-residential valuation share counties
+    val_share_base = base["val_share_resi"].dropna()
+    groups = pd.Series(np.where(val_share_base > val_share_base.median(), "High", "Low"),
+                       index=val_share_base.index)
+    dt["resi_group"] = dt["countyfp"].map(groups)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for measure in LOG_MEASURES:
+            values = dt[measure].to_numpy(dtype="float64")
+            dt[f"{measure}_ln"] = np.where(values > 0, np.log(values), np.nan)
+
+    return dt.sort_values(["countyfp", "year"], ignore_index=True)
+
+def build_measures(panel_path=PANEL_PATH, rates_path=RATES_PATH, hpi_path=HPI_PATH,
+                   output_path=MEASURES_PATH, force=False):
+    """
+    Get the panel with derived measures, rebuilding the cached table only when an input changed.
+
+    Args:
+        panel_path (Path): Panel written by consolidate.py
+        rates_path (Path): Assessment rates CSV
+        hpi_path (Path): County HPI CSV from import-hpi.R; skipped if missing
+        output_path (Path): Where the measures table is cached
+        force (bool): Rebuild even if no input changed
+
+    Returns:
+        pd.DataFrame: The measures table
+    """
+    output_path = Path(output_path)
+    manifest = BuildManifest()
+    inputs = measures_inputs(panel_path, rates_path, hpi_path)
+    if not force and output_path.exists() and not manifest.is_stale(output_path, inputs):
+        return pd.read_parquet(output_path)
+
+    hpi = pd.read_csv(hpi_path) if Path(hpi_path).exists() else None
+    dt = derive_measures(pd.read_parquet(panel_path), pd.read_csv(rates_path), hpi)
+
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    temp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    dt.to_parquet(temp_path, index=False)
+    os.replace(temp_path, output_path)
+
+    manifest.record(output_path, inputs)
+    manifest.save()
+    print(f"Derived measures for {len(dt)} county-years written to {output_path}")
+
+    return dt
+
+class Panel:
+    """
+    County-by-year panel with derived measures, held in memory for repeated queries.
+
+    Rows are sorted by county and year, and the county and year columns are
+    kept as NumPy arrays, so a query is a couple of vectorized comparisons
+    rather than a join or a re-derivation.
+    """
+
+    def __init__(self, table):
+        self.table = table.sort_values(["countyfp", "year"], ignore_index=True)
+        self._countyfp = self.table["countyfp"].to_numpy()
+        self._year = self.table["year"].to_numpy()
+        self._fips = {name.lower(): countyfp for countyfp, name in
+                      self.table[["countyfp", "county"]].drop_duplicates().itertuples(index=False)
+                      if isinstance(name, str)}
+
+    @classmethod
+    def load(cls, force=False, **paths):
+        """Load the panel, rebuilding the cached measures if needed; paths are passed to build_measures."""
+        return cls(build_measures(force=force, **paths))
+
+    @property
+    def measures(self):
+        """Names of the numeric measures that can be queried."""
+        return [column for column in self.table.columns
+                if column not in KEY_COLUMNS and pd.api.types.is_numeric_dtype(self.table[column])]
+
+    def _county_codes(self, counties):
+        codes = []
+        for county in counties:
+            if isinstance(county, str) and not county.isdigit():
+                if county.lower() not in self._fips:
+                    raise ValueError(f"Unknown county: {county}")
+                codes.append(self._fips[county.lower()])
+            else:
+                codes.append(int(county))
+        return codes
+
+    def _check_measures(self, measures):
+        unknown = [measure for measure in measures if measure not in self.table.columns]
+        if unknown:
+            raise ValueError(f"Unknown measures: {', '.join(unknown)}")
+
+    def query(self, measures=None, counties=None, years=None):
+        """
+        Select county-years and measures.
+
+        Args:
+            measures (list): Measures to return (default: all)
+            counties (list): County names (case-insensitive) or FIPS codes (default: all)
+            years (tuple): (first, last) years, inclusive; either may be None
+
+        Returns:
+            pd.DataFrame: countyfp, county, year, resi_group and the measures
+        """
+        mask = np.ones(len(self.table), dtype=bool)
+        if counties:
+            mask &= np.isin(self._countyfp, self._county_codes(counties))
+        if years:
+            first, last = years
+            if first is not None:
+                mask &= self._year >= first
+            if last is not None:
+                mask &= self._year <= last
+
+        if measures is None:
+            measures = self.measures
+        self._check_measures(measures)
+
+        columns = KEY_COLUMNS + ["resi_group"] + [m for m in measures if m not in KEY_COLUMNS + ["resi_group"]]
+        return self.table.loc[mask, columns].reset_index(drop=True)
+
+    def summarize(self, measures, by="year", stat="mean", counties=None, years=None):
+        """
+        Aggregate measures over groups of county-years.
+
+        Args:
+            measures (list): Measures to aggregate
+            by (str or list): Grouping columns, from GROUPS
+            stat (str): Aggregate, from STATS; missing values are skipped
+            counties (list): Counties to include (default: all)
+            years (tuple): (first, last) years to include
+
+        Returns:
+            pd.DataFrame: One row per group
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        if any(column not in GROUPS for column in by):
+            raise ValueError(f"Can only group by {', '.join(GROUPS)}")
+        if stat not in STATS:
+            raise ValueError(f"Unknown statistic: {stat}")
+
+        rows = self.query(measures, counties, years)
+        return rows.groupby(by, sort=True)[list(measures)].agg(stat).reset_index()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the county panel joined with assessment rates and its derived measures."
+    )
+    parser.add_argument("--measures", nargs="+", help="Measures to show (default: all)")
+    parser.add_argument("--counties", nargs="+", help="County names or FIPS codes (default: all)")
+    parser.add_argument("--years", nargs=2, type=int, metavar=("FIRST", "LAST"), help="Inclusive year range")
+    parser.add_argument("--by", nargs="+", choices=GROUPS, help="Aggregate measures by these columns")
+    parser.add_argument("--stat", choices=STATS, default="mean", help="Aggregate for --by (default: mean)")
+    parser.add_argument("--csv", type=Path, help="Write the result to a CSV file instead of printing it")
+    parser.add_argument("--list", action="store_true", help="List the available measures")
+    parser.add_argument("--force", action="store_true", help="Rebuild the cached measures")
+    parser.add_argument("--panel", type=Path, default=PANEL_PATH, help="Panel Parquet file")
+    args = parser.parse_args()
+
+    panel = Panel.load(force=args.force, panel_path=args.panel)
+    if args.list:
+        print("\n".join(panel.measures))
+        sys.exit(0)
+
+    try:
+        if args.by:
+            result = panel.summarize(args.measures or panel.measures, args.by, args.stat, args.counties, args.years)
+        else:
+            result = panel.query(args.measures, args.counties, args.years)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.csv:
+        result.to_csv(args.csv, index=False)
+        print(f"{len(result)} rows written to {args.csv}")
+    else:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(result.to_string(index=False))
@@ -1,69 +1,87 @@
 #!/usr/bin/env python3
+import argparse
 import csv
+import json
 import os
 import sys
-import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 from pathlib import Path
 
-PYTHON = sys.executable
+from pypdf import PdfReader
+
+from extract_target_table_pdf import (VERIFY_DPI, VERIFY_SCALE, extract_and_save_page, extract_and_save_pages,
+                                      get_output_path, replaced_parts, verify_page_ocr)
+from instrument import print_report, span, start_run
+from manifest import BuildManifest, page_inputs
+from orientation import (OSD_DPI, detect_orientation, get_sidecar_path,
+                         load_orientations, orientation_key, save_orientations)
+from raster_cache import DEFAULT_MAX_PIXELS, PageRasterCache
+
+DEFAULT_OCR_REPORT = Path("data/annual-reports/ocr-verification.json")
 
 def get_annual_report_path(year):
     """Get the path to the annual report PDF for a given year."""
     data_dir = Path("data/annual-reports")
-    
+
     # First try to find an exact match
     for pdf_file in data_dir.glob(f"*{year}*.pdf"):
         return pdf_file
-    
+
     print(f"Warning: Could not find annual report for {year}")
     return None
 
-def process_pages(csv_path):
+def get_page_jobs(csv_path, auto_orientation=False):
     """
-    Process the pages CSV file and extract target tables for each year.
-    
+    Expand the pages CSV file into one extraction job per page.
+
     Args:
-        csv_path (str): Path to the CSV file containing page information
+        csv_path (str or Path): Path to the CSV file containing page information
+        auto_orientation (bool): Whether to detect every page's orientation
+            instead of reading it from the orientation column
+
+    Returns:
+        list: Job dicts with keys pdf_path, year, page_num, suffix, dir_name,
+            orientation ('auto' when it is to be detected) and crosswalk
     """
     csv_path = Path(csv_path)
-    
-    if not csv_path.exists():
-        print(f"Error: File not found - {csv_path}")
-        return
-    
-    print(f"Processing pages from {csv_path}")
-    
+
     # Extract directory name from CSV filename
     dir_name = csv_path.stem
     if "-pages" in dir_name:
         dir_name = dir_name.replace("-pages", "")
-    
-    print(f"Output directory will be: data/{dir_name}")
-    
+
+    jobs = []
+
     with open(csv_path, 'r') as f:
         csv_reader = csv.DictReader(f)
-        
+
         for row in csv_reader:
             year = row.get('year')
             pages = row.get('page')
             orientation = row.get('orientation')
-            
+
             if not year or not pages:
                 continue
 
             if not orientation:
                 orientation = 0
-            
+
             try:
                 year = year.strip()
+                if auto_orientation or str(orientation).strip() == "auto":
+                    orientation = "auto"
+                else:
+                    orientation = int(orientation)
                 annual_report_path = get_annual_report_path(year)
-                
+
                 if not annual_report_path:
                     continue
-                
+
                 # Handle multi-page tables
                 page_ranges = pages.split(',')
-                
+
                 for i, page_range in enumerate(page_ranges):
                     # Handle ranges like "404-405"
                     if '-' in page_range:
@@ -71,49 +89,464 @@ def process_pages(csv_path):
                         for j, page_num in enumerate(range(start_page, end_page + 1)):
                             # Use 'a', 'b', etc. as suffix for multiple pages
                             suffix = chr(97 + j) if (end_page - start_page) > 0 else ""
-                            
-                            # Call extract_target_table_pdf.py with the page number and suffix
-                            cmd = [
-                                PYTHON,
-                                "program/databuild/extract_target_table_pdf.py",
-                                str(annual_report_path),
-                                str(page_num),
-                                suffix,
-                                dir_name,
-                                str(orientation)
-                            ]
-                            
-                            print(f"Extracting {year} page {page_num} with suffix '{suffix}' to {dir_name}/")
-                            subprocess.run(cmd)
+                            jobs.append({
+                                "pdf_path": str(annual_report_path),
+                                "year": year,
+                                "page_num": page_num,
+                                "suffix": suffix,
+                                "dir_name": dir_name,
+                                "orientation": orientation,
+                                "crosswalk": str(csv_path),
+                            })
                     else:
                         # Single page
                         page_num = int(page_range)
-                        
+
                         # Use 'a', 'b', etc. as suffix if there are multiple page ranges
                         suffix = chr(97 + i) if len(page_ranges) > 1 else ""
-                        
-                        cmd = [
-                            PYTHON,
-                            "program/databuild/extract_target_table_pdf.py",
-                            str(annual_report_path),
-                            str(page_num),
-                            suffix,
-                            dir_name,
-                            str(orientation)
-                        ]
-                        
-                        print(f"Extracting {year} page {page_num} with suffix '{suffix}' to {dir_name}/")
-                        subprocess.run(cmd)
-                        
+                        jobs.append({
+                            "pdf_path": str(annual_report_path),
+                            "year": year,
+                            "page_num": page_num,
+                            "suffix": suffix,
+                            "dir_name": dir_name,
+                            "orientation": orientation,
+                            "crosswalk": str(csv_path),
+                        })
+
             except Exception as e:
                 print(f"Error processing year {year}, pages {pages}: {e}")
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        csv_path = sys.argv[1]
+    return jobs
+
+def run_page_job(job, verify_ocr=False, reader=None):
+    """
+    Extract a single page and report how it went.
+
+    Pages marked as up to date by plan_page_jobs are skipped; all others
+    are (re)written.
+
+    Args:
+        job (dict): Job dict as produced by get_page_jobs
+        verify_ocr (bool): Whether to OCR the page and check its table title
+        reader (PdfReader): Already open report, used to copy the page and, with
+            verify_ocr, to read its text layer
+
+    Returns:
+        dict: The job fields plus status ('ok', 'skipped' or 'failed'),
+            elapsed wall time in seconds, an error message if any, the
+            part PDFs and workbooks a combined table replaced and, with
+            verify_ocr, the OCR verification record
+    """
+    result = dict(job, status="failed", elapsed=0.0, error=None)
+    start = time.perf_counter()
+
+    try:
+        with span("extract_page", stage="extract", year=f"{job['year']}{job['suffix']}") as record:
+            if not job.get("stale", True):
+                result["status"] = "skipped"
+            elif "pages" in job:
+                output_path = get_output_path(job["pdf_path"], job["dir_name"])
+                result["replaced"] = [str(path) for path in replaced_parts(output_path, job["dir_name"])]
+                if extract_and_save_pages(job["pdf_path"], job["pages"], dir_name=job["dir_name"],
+                                          reader=reader, overwrite=True):
+                    result["status"] = "ok"
+            elif extract_and_save_page(
+                job["pdf_path"],
+                job["page_num"],
+                verbose=False,
+                dir_name=job["dir_name"],
+                orientation=job["orientation"],
+                suffix=job["suffix"],
+                reader=reader,
+                overwrite=True
+            ):
+                result["status"] = "ok"
+
+            record["result"] = result["status"]
+            if result["status"] == "ok":
+                record["bytes_out"] = get_output_path(job["pdf_path"], job["dir_name"], job["suffix"]).stat().st_size
+    except Exception as e:
+        result["error"] = str(e)
+
+    if verify_ocr:
+        # Combined jobs are verified on their first page, which holds the title
+        try:
+            with span("verify_ocr", stage="extract", year=f"{job['year']}{job['suffix']}"):
+                result["verification"] = verify_page_ocr(
+                    job["pdf_path"], job["page_num"], job["dir_name"], job["orientation"], reader=reader
+                )
+        except Exception as e:
+            result["verification"] = {"error": str(e)}
+
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+def run_report_jobs(report_jobs, verify_ocr=False):
+    """
+    Extract all pages needed from one report, opening and parsing it once.
+
+    Args:
+        report_jobs (list): Job dicts from get_page_jobs that share a pdf_path
+        verify_ocr (bool): Whether to OCR the pages and check their table titles
+
+    Returns:
+        list: One result record per page, as returned by run_page_job
+    """
+    reader = None
+    results = []
+    for job in report_jobs:
+        if reader is None and (job.get("stale", True) or verify_ocr):
+            try:
+                reader = PdfReader(job["pdf_path"])
+            except Exception as e:
+                print(f"Error opening {Path(job['pdf_path']).name}: {e}")
+        results.append(run_page_job(job, verify_ocr, reader))
+
+    return results
+
+def render_report_pages(pdf_path, page_nums, dpi=300):
+    """
+    Rasterize every page needed from one report into the page raster cache.
+
+    Args:
+        pdf_path (str): Path to the annual report PDF
+        page_nums (list): Page numbers (1-indexed) to render
+        dpi (int): Render resolution
+
+    Returns:
+        int: Number of pages available in the cache
+    """
+    with span("render_pages", stage="extract", report=Path(pdf_path).name):
+        return len(PageRasterCache().render_pages(pdf_path, page_nums, dpi=dpi))
+
+def get_pending_renders(page_jobs):
+    """Group the pages to OCR-verify by report, so each report is rendered once."""
+    pending = {}
+    for job in page_jobs:
+        pending.setdefault(job["pdf_path"], set()).add(job["page_num"])
+
+    return {pdf_path: sorted(page_nums) for pdf_path, page_nums in pending.items()}
+
+def resolve_orientations(page_jobs, executor=None, detect=True):
+    """
+    Fill in the orientation of page jobs marked 'auto'.
+
+    Angles already in a crosswalk's orientation sidecar are reused; the
+    rest are detected and written back to the sidecar.
+
+    Args:
+        page_jobs (list): Job dicts from get_page_jobs, updated in place
+        executor (Executor): Pool to detect orientations on, or None to run inline
+        detect (bool): Whether to detect missing angles; if False, only the
+            sidecars are read and pages not in them stay 'auto'
+    """
+    auto_jobs = [job for job in page_jobs if job["orientation"] == "auto"]
+    if not auto_jobs:
+        return
+
+    sidecars = {}
+    to_detect = []
+    for job in auto_jobs:
+        sidecar_path = get_sidecar_path(job["crosswalk"])
+        if sidecar_path not in sidecars:
+            sidecars[sidecar_path] = load_orientations(sidecar_path)
+
+        record = sidecars[sidecar_path].get(orientation_key(job))
+        if record is not None:
+            job["orientation"] = record["orientation"]
+        else:
+            to_detect.append(job)
+
+    print(f"Orientation: {len(auto_jobs) - len(to_detect)} pages from sidecar, {len(to_detect)} to detect")
+    if not to_detect or not detect:
+        return
+
+    thumbnails = {}
+    for job in to_detect:
+        thumbnails.setdefault(job["pdf_path"], set()).add(job["page_num"])
+    for _ in _run_all(executor, render_report_pages,
+                      [(pdf_path, sorted(pages), OSD_DPI) for pdf_path, pages in thumbnails.items()]):
+        pass
+
+    for (job,), record, error in _run_all(executor, _detect_job_orientation,
+                                          [(job,) for job in to_detect]):
+        if error is not None:
+            print(f"Error detecting orientation of {job['year']} page {job['page_num']}: {error}")
+            job["orientation"] = 0
+            continue
+
+        job["orientation"] = record["orientation"]
+        sidecars[get_sidecar_path(job["crosswalk"])][orientation_key(job)] = record
+        print(f"Detected {record['orientation']}° for {job['year']} page {job['page_num']} "
+              f"({record['method']}, confidence {record['confidence']:.1f})")
+
+    for sidecar_path, orientations in sidecars.items():
+        save_orientations(sidecar_path, orientations)
+
+def combine_page_jobs(page_jobs):
+    """
+    Merge the per-page jobs of each multi-page table into one job.
+
+    The pages of a table are copied into a single PDF, <year>.pdf, so the
+    table stage reads and uploads one file per table instead of one per page.
+
+    Args:
+        page_jobs (list): Job dicts from get_page_jobs with resolved orientations
+
+    Returns:
+        list: Jobs with single-page tables unchanged and one job per multi-page
+            table, with suffix '' and a pages list of (page number, orientation)
+    """
+    tables = {}
+    for job in page_jobs:
+        key = (job["pdf_path"], job["dir_name"], job["year"], job["crosswalk"])
+        tables.setdefault(key, []).append(job)
+
+    combined = []
+    for table_jobs in tables.values():
+        if len(table_jobs) == 1:
+            combined.append(table_jobs[0])
+            continue
+
+        first = table_jobs[0]
+        combined.append(dict(first, suffix="",
+                             pages=[(job["page_num"], job["orientation"]) for job in table_jobs]))
+
+    return combined
+
+def plan_page_jobs(page_jobs, manifest, adopt=True):
+    """
+    Mark which page jobs are stale according to the build manifest.
+
+    A page is stale when its output is missing or when the report, the
+    crosswalk row (page, suffix, orientation) or the splitter version
+    changed since it was written. Pages extracted before the manifest was
+    kept are not stale.
+
+    Args:
+        page_jobs (list): Job dicts with resolved orientations, updated in place
+            with "stale" and "inputs" keys
+        manifest (BuildManifest): Manifest of previously built artifacts
+        adopt (bool): Whether to record pages extracted before the manifest
+            was kept in the manifest; False leaves it unchanged
+    """
+    for job in page_jobs:
+        output_path = get_output_path(job["pdf_path"], job["dir_name"], job["suffix"])
+        job["inputs"] = page_inputs(job)
+        if output_path is None:
+            job["stale"] = True
+            continue
+
+        if adopt:
+            manifest.adopt(output_path, job["inputs"])
+        job["stale"] = (manifest.is_stale(output_path, job["inputs"])
+                        and not manifest.is_adoptable(output_path, job["inputs"]))
+
+    n_stale = sum(job["stale"] for job in page_jobs)
+    print(f"{n_stale} of {len(page_jobs)} pages are missing or out of date")
+
+def _detect_job_orientation(job):
+    """Detect the orientation of the page in a page job."""
+    with span("detect_orientation", stage="extract", year=job["year"], page=job["page_num"]):
+        return detect_orientation(job["pdf_path"], job["page_num"])
+
+def _run_all(executor, fn, arg_list):
+    """
+    Call fn on each argument tuple, on a process pool if one is given.
+
+    Yields:
+        tuple: (args, result, error) in completion order, with error set
+            to the exception raised if the call failed
+    """
+    if executor is None:
+        for args in arg_list:
+            try:
+                yield args, fn(*args), None
+            except Exception as e:
+                yield args, None, e
+        return
+
+    futures = {executor.submit(fn, *args): args for args in arg_list}
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except Exception as e:
+            yield futures[future], None, e
+
+def process_pages(csv_paths, jobs=1, verify_ocr=False, ocr_report=None, auto_orientation=False,
+                  combine=False):
+    """
+    Process the pages CSV files and extract target tables for each year.
+
+    Pages needed from the same annual report are extracted together,
+    across all CSV files, so each report is opened and parsed once.
+
+    Args:
+        csv_paths (str, Path or list): Path(s) to CSV files containing page information
+        jobs (int): Number of worker processes to extract pages with
+        verify_ocr (bool): Whether to OCR each page and check its table title
+        ocr_report (str or Path): Where to write the JSON verification report
+        auto_orientation (bool): Whether to detect page orientations instead
+            of using the orientation column
+        combine (bool): Whether to save multi-page tables as one PDF per
+            table instead of one PDF per page
+
+    Returns:
+        list: One result record per page, as returned by run_page_job
+    """
+    if isinstance(csv_paths, (str, Path)):
+        csv_paths = [csv_paths]
+
+    start_run()
+    page_jobs = []
+    for csv_path in map(Path, csv_paths):
+        if not csv_path.exists():
+            print(f"Error: File not found - {csv_path}")
+            continue
+
+        print(f"Processing pages from {csv_path}")
+        page_jobs.extend(get_page_jobs(csv_path, auto_orientation))
+
+    if not page_jobs:
+        print("No pages to extract")
+        return []
+
+    for dir_name in sorted({job["dir_name"] for job in page_jobs}):
+        print(f"Output directory will be: data/annual-reports/{dir_name}")
+    print(f"Extracting {len(page_jobs)} pages with {jobs} worker(s)")
+
+    start = time.perf_counter()
+    results = []
+    manifest = BuildManifest()
+
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext()
+    with pool as executor:
+        resolve_orientations(page_jobs, executor)
+        if combine:
+            page_jobs = combine_page_jobs(page_jobs)
+        plan_page_jobs(page_jobs, manifest)
+
+        # Rasters are only needed to OCR-verify pages
+        renders = get_pending_renders(page_jobs) if verify_ocr else {}
+        verify_dpi = VERIFY_DPI // VERIFY_SCALE
+        for (pdf_path, page_nums, _), count, error in _run_all(executor, render_report_pages,
+                                                               [(pdf_path, page_nums, verify_dpi)
+                                                                for pdf_path, page_nums in renders.items()]):
+            if error is not None:
+                # Pages are rendered again one by one during verification
+                print(f"Error rendering {Path(pdf_path).name}: {error}")
+            else:
+                print(f"Rendered {count} pages of {Path(pdf_path).name}")
+
+        reports = {}
+        for job in page_jobs:
+            reports.setdefault(job["pdf_path"], []).append(job)
+
+        for (report_jobs, _), report_results, error in _run_all(
+                executor, run_report_jobs,
+                [(report_jobs, verify_ocr) for report_jobs in reports.values()]):
+            if error is not None:
+                report_results = [dict(job, status="failed", elapsed=0.0, error=str(error))
+                                  for job in report_jobs]
+            for result in report_results:
+                results.append(result)
+                _print_result(result)
+                if result["status"] == "ok":
+                    output_path = get_output_path(result["pdf_path"], result["dir_name"], result["suffix"])
+                    manifest.record(output_path, result["inputs"])
+                    manifest.forget(result.get("replaced", []))
+
+    manifest.save()
+
+    elapsed = time.perf_counter() - start
+
+    # Print summary
+    counts = {status: sum(r["status"] == status for r in results)
+              for status in ("ok", "skipped", "failed")}
+    print("\nExtraction Summary:")
+    print(f"Extracted: {counts['ok']} pages")
+    print(f"Skipped (up to date): {counts['skipped']} pages")
+    print(f"Failed: {counts['failed']} pages")
+    print(f"Wall time: {elapsed:.1f}s "
+          f"(sum of page times: {sum(r['elapsed'] for r in results):.1f}s)")
+
+    failed = [r for r in results if r["status"] == "failed"]
+    if failed:
+        print("Failed pages:")
+        for r in sorted(failed, key=lambda r: (r["year"], r["suffix"])):
+            reason = f": {r['error']}" if r["error"] else ""
+            print(f"  - {r['year']}{r['suffix']} (page {r['page_num']}){reason}")
+
+    if verify_ocr:
+        write_ocr_report(results, ocr_report or DEFAULT_OCR_REPORT)
+
+    print_report()
+    return results
+
+def write_ocr_report(results, report_path):
+    """
+    Write the OCR verification records to a JSON report and summarize them.
+
+    Args:
+        results (list): Result records from run_page_job with verify_ocr=True
+        report_path (str or Path): Path of the JSON report
+    """
+    report_path = Path(report_path)
+    report_path.parent.mkdir(exist_ok=True, parents=True)
+
+    records = []
+    for r in sorted(results, key=lambda r: (r["dir_name"], r["year"], r["suffix"])):
+        record = dict(r.get("verification") or {})
+        record.update(year=r["year"], suffix=r["suffix"])
+        records.append(record)
+
+    with open(report_path, 'w') as f:
+        json.dump(records, f, indent=2)
+
+    unverified = [r for r in records if not r.get("title_found")]
+    print(f"\nOCR verification: {len(records) - len(unverified)} of {len(records)} pages contain the expected title")
+    for r in unverified:
+        print(f"  - {r.get('dir_name', '')}/{r['year']}{r['suffix']} "
+              f"(title score {r.get('title_score', 0):.2f}){' ' + r['error'] if r.get('error') else ''}")
+    print(f"Verification report written to {report_path}")
+
+def _print_result(result):
+    """Print a one-line progress message for a finished page job."""
+    label = f"{result['year']}{result['suffix']}"
+    if "pages" in result:
+        pages = f"pages {', '.join(str(page_num) for page_num, _ in result['pages'])}"
     else:
-        print("Usage: python process_pages.py <csv_file_path>")
-        print("Example: python process_pages.py crosswalk/county-valuation-pages.csv")
+        pages = f"page {result['page_num']}"
+    print(f"[{result['status']:>7}] {result['dir_name']}/{label} {pages} ({result['elapsed']:.1f}s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Extract the table pages listed in one or more pages CSV files.",
+        epilog="Example: python process_pages.py crosswalk/county-valuation-pages.csv crosswalk/mill-levies-pages.csv --jobs 8"
+    )
+    parser.add_argument("csv_paths", nargs="+", help="Path(s) to CSV files containing page information")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--auto-orientation", action="store_true",
+                        help="Detect page orientations (cached in a <csv>-orientation.csv sidecar) "
+                             "instead of using the orientation column")
+    parser.add_argument("--combine", action="store_true",
+                        help="Save each multi-page table as one <year>.pdf instead of <year>a.pdf, <year>b.pdf, ...")
+    parser.add_argument("--verify-ocr", action="store_true",
+                        help="OCR each page and check it contains the expected table title")
+    parser.add_argument("--ocr-report", default=DEFAULT_OCR_REPORT,
+                        help=f"Path of the JSON verification report (default: {DEFAULT_OCR_REPORT})")
+    parser.add_argument("--max-pixels", type=int,
+                        help="Largest page image each worker decodes for OCR; bigger renders are "
+                             f"downscaled (default: RASTER_MAX_PIXELS or {DEFAULT_MAX_PIXELS:,})")
+    args = parser.parse_args()
+
+    if args.max_pixels:
+        os.environ["RASTER_MAX_PIXELS"] = str(args.max_pixels)  # inherited by the worker processes
+
+    results = process_pages(args.csv_paths, jobs=args.jobs,
+                            verify_ocr=args.verify_ocr, ocr_report=args.ocr_report,
+                            auto_orientation=args.auto_orientation, combine=args.combine)
+    if any(r["status"] == "failed" for r in results):
         sys.exit(1)
-    
-    process_pages(csv_path)
\ No newline at end of file
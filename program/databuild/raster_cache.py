@@ -0,0 +1,320 @@
+import hashlib
+import math
+import os
+import re
+import subprocess
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+from pypdf import PdfReader
+
+from instrument import span
+
+DEFAULT_CACHE_DIR = Path("data") / "raster-cache"
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3  # 5 GB
+
+# Largest page image rendered, in pixels (one byte each, grayscale); pages
+# that would be larger at the requested dpi are rendered at a lower one, so
+# no worker ever decodes more. A letter page at 300 dpi is 8.4 million
+# pixels. Override with RASTER_MAX_PIXELS
+DEFAULT_MAX_PIXELS = 40_000_000
+
+# Lossless transposes for the counter-clockwise orientations used in the crosswalks
+TRANSPOSES = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+# In-process memo of report hashes, keyed by (path, size, mtime)
+_file_hashes = {}
+
+# In-process memo of page crop boxes, report hash -> {page: (width, height) in points}
+_page_sizes = {}
+
+def file_hash(path):
+    """
+    Get the SHA-256 hash of a file, memoized on its path, size and mtime.
+
+    Args:
+        path (str or Path): Path to the file
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+
+    return _file_hashes[key]
+
+def group_page_runs(page_nums, max_gap=2):
+    """
+    Group page numbers into runs that are cheap to render in one pdftoppm pass.
+
+    Args:
+        page_nums (iterable): Page numbers (1-indexed)
+        max_gap (int): Largest number of unneeded pages to render to join two runs
+
+    Returns:
+        list: (first_page, last_page) tuples
+    """
+    runs = []
+    for page_num in sorted(set(page_nums)):
+        if runs and page_num - runs[-1][1] <= max_gap + 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+
+    return [tuple(run) for run in runs]
+
+def get_max_pixels():
+    """Get the per-worker pixel budget from RASTER_MAX_PIXELS, or the default."""
+    return int(os.environ.get("RASTER_MAX_PIXELS") or DEFAULT_MAX_PIXELS)
+
+def budget_dpi(width, height, dpi, max_pixels=None):
+    """
+    Get the highest resolution, up to dpi, at which a page fits the pixel budget.
+
+    Args:
+        width (float): Page width in points
+        height (float): Page height in points
+        dpi (int): Requested render resolution
+        max_pixels (int): Pixel budget; defaults to get_max_pixels()
+
+    Returns:
+        int: Render resolution
+    """
+    max_pixels = max_pixels or get_max_pixels()
+    pixels = (width * dpi / 72 + 1) * (height * dpi / 72 + 1)
+    if pixels <= max_pixels:
+        return dpi
+    return max(int(dpi * math.sqrt(max_pixels / pixels)), 1)
+
+def page_sizes(pdf_path, page_nums):
+    """
+    Get the crop box sizes pdftoppm renders, memoized per report hash.
+
+    The first call for a report reads the size of all its pages, so callers
+    that ask for one page at a time parse it only once per process.
+
+    Returns:
+        dict: Page number -> (width, height) in points, or None if the page cannot be read
+    """
+    key = file_hash(pdf_path)
+    if key not in _page_sizes:
+        sizes = {}
+        try:
+            for page_num, page in enumerate(PdfReader(pdf_path).pages, start=1):
+                try:
+                    box = page.cropbox
+                    sizes[page_num] = (abs(float(box.width)), abs(float(box.height)))
+                except Exception:
+                    sizes[page_num] = None
+        except Exception:
+            pass  # unreadable report: pdftoppm reports the error
+        _page_sizes[key] = sizes
+
+    return {page_num: _page_sizes[key].get(page_num) for page_num in page_nums}
+
+def render_dpis(pdf_path, page_nums, dpi, max_pixels=None):
+    """
+    Get the resolution each page is rendered at under the pixel budget.
+
+    Page sizes come from the crop boxes pdftoppm renders (see page_sizes);
+    pages that cannot be read keep the requested dpi and fail in pdftoppm
+    instead.
+
+    Returns:
+        dict: Page number -> render resolution
+    """
+    return {page_num: budget_dpi(*size, dpi, max_pixels) if size is not None else dpi
+            for page_num, size in page_sizes(pdf_path, page_nums).items()}
+
+def open_page(png_path, scale=1, max_pixels=None):
+    """
+    Decode a rendered page into a single grayscale buffer.
+
+    The image is read once and the file closed. Pages are rendered in
+    grayscale, so no converted copy is made; older color renders are
+    converted once. The image is downscaled by an integer factor (box
+    filter) when scale asks for it. Renders from PageRasterCache already
+    fit the pixel budget; a larger image from elsewhere is decoded in full
+    and then reduced to fit it.
+
+    Args:
+        png_path (str or Path): Rendered page
+        scale (int): Smallest downscale factor, e.g. 2 for detection work
+            that does not need full resolution
+        max_pixels (int): Pixel budget; defaults to get_max_pixels()
+
+    Returns:
+        PIL.Image: Grayscale page image
+    """
+    max_pixels = max_pixels or get_max_pixels()
+
+    img = Image.open(png_path)
+    factor = max(int(scale), 1)
+    while (img.width // factor) * (img.height // factor) > max_pixels:
+        factor += 1
+
+    img.load()  # decodes and closes the file
+    if img.mode != "L":
+        img = img.convert("L")
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+def upright(img, orientation):
+    """
+    Turn an image counter-clockwise by a multiple of 90 degrees without resampling.
+
+    Args:
+        img (PIL.Image): Page image
+        orientation (int): Counter-clockwise rotation in degrees, as in the crosswalks
+
+    Returns:
+        PIL.Image: The turned image, or img itself for 0
+    """
+    if orientation % 90:
+        raise ValueError(f"Orientation must be a multiple of 90 degrees, got {orientation}")
+
+    method = TRANSPOSES.get(orientation % 360)
+    return img.transpose(method) if method is not None else img
+
+class PageRasterCache:
+    """
+    On-disk cache of rasterized report pages keyed by (report hash, page, dpi).
+
+    Entries are PNG files under cache_dir/<report hash>/<page>-<dpi>.png. Their
+    mtime is bumped on every hit, and the least recently used entries are
+    evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = Path(cache_dir or os.environ.get("RASTER_CACHE_DIR", DEFAULT_CACHE_DIR))
+        self.max_bytes = int(max_bytes or os.environ.get("RASTER_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+
+    def entry_path(self, pdf_path, page_num, dpi=300):
+        """Get the cache path for a page, whether or not it has been rendered."""
+        return self.cache_dir / file_hash(pdf_path)[:16] / f"{page_num}-{dpi}.png"
+
+    def get(self, pdf_path, page_num, dpi=300):
+        """
+        Get a rendered page, rasterizing it on a cache miss.
+
+        Args:
+            pdf_path (str or Path): Path to the report PDF
+            page_num (int): Page number (1-indexed)
+            dpi (int): Render resolution
+
+        Returns:
+            Path: Path to the cached PNG, or None if the page could not be rendered
+        """
+        return self.render_pages(pdf_path, [page_num], dpi=dpi).get(page_num)
+
+    def render_pages(self, pdf_path, page_nums, dpi=300):
+        """
+        Make sure all requested pages of one report are in the cache.
+
+        Missing pages are rendered with one pdftoppm -f/-l pass per run of
+        nearby pages rather than one call per page. Pages too large for the
+        pixel budget at dpi are rendered (and cached) at the highest
+        resolution that fits it. When every page is already cached at dpi,
+        the PDF is not opened at all; page sizes, needed to look up the
+        others, are read once per report and process.
+
+        Args:
+            pdf_path (str or Path): Path to the report PDF
+            page_nums (iterable): Page numbers (1-indexed)
+            dpi (int): Render resolution
+
+        Returns:
+            dict: Page number -> cached PNG path for every page that was rendered
+        """
+        pdf_path = Path(pdf_path)
+        page_nums = set(page_nums)
+
+        # A render at the requested dpi is a hit without reading the PDF;
+        # only the other pages need their size to find their budget dpi
+        entries = {page_num: self.entry_path(pdf_path, page_num, dpi) for page_num in page_nums}
+        unsized = [page_num for page_num, path in entries.items() if not path.exists()]
+        dpis = dict.fromkeys(page_nums, dpi)
+        if unsized:
+            dpis.update(render_dpis(pdf_path, unsized, dpi))
+            entries.update({page_num: self.entry_path(pdf_path, page_num, dpis[page_num]) for page_num in unsized})
+        missing = [page_num for page_num in unsized if not entries[page_num].exists()]
+
+        for page_dpi in sorted({dpis[page_num] for page_num in missing}):
+            pages = [page_num for page_num in missing if dpis[page_num] == page_dpi]
+            for first_page, last_page in group_page_runs(pages):
+                self._render_run(pdf_path, first_page, last_page, page_dpi,
+                                 {page_num: entries[page_num] for page_num in pages})
+
+        rendered = {}
+        for page_num, path in entries.items():
+            if path.exists():
+                os.utime(path)  # mark as recently used
+                rendered[page_num] = path
+
+        if missing:
+            self.evict()
+
+        return rendered
+
+    def _render_run(self, pdf_path, first_page, last_page, dpi, entries):
+        """Render pages first_page..last_page and move the needed ones into the cache."""
+        report_dir = next(iter(entries.values())).parent
+        report_dir.mkdir(exist_ok=True, parents=True)
+
+        # Render inside the cache directory so the final move is an atomic rename
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as temp_dir:
+            pdftoppm_cmd = [
+                "pdftoppm",
+                "-png",
+                "-gray",
+                "-r", str(dpi),
+                "-f", str(first_page),
+                "-l", str(last_page),
+                str(pdf_path),
+                str(Path(temp_dir) / "page")
+            ]
+            with span("pdftoppm", pages=last_page - first_page + 1, dpi=dpi) as record:
+                subprocess.run(pdftoppm_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                record["bytes_out"] = sum(path.stat().st_size for path in Path(temp_dir).glob("page-*.png"))
+
+            # pdftoppm zero-pads page numbers to the width of the page count
+            for png_path in Path(temp_dir).glob("page-*.png"):
+                page_num = int(re.search(r'-(\d+)\.png$', png_path.name).group(1))
+                if page_num in entries:
+                    os.replace(png_path, entries[page_num])
+
+    def size(self):
+        """Get the total size of the cached pages in bytes."""
+        return sum(path.stat().st_size for path in self.cache_dir.glob("*/*.png"))
+
+    def evict(self):
+        """Delete least recently used pages until the cache fits in max_bytes."""
+        entries = []
+        for path in self.cache_dir.glob("*/*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another worker
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
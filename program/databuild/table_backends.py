@@ -0,0 +1,535 @@
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+
+from instrument import span, traced
+from manifest import tool_version
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+# Same bucket as upload_check.DEFAULT_BUCKET, which needs boto3 to import
+DEFAULT_BUCKET = "colorado-data-bucket"
+
+# Textract's default quota of concurrent asynchronous analysis jobs
+DEFAULT_MAX_CONCURRENT = 10
+
+# Adaptive polling: start short, back off geometrically up to a ceiling
+INITIAL_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 60
+POLL_BACKOFF = 1.5
+
+class TableBackend:
+    """
+    Interface for turning extracted table PDFs into derived/<dir>/<year>.xlsx workbooks.
+
+    Subclasses implement sources and extract_one; extract_all may be
+    overridden to process many PDFs more efficiently than one at a time.
+    """
+
+    name = None
+    requires_upload = False
+
+    def sources(self, dir_name):
+        """
+        Find the table PDFs available to this backend.
+
+        Returns:
+            dict: year/part -> source location (S3 URI or local path)
+        """
+        raise NotImplementedError
+
+    def versions(self):
+        """
+        Get the versions of the tools this backend extracts with.
+
+        Returns:
+            dict: Tool name -> version, recorded in the build manifest
+        """
+        return {}
+
+    def source_for(self, dir_name, year):
+        """Get the source location of one extracted table PDF."""
+        raise NotImplementedError
+
+    def analyze(self, year, source, job_id=None, on_job=None):
+        """
+        Run table extraction on one PDF.
+
+        Args:
+            year (str): Year/part of the PDF
+            source (str or Path): Source location from sources() or source_for()
+            job_id (str): External job an earlier attempt started for this
+                PDF, to resume instead of starting a new one
+            on_job (callable): Called with the external job's ID as soon as
+                it is started or resumed, and with None when it failed
+
+        Returns:
+            object: Backend-specific result to pass to export
+        """
+        raise NotImplementedError
+
+    def export(self, result, year, excel_output_path):
+        """
+        Write the tables from an analyze result to a workbook.
+
+        Returns:
+            int: Number of tables written
+        """
+        raise NotImplementedError
+
+    def extract_one(self, year, source, excel_output_path):
+        """
+        Extract the tables from one PDF and write them to a workbook.
+
+        Returns:
+            int: Number of tables written
+        """
+        with span("analyze", stage="analyze", year=year):
+            result = self.analyze(year, source)
+        with span("export", stage="export", year=year):
+            return self.export(result, year, excel_output_path)
+
+    def extract_all(self, jobs, output_dir):
+        """
+        Extract the tables from many PDFs.
+
+        Args:
+            jobs (dict): year/part -> source location
+            output_dir (Path): Directory to write <year>.xlsx workbooks to
+
+        Returns:
+            tuple: (successful, failed) lists of year/part names
+        """
+        successful = []
+        failed = []
+
+        for year, source in jobs.items():
+            excel_output_path = output_dir / f"{year}.xlsx"
+            print(f"\nProcessing {year} PDF at {source}")
+            try:
+                n_tables = self.extract_one(year, source, excel_output_path)
+                print(f"Successfully exported {n_tables} tables to {excel_output_path}")
+                successful.append(year)
+            except Exception as e:
+                print(f"Error processing {year} PDF: {e}")
+                failed.append(year)
+
+        return successful, failed
+
+class LocalBackend(TableBackend):
+    """Extract tables on local cores with Tesseract word boxes and column clustering."""
+
+    name = "local"
+
+    def sources(self, dir_name):
+        source_dir = PROJECT_ROOT / "data" / "annual-reports" / dir_name
+        return {pdf_path.stem: pdf_path for pdf_path in sorted(source_dir.glob("*.pdf"))}
+
+    def source_for(self, dir_name, year):
+        return PROJECT_ROOT / "data" / "annual-reports" / dir_name / f"{year}.pdf"
+
+    def versions(self):
+        import pytesseract
+
+        return {
+            "pytesseract": tool_version("pytesseract"),
+            "tesseract": str(pytesseract.get_tesseract_version()),
+        }
+
+    def analyze(self, year, source, job_id=None, on_job=None):
+        from local_tables import extract_pdf_tables
+
+        return extract_pdf_tables(source)
+
+    def export(self, result, year, excel_output_path):
+        from local_tables import export_tables_to_excel, stitch_tables
+
+        if not any(result):
+            print(f"Warning: No tables found in {year} PDF")
+
+        # One table per page; a combined multi-page table becomes one sheet
+        stitched, others = stitch_tables(result)
+        export_tables_to_excel([stitched] + others, excel_output_path)
+        return int(bool(stitched)) + len(others)
+
+class TextractBackend(TableBackend):
+    """Extract tables with Amazon Textract from PDFs uploaded to S3."""
+
+    name = "textract"
+    requires_upload = True
+
+    def __init__(self, s3_bucket=DEFAULT_BUCKET, max_concurrent=DEFAULT_MAX_CONCURRENT, max_wait_time=900):
+        self.s3_bucket = s3_bucket
+        self.max_concurrent = max_concurrent
+        self.max_wait_time = max_wait_time
+        self._extractor = None
+        self._runs = {}
+        self._runs_lock = threading.Lock()
+        self._listings = {}
+
+    @property
+    def extractor(self):
+        """Textractor client, created on first use."""
+        if self._extractor is None:
+            from textractor import Textractor
+
+            print("Initializing Textractor...")
+            self._extractor = Textractor(profile_name="default")
+        return self._extractor
+
+    def sources(self, dir_name):
+        from upload_check import get_s3_client, list_objects
+
+        s3_client = get_s3_client()
+        self._listings[dir_name] = list_objects(s3_client, self.s3_bucket, f"{dir_name}/")
+        sources = {
+            key.split('/')[-1].split('.')[0]: f"s3://{self.s3_bucket}/{key}"  # Extract year/part from filename
+            for key in self._listings[dir_name]
+            if key.endswith('.pdf')
+        }
+
+        # Part objects left in S3 after a table was combined (--combine) are not analyzed again
+        return {part: source for part, source in sources.items()
+                if not (len(part) == 5 and part[4].isalpha() and part[:4] in sources)}
+
+    def source_etags(self, dir_name):
+        """
+        Get the ETags of a table's PDFs in S3, for the build manifest.
+
+        Reuses the listing made by sources() if there is one.
+
+        Returns:
+            dict: year/part -> ETag
+        """
+        if dir_name not in self._listings:
+            from upload_check import get_s3_client, list_objects
+
+            self._listings[dir_name] = list_objects(get_s3_client(), self.s3_bucket, f"{dir_name}/")
+
+        return {key.split('/')[-1].split('.')[0]: obj["etag"]
+                for key, obj in self._listings[dir_name].items() if key.endswith('.pdf')}
+
+    def versions(self):
+        return {
+            "amazon-textract-textractor": tool_version("amazon-textract-textractor"),
+            "features": "TABLES,FORMS",
+        }
+
+    def source_for(self, dir_name, year):
+        return f"s3://{self.s3_bucket}/{dir_name}/{year}.pdf"
+
+    def analyze(self, year, source, job_id=None, on_job=None):
+        tables = self.text_layer_tables(year, source)
+        if tables is not None:
+            return None, tables
+
+        # The job state file lives next to the outputs: derived/<dir>/
+        dir_name = source.split('/')[-2]
+        run = self.get_run(PROJECT_ROOT / "derived" / dir_name)
+        return run, asyncio.run(run.analyze(year, source, job_id, on_job))
+
+    def export(self, result, year, excel_output_path):
+        run, job_id = result
+        if run is None:
+            # Tables read from the text layer; see text_layer_tables
+            return LocalBackend().export(job_id, year, excel_output_path)
+
+        n_tables = run.export(job_id, year, excel_output_path)
+        run.forget(year)
+        return n_tables
+
+    def extract_all(self, jobs, output_dir):
+        successful = []
+        failed = []
+
+        # Born-digital PDFs are read locally and never sent to Textract
+        remaining = {}
+        for year, source in jobs.items():
+            tables = self.text_layer_tables(year, source)
+            if tables is None:
+                remaining[year] = source
+                continue
+
+            try:
+                with span("export", stage="export", year=year):
+                    n_tables = self.export((None, tables), year, output_dir / f"{year}.xlsx")
+                print(f"Successfully exported {n_tables} tables to {output_dir / f'{year}.xlsx'}")
+                successful.append(year)
+            except Exception as e:
+                print(f"Error processing {year} PDF: {e}")
+                failed.append(year)
+
+        if remaining:
+            print(f"Processing {len(remaining)} PDFs with up to {self.max_concurrent} concurrent Textract jobs")
+            new_successful, new_failed = asyncio.run(self.get_run(output_dir).run(remaining))
+            successful.extend(new_successful)
+            failed.extend(new_failed)
+
+        return successful, failed
+
+    def text_layer_tables(self, year, source):
+        """
+        Read the tables of a PDF from its text layer if every page has one.
+
+        Uses the local copy of the uploaded PDF in data/annual-reports/.
+
+        Returns:
+            list: One table per page, or None if the PDF needs Textract
+        """
+        from text_layer import extract_pdf_text_tables, local_pdf_for
+
+        local_pdf = local_pdf_for(source)
+        if local_pdf is None:
+            return None
+
+        try:
+            with span("text_layer", year=year) as record:
+                record["bytes_in"] = local_pdf.stat().st_size
+                tables = extract_pdf_text_tables(local_pdf)
+        except Exception as e:
+            print(f"Could not read the text layer of {local_pdf.name}: {e}")
+            return None
+
+        if tables is not None:
+            print(f"Read {year} tables from the PDF text layer, skipping Textract")
+        return tables
+
+    def get_run(self, output_dir):
+        """Get the scheduler for jobs writing to output_dir, shared so they share one state file."""
+        with self._runs_lock:
+            if output_dir not in self._runs:
+                self._runs[output_dir] = TextractRun(
+                    self.extractor, output_dir,
+                    max_concurrent=self.max_concurrent, max_wait_time=self.max_wait_time
+                )
+            return self._runs[output_dir]
+
+BACKENDS = {backend.name: backend for backend in (TextractBackend, LocalBackend)}
+
+def get_backend(name, **options):
+    """
+    Create a table extraction backend by name.
+
+    Args:
+        name (str): One of the keys of BACKENDS
+        **options: Keyword arguments for the backend's constructor
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown table backend '{name}'; choose from {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
+
+def get_state_path(output_dir):
+    """Get the file recording in-flight Textract job IDs for an output directory."""
+    return output_dir / ".textract-jobs.json"
+
+def load_job_state(state_path):
+    """Load the in-flight job records, keyed by year/part."""
+    if not state_path.exists():
+        return {}
+
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+def save_job_state(state_path, state):
+    """Persist the in-flight job records, replacing the file atomically."""
+    temp_path = state_path.with_suffix(".tmp")
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    temp_path.replace(state_path)
+
+class TextractRun:
+    """
+    Submit-all-then-harvest scheduler for Textract document analysis.
+
+    Jobs are started as soon as a slot under the concurrency cap is free,
+    their IDs are written to a state file, and all in-flight jobs are
+    polled together on one event loop. Jobs found in the state file from
+    an interrupted run are re-attached instead of being started again.
+    """
+
+    def __init__(self, extractor, output_dir, max_concurrent=DEFAULT_MAX_CONCURRENT, max_wait_time=900):
+        self.extractor = extractor
+        self.output_dir = output_dir
+        self.max_wait_time = max_wait_time
+        self.state_path = get_state_path(output_dir)
+        self.state = load_job_state(self.state_path)
+        self.max_concurrent = max_concurrent
+        self.table_counts = {}
+
+        # The state file is shared by event loops in different threads when
+        # jobs are analyzed one at a time (see TextractBackend.analyze)
+        self.state_lock = threading.Lock()
+
+    async def run(self, jobs):
+        """
+        Process every job and wait for all of them.
+
+        Args:
+            jobs (dict): year/part -> S3 URI of the PDF
+
+        Returns:
+            tuple: (successful, failed) lists of year/part names
+        """
+        # Created here so it belongs to the running event loop
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        results = await asyncio.gather(*(self.process(year, s3_uri) for year, s3_uri in jobs.items()))
+
+        successful = [year for year, ok in zip(jobs, results) if ok]
+        failed = [year for year, ok in zip(jobs, results) if not ok]
+        return successful, failed
+
+    async def process(self, year, s3_uri):
+        """Start (or re-attach to) the job for one PDF, wait for it and export its tables."""
+        excel_output_path = self.output_dir / f"{year}.xlsx"
+
+        async with self.slots:
+            try:
+                with span("textract_job", stage="analyze", year=year, cpu=False):
+                    job_id = await self.analyze(year, s3_uri)
+
+                print(f"Job for {year} completed, exporting tables to Excel...")
+                n_tables = await asyncio.to_thread(traced(self.export, "export", stage="export", year=year),
+                                                   job_id, year, excel_output_path)
+                print(f"Successfully exported {n_tables} tables to {excel_output_path}")
+
+                self.table_counts[year] = n_tables
+                self.forget(year)
+                return True
+
+            except Exception as e:
+                print(f"Error processing {year} PDF: {e}")
+                return False
+
+    async def analyze(self, year, s3_uri, job_id=None, on_job=None):
+        """
+        Start (or re-attach to) the job for one PDF and wait for it to succeed.
+
+        Args:
+            year (str): Year/part of the PDF
+            s3_uri (str): S3 URI of the PDF
+            job_id (str): Job to re-attach to when the state file has none,
+                e.g. one recorded by the job queue on another machine
+            on_job (callable): Called with the job ID once the job is started
+                or re-attached, and with None if it failed
+
+        Returns:
+            str: ID of the finished job
+
+        Raises:
+            Exception: If the job fails or times out
+        """
+        record = self.state.get(year)
+        if record and record["s3_uri"] == s3_uri:
+            print(f"Re-attaching to Textract job {record['job_id']} for {year}")
+        elif job_id:
+            print(f"Re-attaching to Textract job {job_id} for {year}")
+            record = {"job_id": job_id, "s3_uri": s3_uri, "submitted": time.time()}
+            with self.state_lock:
+                self.state[year] = record
+                save_job_state(self.state_path, self.state)
+        else:
+            record = await self.submit(year, s3_uri)
+
+        if on_job:
+            on_job(record["job_id"])
+        status = await self.wait(year, record["job_id"])
+
+        if status == "EXPIRED":
+            # Results are only kept for a limited time; start over
+            record = await self.submit(year, s3_uri)
+            if on_job:
+                on_job(record["job_id"])
+            status = await self.wait(year, record["job_id"])
+
+        if status != "SUCCEEDED":
+            if on_job and status != "TIMED_OUT":
+                on_job(None)  # a timed-out job is still running and can be resumed
+            raise Exception(f"Textract job failed with status: {status}")
+
+        return record["job_id"]
+
+    async def submit(self, year, s3_uri):
+        """Start a Textract analysis job and record its ID in the state file."""
+        from textractor.data.constants import TextractFeatures
+
+        print(f"Starting Textract analysis on {s3_uri}")
+        job = await asyncio.to_thread(
+            traced(self.extractor.start_document_analysis, "textract_start", year=year),
+            file_source=s3_uri,
+            features=[TextractFeatures.TABLES, TextractFeatures.FORMS],
+            save_image=False
+        )
+
+        record = {"job_id": job.job_id, "s3_uri": s3_uri, "submitted": time.time()}
+        with self.state_lock:
+            self.state[year] = record
+            save_job_state(self.state_path, self.state)
+        return record
+
+    async def wait(self, year, job_id):
+        """
+        Poll a job with adaptive backoff until it finishes or times out.
+
+        Returns:
+            str: Final job status, 'EXPIRED' if Textract no longer knows the job,
+                or 'TIMED_OUT'
+        """
+        waited = 0
+        poll_interval = INITIAL_POLL_INTERVAL
+        client = self.extractor.textract_client
+
+        while True:
+            try:
+                response = await asyncio.to_thread(traced(client.get_document_analysis, "textract_poll", year=year),
+                                                   JobId=job_id, MaxResults=1)
+            except client.exceptions.InvalidJobIdException:
+                return "EXPIRED"
+
+            status = response["JobStatus"]
+            if status != "IN_PROGRESS":
+                if status in ["FAILED", "ERROR"]:
+                    self.forget(year)  # start a fresh job next run
+                return status
+
+            if waited >= self.max_wait_time:
+                # Keep the job ID so the next run can pick it up again
+                print(f"Textract job for {year} timed out after {waited:.0f}s; will resume next run")
+                return "TIMED_OUT"
+
+            await asyncio.sleep(poll_interval)
+            waited += poll_interval
+            poll_interval = min(poll_interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+    def export(self, job_id, year, excel_output_path):
+        """Fetch a finished job's results and export its tables to Excel."""
+        from textractor.data.constants import TextractAPI
+        from textractor.entities.lazy_document import LazyDocument
+
+        with span("textract_fetch", year=year):
+            document = LazyDocument(job_id, TextractAPI.ANALYZE, textract_client=self.extractor.textract_client)
+            document.tables  # results are fetched on first access
+
+        # Check if tables were extracted
+        if not document.tables:
+            print(f"Warning: No tables found in {year} PDF")
+
+        # A combined multi-page table comes back as one table per page
+        if len({table.page for table in document.tables}) > 1:
+            from local_tables import export_tables_to_excel, stitch_tables
+
+            tables = [table.to_pandas(use_columns=False).fillna("").astype(str).values.tolist()
+                      for table in document.tables]
+            stitched, others = stitch_tables(tables, match_columns=True)
+            export_tables_to_excel([stitched] + others, excel_output_path)
+            return 1 + len(others)
+
+        document.export_tables_to_excel(excel_output_path)
+        return len(document.tables)
+
+    def forget(self, year):
+        """Drop a job from the state file."""
+        with self.state_lock:
+            if self.state.pop(year, None) is not None:
+                save_job_state(self.state_path, self.state)
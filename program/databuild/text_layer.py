@@ -0,0 +1,173 @@
+from pathlib import Path
+import math
+import re
+
+from pypdf import PdfReader
+
+# A page needs at least this many non-space characters, mostly letters and
+# digits, for its text layer to stand in for OCR
+MIN_TEXT_CHARS = 200
+MIN_ALNUM_SHARE = 0.6
+
+# Average glyph width as a share of the font size, for estimating word widths
+GLYPH_WIDTH = 0.5
+
+def page_text(page):
+    """Get the text layer of a pypdf page, or '' if it has none or cannot be read."""
+    try:
+        return page.extract_text() or ""
+    except Exception:
+        return ""
+
+def page_text_orientation(page):
+    """
+    Get the text layer of a pypdf page and the rotation that makes its text upright.
+
+    Each run of text votes, by its length, for the direction its baseline
+    runs in on the page as displayed: the text matrix and the current
+    transformation give the direction in user space, and the page's
+    /Rotate turns it clockwise. The winning direction is snapped to a
+    multiple of 90 degrees.
+
+    Args:
+        page: pypdf page
+
+    Returns:
+        tuple: (text, counter-clockwise orientation as in the crosswalks, or
+            None if the page has no text)
+    """
+    rotation = page.rotation % 360
+    votes = {}
+
+    def visit(text, cm, tm, font_dict, font_size):
+        n_chars = len(text.strip())
+        if not n_chars:
+            return
+
+        # Baseline direction in user space: text matrix x axis through the CTM
+        dx = tm[0] * cm[0] + tm[1] * cm[2]
+        dy = tm[0] * cm[1] + tm[1] * cm[3]
+        if not dx and not dy:
+            return
+
+        angle = round(math.degrees(math.atan2(dy, dx)) / 90) * 90
+        orientation = (rotation - angle) % 360
+        votes[orientation] = votes.get(orientation, 0) + n_chars
+
+    try:
+        text = page.extract_text(visitor_text=visit) or ""
+    except Exception:
+        return "", None
+
+    return text, max(votes, key=votes.get) if votes else None
+
+def has_text_layer(page=None, text=None):
+    """
+    Check whether a page has a text layer good enough to skip OCR.
+
+    Scanned pages have no text or only a few stray characters; born-digital
+    pages (and scans with an embedded OCR layer) have the whole table.
+
+    Args:
+        page: pypdf page, read if text is not given
+        text (str): Already extracted text of the page
+    """
+    if text is None:
+        text = page_text(page)
+
+    chars = re.sub(r"\s", "", text)
+    if len(chars) < MIN_TEXT_CHARS:
+        return False
+
+    return sum(char.isalnum() for char in chars) / len(chars) >= MIN_ALNUM_SHARE
+
+def _upright(x, y, width, height, rotation):
+    """Map a point from PDF user space (origin bottom left) to top-down coordinates of the displayed page."""
+    if rotation == 90:
+        return y, x
+    if rotation == 180:
+        return width - x, y
+    if rotation == 270:
+        return height - y, width - x
+    return x, height - y
+
+def page_words(page):
+    """
+    Read positioned words from a page's content stream.
+
+    Positions are in points on the page as displayed, i.e. after its
+    /Rotate, with the same keys as local_tables.ocr_words so the words can
+    go straight to local_tables.words_to_table. Word widths are estimated
+    from the font size.
+
+    Args:
+        page: pypdf page
+
+    Returns:
+        list: Word dicts with text, left, top, width and height
+    """
+    box = page.mediabox
+    page_width, page_height = float(box.width), float(box.height)
+    rotation = page.rotation % 360
+    words = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        if not text.strip():
+            return
+
+        # Text space -> user space: text matrix, then current transformation matrix
+        x = cm[0] * tm[4] + cm[2] * tm[5] + cm[4] - float(box.left)
+        y = cm[1] * tm[4] + cm[3] * tm[5] + cm[5] - float(box.bottom)
+        scale = (tm[0] ** 2 + tm[1] ** 2) ** 0.5 * (cm[0] ** 2 + cm[1] ** 2) ** 0.5
+        size = (font_size or 1) * (scale or 1)
+        left, baseline = _upright(x, y, page_width, page_height, rotation)
+
+        for match in re.finditer(r"\S+", text):
+            words.append({
+                "text": match.group(),
+                "left": left + match.start() * size * GLYPH_WIDTH,
+                "top": baseline - size,
+                "width": len(match.group()) * size * GLYPH_WIDTH,
+                "height": size,
+            })
+
+    try:
+        page.extract_text(visitor_text=visit)
+    except Exception:
+        return []
+
+    return words
+
+def extract_pdf_text_tables(pdf_path):
+    """
+    Extract one table per page from the text layer of a PDF, without any OCR.
+
+    Returns:
+        list: One table per page, or None if any page lacks a usable text layer
+    """
+    from local_tables import words_to_table
+
+    tables = []
+    for page in PdfReader(pdf_path).pages:
+        if not has_text_layer(page):
+            return None
+        tables.append(words_to_table(page_words(page)))
+
+    return tables
+
+def local_pdf_for(source):
+    """
+    Get the local copy of a table PDF given as a local path or an S3 URI.
+
+    S3 sources mirror the extracted page PDFs in data/annual-reports/<dir>/.
+
+    Returns:
+        Path: Local PDF, or None if there is no local copy
+    """
+    local_pdf = Path(source)
+    if not local_pdf.exists():
+        project_root = Path(__file__).resolve().parent.parent.parent
+        _, _, key = str(source).partition("://")[2].partition("/")
+        local_pdf = project_root / "data" / "annual-reports" / key
+
+    return local_pdf if local_pdf.is_file() else None
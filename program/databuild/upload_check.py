@@ -1,110 +1,233 @@
 from pathlib import Path
 import boto3
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import hashlib
 import os
 import time
 import sys
 
-def upload_pdfs(dir_name):
+from instrument import print_report, span, start_run
+
+DEFAULT_BUCKET = "colorado-data-bucket"
+
+# Files at or above this size are uploaded in parts of this size. The local
+# ETag calculation below must use the same value to match S3's ETags.
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNKSIZE,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=4,
+    use_threads=True
+)
+
+def get_s3_client(endpoint_url=None):
+    """
+    Create an S3 client.
+
+    Args:
+        endpoint_url (str): S3-compatible endpoint to use instead of AWS, e.g. a
+            local MinIO or moto server. Defaults to the S3_ENDPOINT_URL environment variable.
+    """
+    return boto3.client('s3', endpoint_url=endpoint_url or os.environ.get("S3_ENDPOINT_URL"))
+
+def list_objects(s3_client, s3_bucket, prefix):
+    """
+    Index every object under a prefix with one paginated listing.
+
+    Returns:
+        dict: S3 key -> {"etag": ETag without quotes, "size": size in bytes}
+    """
+    index = {}
+    with span("s3_list", prefix=prefix):
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                index[obj['Key']] = {"etag": obj['ETag'].strip('"'), "size": obj['Size']}
+
+    return index
+
+def object_etag(s3_client, s3_bucket, s3_key):
+    """Get the ETag (without quotes) of one S3 object, or None if it does not exist."""
+    from botocore.exceptions import ClientError
+
+    try:
+        return s3_client.head_object(Bucket=s3_bucket, Key=s3_key)['ETag'].strip('"')
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+def local_etag(path, chunksize=MULTIPART_CHUNKSIZE):
+    """
+    Compute the ETag S3 assigns to a file uploaded with TRANSFER_CONFIG.
+
+    Single-part uploads get the MD5 of the content; multipart uploads get
+    the MD5 of the concatenated part MD5s followed by '-<number of parts>'.
+    """
+    part_digests = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b""):
+            part_digests.append(hashlib.md5(chunk).digest())
+
+    if len(part_digests) <= 1 and Path(path).stat().st_size < chunksize:
+        return part_digests[0].hex() if part_digests else hashlib.md5(b"").hexdigest()
+
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+def upload_file(s3_client, pdf_path, s3_bucket, s3_key, max_retries=3, retry_delay=2):
+    """
+    Upload a file, retrying with exponential backoff.
+
+    Raises:
+        Exception: The last upload error if every attempt fails
+    """
+    for attempt in range(max_retries):
+        try:
+            with span("s3_upload", stage="upload", year=Path(pdf_path).stem, attempt=attempt + 1) as record:
+                s3_client.upload_file(str(pdf_path), s3_bucket, s3_key, Config=TRANSFER_CONFIG)
+                record["bytes_out"] = Path(pdf_path).stat().st_size
+            return
+        except Exception as upload_error:
+            if attempt < max_retries - 1:
+                print(f"Upload attempt {attempt+1} for {pdf_path.name} failed: {upload_error}")
+                print(f"Retrying in {retry_delay} seconds...")
+                time.sleep(retry_delay)
+                retry_delay *= 2  # Exponential backoff
+            else:
+                print(f"All upload attempts failed for {pdf_path.name}")
+                raise
+
+def is_unchanged(pdf_path, existing):
+    """
+    Check whether a local file matches an object from list_objects.
+
+    Args:
+        pdf_path (Path): Local file
+        existing (dict): Index entry for its S3 key, or None if the key is missing
+    """
+    return (existing is not None and existing["size"] == pdf_path.stat().st_size
+            and existing["etag"] == local_etag(pdf_path))
+
+def sync_file(s3_client, pdf_path, s3_bucket, s3_key, index):
+    """
+    Upload one file unless S3 already has the same content.
+
+    Args:
+        s3_client: boto3 S3 client
+        pdf_path (Path): Local file
+        s3_bucket (str): Name of the S3 bucket
+        s3_key (str): Destination key
+        index (dict): Listing from list_objects covering s3_key; updated with
+            the uploaded object's ETag and size
+
+    Returns:
+        str: 'uploaded' or 'unchanged'
+    """
+    if is_unchanged(pdf_path, index.get(s3_key)):
+        return "unchanged"
+
+    upload_file(s3_client, pdf_path, s3_bucket, s3_key)
+    index[s3_key] = {"etag": local_etag(pdf_path), "size": pdf_path.stat().st_size}
+    return "uploaded"
+
+def upload_pdfs(dir_name, s3_bucket=DEFAULT_BUCKET, workers=8, endpoint_url=None):
     """
-    Upload PDFs to S3 bucket.
-    
+    Upload PDFs to S3 bucket, skipping files whose content is already there.
+
+    The prefix is listed once up front; files whose size and ETag match the
+    listing are skipped and the rest are uploaded on a thread pool.
+
     Args:
         dir_name (str): Name of the directory containing PDFs to upload
+        s3_bucket (str): Name of the S3 bucket
+        workers (int): Number of files to upload concurrently
+        endpoint_url (str): S3-compatible endpoint to use instead of AWS
+
+    Returns:
+        dict: Lists of file names under "uploaded", "unchanged" and "failed"
     """
     project_root = Path(__file__).resolve().parent.parent.parent
     target_dir = project_root / "data" / "annual-reports" / dir_name
-    
+
     # Create directory if it doesn't exist
     target_dir.mkdir(exist_ok=True, parents=True)
-    
-    s3_bucket = "colorado-data-bucket"
-    s3_client = boto3.client('s3')
-    
+
+    start_run()
+    s3_client = get_s3_client(endpoint_url)
+    summary = {"uploaded": [], "unchanged": [], "failed": []}
+
     # Get list of all PDFs
-    pdf_files = list(target_dir.glob("*.pdf"))
-    
+    pdf_files = sorted(target_dir.glob("*.pdf"))
+
     if not pdf_files:
         print(f"No PDFs found in {target_dir}")
-        return
-    
+        return summary
+
     print(f"Found {len(pdf_files)} PDFs in {dir_name}")
-    
-    # Track successful and failed uploads
-    successful = []
-    failed = []
-    
+
+    try:
+        index = list_objects(s3_client, s3_bucket, f"{dir_name}/")
+    except Exception as e:
+        print(f"Error listing objects in S3 bucket: {e}")
+        return summary
+
+    print(f"Found {len(index)} objects in {s3_bucket}/{dir_name}/")
+
+    # Only upload files that are missing or whose content changed
+    to_upload = []
     for pdf_path in pdf_files:
-        year = pdf_path.stem  # Get the year from the filename
-        s3_key = f"{dir_name}/{year}.pdf"
-        s3_uri = f"s3://{s3_bucket}/{s3_key}"
-        
-        try:
-            # Check if file already exists
+        s3_key = f"{dir_name}/{pdf_path.name}"
+        if is_unchanged(pdf_path, index.get(s3_key)):
+            summary["unchanged"].append(pdf_path.name)
+        else:
+            to_upload.append((pdf_path, s3_key))
+
+    print(f"{len(summary['unchanged'])} PDFs unchanged, uploading {len(to_upload)} with {workers} worker(s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(upload_file, s3_client, pdf_path, s3_bucket, s3_key): (pdf_path, s3_key)
+            for pdf_path, s3_key in to_upload
+        }
+        for future in as_completed(futures):
+            pdf_path, s3_key = futures[future]
             try:
-                s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
-                print(f"PDF already exists at {s3_uri}")
-                successful.append(year)
-            except ClientError as e:
-                if e.response['Error']['Code'] == '404':
-                    # File doesn't exist, upload it
-                    print(f"Uploading {pdf_path.name} to S3 bucket {s3_bucket}")
-                    
-                    # Implement retry logic
-                    max_retries = 3
-                    retry_delay = 2
-                    
-                    for attempt in range(max_retries):
-                        try:
-                            s3_client.upload_file(str(pdf_path), s3_bucket, s3_key)
-                            print(f"PDF uploaded to {s3_uri}")
-                            successful.append(year)
-                            break
-                        except Exception as upload_error:
-                            if attempt < max_retries - 1:
-                                print(f"Upload attempt {attempt+1} failed: {upload_error}")
-                                print(f"Retrying in {retry_delay} seconds...")
-                                time.sleep(retry_delay)
-                                retry_delay *= 2  # Exponential backoff
-                            else:
-                                print(f"All upload attempts failed for {pdf_path.name}")
-                                failed.append(year)
-                                raise
-                else:
-                    print(f"Error checking if file exists: {e}")
-                    failed.append(year)
-        except Exception as e:
-            print(f"Error processing {pdf_path.name}: {e}")
-            failed.append(year)
-    
+                future.result()
+                print(f"PDF uploaded to s3://{s3_bucket}/{s3_key}")
+                summary["uploaded"].append(pdf_path.name)
+            except Exception as e:
+                print(f"Error uploading {pdf_path.name}: {e}")
+                summary["failed"].append(pdf_path.name)
+
     # Print summary
     print("\nUpload Summary:")
-    print(f"Successfully uploaded/verified: {len(successful)} files")
-    print(f"Failed: {len(failed)} files")
-    
-    if failed:
+    print(f"Uploaded: {len(summary['uploaded'])} files")
+    print(f"Already up to date: {len(summary['unchanged'])} files")
+    print(f"Failed: {len(summary['failed'])} files")
+
+    if summary["failed"]:
         print("Failed files:")
-        for year in failed:
-            print(f"  - {year}.pdf")
-    
-    # List objects in bucket
-    try:
-        response = s3_client.list_objects_v2(Bucket=s3_bucket, Prefix=f"{dir_name}/")
-        print(f"\nObjects in {s3_bucket}/{dir_name}/:")
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                print(f"  {obj['Key']} ({obj['Size']} bytes)")
-        else:
-            print("  No objects found")
-    except Exception as e:
-        print(f"Error listing objects: {e}")
+        for name in sorted(summary["failed"]):
+            print(f"  - {name}")
+
+    print_report()
+    return summary
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python upload_check.py <directory_name>")
-        print("Example: python upload_check.py mill-levy")
-        print("Directory name should refer to a subfolder in the data/ directory")
+    parser = argparse.ArgumentParser(
+        description="Upload extracted table PDFs in data/annual-reports/<directory_name> to S3.",
+        epilog="Example: python upload_check.py mill-levies --workers 16"
+    )
+    parser.add_argument("dir_name", help="Subfolder of data/annual-reports/, also used as the S3 prefix")
+    parser.add_argument("--bucket", default=DEFAULT_BUCKET, help=f"S3 bucket (default: {DEFAULT_BUCKET})")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent uploads (default: 8)")
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint, e.g. http://localhost:9000 for MinIO")
+    args = parser.parse_args()
+
+    summary = upload_pdfs(args.dir_name, s3_bucket=args.bucket, workers=args.workers,
+                          endpoint_url=args.endpoint_url)
+    if summary["failed"]:
         sys.exit(1)
-    
-    dir_name = sys.argv[1]
-    upload_pdfs(dir_name)
@@ -0,0 +1,236 @@
+from pathlib import Path
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+PANEL_PATH = PROJECT_ROOT / "derived" / "panel.parquet"
+REPORT_PATH = PROJECT_ROOT / "derived" / "validation-report.json"
+
+# How each panel column is written in the reports: dollar amounts are whole
+# numbers, so any ',' or '.' in them is a thousands separator; levies are
+# mills with up to three decimals
+COLUMN_KINDS = {
+    "assessed_valuation": "amount",
+    "total_revenue": "amount",
+    "county_mill_levy": "levy",
+    "total_levy": "levy",
+    "assessed_resi": "amount",
+    "assessed_total": "amount",
+}
+
+# Letters OCR reads in place of digits
+OCR_LETTERS = str.maketrans({"O": "0", "o": "0", "D": "0", "l": "1", "I": "1", "i": "1", "|": "1",
+                             "S": "5", "s": "5", "B": "8"})
+
+# Historical bounds on levies, in mills
+LEVY_RANGES = {"county_mill_levy": (0, 50), "total_levy": (20, 250)}
+
+# Relative tolerance for revenue = valuation x levy and for agreement between the two tables
+REVENUE_TOLERANCE = 0.01
+VALUATION_TOLERANCE = 0.01
+
+# Year-over-year change in valuations, in percent, that suggests an OCR or unit error
+YOY_THRESHOLD = 50
+
+def parse_numeric(values, kind="amount"):
+    """
+    Parse a column of OCR'd numeric cells.
+
+    Handles dollar signs and footnote marks, trailing junk after the first
+    token, trailing separators ('25.043.'), letters read in place of digits
+    within a number ('l,234,5O6', but not a lone 'S'), parenthesized
+    negatives and, for levies, a comma read in place of the decimal point.
+
+    Args:
+        values (pd.Series): Raw cell values (strings, numbers or None)
+        kind (str): 'amount' for whole-dollar values or 'levy' for mill levies
+
+    Returns:
+        pd.Series: float64 values, NaN where a cell is empty or not a number
+    """
+    text = values.astype("string").str.strip()
+    negative = text.str.startswith("(").fillna(False).to_numpy(dtype=bool)
+
+    text = text.str.replace(r"[()$#*]", "", regex=True).str.strip()
+    text = text.str.extract(r"^(\S*)", expand=False).str.rstrip(".,")
+
+    # Letters only stand in for digits in a token that has real digits: 'S' alone is not 5
+    has_digit = text.str.contains(r"\d", regex=True).fillna(False).to_numpy(dtype=bool)
+    text = text.where(~has_digit, text.str.translate(OCR_LETTERS))
+
+    if kind == "levy":
+        # Keep only the last separator as the decimal point
+        text = text.str.replace(r"[.,](?=.*[.,])", "", regex=True).str.replace(",", ".", regex=False)
+    else:
+        text = text.str.replace(r"[.,]", "", regex=True)
+
+    numbers = pd.to_numeric(text, errors="coerce").astype("float64")
+    numbers = numbers.where(~negative, -numbers)
+
+    # Cells the workbook already stores as numbers are used as they are
+    stored = pd.to_numeric(values.where(values.map(type) != str), errors="coerce").astype("float64")
+    return stored.where(stored.notna(), numbers)
+
+def expected_counties(years):
+    """Number of counties in each year: 63 until Broomfield County first appears in the 2001 report, then 64."""
+    return np.where(years >= 2001, 64, 63)
+
+def _violations(panel, mask, rule, column, message, expected=None):
+    """Collect the rows of panel flagged by a boolean mask as violation records."""
+    flagged = panel.loc[mask, ["countyfp", "county", "year"]].copy()
+    flagged["rule"] = rule
+    flagged["column"] = column
+    flagged["value"] = panel.loc[mask, column] if column in panel else None
+    flagged["expected"] = expected[mask] if expected is not None else None
+    flagged["message"] = message
+    return flagged
+
+def check_panel(panel):
+    """
+    Run every validation rule over the whole panel at once.
+
+    Args:
+        panel (pd.DataFrame): Panel with countyfp, county, year and the COLUMN_KINDS columns
+
+    Returns:
+        pd.DataFrame: One row per violation with rule, countyfp, county, year,
+            column, value, expected and message
+    """
+    panel = panel.sort_values(["countyfp", "year"]).reset_index(drop=True)
+    results = []
+
+    # Unique county-years
+    mask = panel.duplicated(["countyfp", "year"], keep=False)
+    results.append(_violations(panel, mask, "duplicate_key", "countyfp", "County-year appears more than once"))
+
+    # Missing cells, in years where the column was reported at all
+    for column in COLUMN_KINDS:
+        if column not in panel:
+            continue
+        reported = panel.groupby("year")[column].transform("count") > 0
+        mask = reported & panel[column].isna()
+        results.append(_violations(panel, mask, "missing_value", column, "Missing or unparseable value"))
+
+    # Counties per year, for each table
+    for column in ("county_mill_levy", "assessed_total"):
+        if column not in panel:
+            continue
+        counts = panel.groupby("year")[column].count()
+        counts = counts[counts > 0]
+        expected = expected_counties(counts.index.to_numpy())
+        for year, count, n in zip(counts.index, counts.to_numpy(), expected):
+            if count != n:
+                results.append(pd.DataFrame([{
+                    "countyfp": None, "county": None, "year": year, "rule": "county_count",
+                    "column": column, "value": count, "expected": n,
+                    "message": f"{count} counties with {column}, expected {n}",
+                }]))
+
+    # Levies within historical ranges
+    for column, (low, high) in LEVY_RANGES.items():
+        if column not in panel:
+            continue
+        mask = (panel[column] < low) | (panel[column] > high)
+        results.append(_violations(panel, mask, "levy_range", column, f"Outside {low}-{high} mills"))
+
+    # Residential valuation cannot exceed total valuation
+    if {"assessed_resi", "assessed_total"} <= set(panel.columns):
+        mask = panel["assessed_resi"] > panel["assessed_total"]
+        results.append(_violations(panel, mask, "resi_exceeds_total", "assessed_resi",
+                                   "Residential valuation exceeds total valuation", panel["assessed_total"]))
+
+    # Total revenue = assessed valuation x total levy / 1000
+    if {"total_revenue", "assessed_valuation", "total_levy"} <= set(panel.columns):
+        implied = panel["assessed_valuation"] * panel["total_levy"] / 1000
+        mask = (panel["total_revenue"] - implied).abs() > REVENUE_TOLERANCE * panel["total_revenue"].abs()
+        results.append(_violations(panel, mask, "revenue_identity", "total_revenue",
+                                   "Revenue differs from valuation x levy / 1000 by more than "
+                                   f"{REVENUE_TOLERANCE:.0%}", implied))
+
+    # Both tables report the same total assessed valuation
+    if {"assessed_valuation", "assessed_total"} <= set(panel.columns):
+        diff = (panel["assessed_valuation"] - panel["assessed_total"]).abs()
+        mask = diff > VALUATION_TOLERANCE * panel["assessed_valuation"].abs()
+        results.append(_violations(panel, mask, "valuation_mismatch", "assessed_total",
+                                   "Mill levy and county valuation tables differ by more than "
+                                   f"{VALUATION_TOLERANCE:.0%}", panel["assessed_valuation"]))
+
+    # Year-over-year swings in valuations, as in import-valuations.R
+    for column in ("assessed_resi", "assessed_total"):
+        if column not in panel:
+            continue
+        previous = panel.groupby("countyfp")[column].shift()
+        change = 100 * (panel[column] - previous) / previous
+        mask = change.notna() & ((change.abs() > YOY_THRESHOLD) | (change == 0))
+        results.append(_violations(panel, mask, "yoy_change", column,
+                                   f"Year-over-year change above {YOY_THRESHOLD}% or exactly 0", previous))
+
+    columns = ["rule", "countyfp", "county", "year", "column", "value", "expected", "message"]
+    results = [result for result in results if not result.empty]
+    if not results:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(results, ignore_index=True)[columns]
+
+def write_report(violations, panel_path, rows, path=REPORT_PATH):
+    """
+    Write the violations as JSON.
+
+    Returns:
+        dict: The report: panel path, row count, violation counts by rule and the violations
+    """
+    records = json.loads(violations.to_json(orient="records"))
+    report = {
+        "panel": str(panel_path),
+        "rows": rows,
+        "counts": violations["rule"].value_counts().sort_index().to_dict(),
+        "violations": records,
+    }
+
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+def validate(panel_path=PANEL_PATH, report_path=REPORT_PATH):
+    """
+    Validate the consolidated panel and write a violation report.
+
+    Args:
+        panel_path (Path): Panel written by consolidate.py
+        report_path (Path): Where to write the JSON report
+
+    Returns:
+        dict: The report
+    """
+    panel = pd.read_parquet(panel_path)
+    violations = check_panel(panel)
+    report = write_report(violations, panel_path, len(panel), report_path)
+
+    # Print summary
+    print("\nValidation Summary:")
+    print(f"Checked {len(panel)} county-years from {panel_path}")
+    if not report["counts"]:
+        print("No violations")
+    for rule, count in report["counts"].items():
+        print(f"  - {rule}: {count}")
+    print(f"Report written to {report_path}")
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the consolidated panel for OCR and consistency errors.")
+    parser.add_argument("--panel", type=Path, default=PANEL_PATH, help="Panel Parquet file")
+    parser.add_argument("--report", type=Path, default=REPORT_PATH, help="JSON violation report")
+    parser.add_argument("--strict", action="store_true", help="Exit with an error if there are any violations")
+    args = parser.parse_args()
+
+    report = validate(args.panel, args.report)
+    if args.strict and report["counts"]:
+        sys.exit(1)